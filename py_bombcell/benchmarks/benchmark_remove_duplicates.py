@@ -0,0 +1,214 @@
+"""
+Benchmarks quality_metrics.find_duplicate_spikes against the previous batched implementation.
+
+With bombcell installed (e.g. pip install -e .), run: python benchmarks/benchmark_remove_duplicates.py
+"""
+
+import numpy as np
+from numba import njit
+
+from bombcell.quality_metrics import find_duplicate_spikes
+
+
+@njit(cache=True)
+def _remove_duplicates_legacy(
+    batch_spike_times_samples,
+    batch_spike_clusters,
+    batch_template_amplitudes,
+    batch_spike_clusters_flat,
+    maxChannels,
+    duplicate_spike_window_samples,
+):
+    """
+    Previous batched duplicate spike detection, kept as the reference for benchmark_remove_duplicates.
+    This function uses batches of spike times and templates to find when spike overlap on the same channel:
+        will remove the lowest amplitude spike for a pair the same unit
+        will remove the most common spike of the batch if a pair of different units
+    Parameters
+    ----------
+    batch_spike_times_samples : ndarray
+        A batch of spike times in samples
+    batch_spike_clusters : ndarray
+        A batch of spike templates
+    batch_template_amplitudes : ndarray
+        A batch of spike template amplitudes
+    batch_spike_clusters_flat : ndarray
+        A batch of the flattened spike templates
+    maxChannels : ndarray
+        The max channel for each unit
+    duplicate_spike_window_samples : int
+        The length of time in samples which marks a pair of overlapping spike
+
+    Returns
+    -------
+    remove_idx : ndarray
+        An array which if 1 states that spike should be removed
+    """
+
+    num_spikes = batch_spike_times_samples.shape[0]
+    remove_idx = np.zeros(num_spikes)
+    # spike counts for the batch
+    unit_spike_counts = np.bincount(batch_spike_clusters)
+
+    # go through each spike in the batch
+    for spike_idx1 in range(num_spikes):
+        if remove_idx[spike_idx1] == 1:
+            continue
+
+        # go through each spike within +/- 25 idx's
+        for spike_idx2 in np.arange(spike_idx1 - 25, min(spike_idx1 + 25, num_spikes)):
+            # ignore self
+            if spike_idx1 == spike_idx2:
+                continue
+            if remove_idx[spike_idx2] == 1:
+                continue
+
+            if (
+                maxChannels[batch_spike_clusters_flat[spike_idx1]]
+                != maxChannels[batch_spike_clusters_flat[spike_idx2]]
+            ):
+                continue
+            # intra-unit removal
+            if batch_spike_clusters[spike_idx1] == batch_spike_clusters[spike_idx2]:
+                if (
+                    np.abs(
+                        batch_spike_times_samples[spike_idx1]
+                        - batch_spike_times_samples[spike_idx2]
+                    )
+                    <= duplicate_spike_window_samples
+                ):
+                    # keep higher amplitude spike
+                    if (
+                        batch_template_amplitudes[spike_idx1]
+                        < batch_template_amplitudes[spike_idx2]
+                    ):
+                        batch_spike_times_samples[spike_idx1] = np.nan
+                        remove_idx[spike_idx1] = 1
+                    else:
+                        batch_spike_times_samples[spike_idx2] = np.nan
+                        remove_idx[spike_idx2] = 1
+
+            # inter-unit removal
+            if batch_spike_clusters[spike_idx1] != batch_spike_clusters[spike_idx2]:
+                if (
+                    np.abs(
+                        batch_spike_times_samples[spike_idx1]
+                        - batch_spike_times_samples[spike_idx2]
+                    )
+                    <= duplicate_spike_window_samples
+                ):
+                    # keep spike from unit with less spikes
+                    if (
+                        unit_spike_counts[batch_spike_clusters[spike_idx1]]
+                        < unit_spike_counts[batch_spike_clusters[spike_idx2]]
+                    ):
+                        batch_spike_times_samples[spike_idx1] = np.nan
+                        remove_idx[spike_idx1] = 1
+                    else:
+                        batch_spike_times_samples[spike_idx2] = np.nan
+                        remove_idx[spike_idx2] = 1
+
+    return remove_idx
+
+
+def benchmark_remove_duplicates(n_spikes=1_000_000, n_units=300, n_channels=384, burst_size=40, seed=42):
+    """
+    Benchmarks find_duplicate_spikes against the previous batched implementation
+    (10000 spike batches, +/- 25 neighbouring spikes) on simulated spikes with injected duplicates
+
+    Parameters
+    ----------
+    n_spikes : int, optional
+        The number of simulated spikes, by default 1000000
+    n_units : int, optional
+        The number of simulated units, by default 300
+    n_channels : int, optional
+        The number of channels, by default 384
+    burst_size : int, optional
+        The number of spikes in a simulated burst of duplicates, by default 40
+    seed : int, optional
+        The random seed, by default 42
+
+    Returns
+    -------
+    results : dict
+        The runtimes of both implementations and the number of duplicates each found
+    """
+    import time
+
+    rng = np.random.default_rng(seed)
+    sample_rate = 30000
+    duplicate_spike_window_samples = 0.000034 * sample_rate
+    maxChannels = rng.integers(0, n_channels, n_units)
+
+    spike_times_samples = np.sort(rng.integers(0, n_spikes * 30, n_spikes))
+    spike_clusters = rng.integers(0, n_units, n_spikes)
+    template_amplitudes = rng.gamma(5, 4, n_spikes)
+
+    # inject duplicates: re-detected copies of spikes, and one long burst of copies
+    n_duplicates = n_spikes // 100
+    copied_spikes = rng.choice(n_spikes, n_duplicates, replace=False)
+    burst_spikes = np.full(burst_size, copied_spikes[0])
+    extra_spikes = np.concatenate((copied_spikes, burst_spikes))
+    spike_times_samples = np.concatenate((spike_times_samples, spike_times_samples[extra_spikes]))
+    spike_clusters = np.concatenate((spike_clusters, spike_clusters[extra_spikes]))
+    template_amplitudes = np.concatenate(
+        (template_amplitudes, template_amplitudes[extra_spikes] * rng.uniform(0.5, 1, extra_spikes.size))
+    )
+    spike_order = np.argsort(spike_times_samples, kind="stable")
+    spike_times_samples = spike_times_samples[spike_order].astype(np.uint64)
+    spike_clusters = spike_clusters[spike_order]
+    template_amplitudes = template_amplitudes[spike_order]
+
+    # compile both before timing
+    find_duplicate_spikes(
+        spike_times_samples[:100], spike_clusters[:100], template_amplitudes[:100],
+        maxChannels, duplicate_spike_window_samples,
+    )
+    _remove_duplicates_legacy(
+        spike_times_samples[:100].astype(np.float32), spike_clusters[:100], template_amplitudes[:100],
+        spike_clusters[:100].astype(np.int32), maxChannels, duplicate_spike_window_samples,
+    )
+
+    time_tmp = time.time()
+    duplicate_spike_idx = find_duplicate_spikes(
+        spike_times_samples, spike_clusters, template_amplitudes,
+        maxChannels, duplicate_spike_window_samples,
+    )
+    runtime_sweep = time.time() - time_tmp
+
+    time_tmp = time.time()
+    batch_size = 10000
+    overlap_size = 100
+    num_spikes_full = spike_times_samples.shape[0]
+    legacy_duplicate_spike_idx = np.zeros(num_spikes_full)
+    for start_idx in range(0, num_spikes_full, batch_size - overlap_size):
+        end_idx = min(start_idx + batch_size, num_spikes_full)
+        legacy_duplicate_spike_idx[start_idx:end_idx] = _remove_duplicates_legacy(
+            spike_times_samples[start_idx:end_idx].astype(np.float32),
+            spike_clusters[start_idx:end_idx],
+            template_amplitudes[start_idx:end_idx],
+            spike_clusters[start_idx:end_idx].astype(np.int32),
+            maxChannels,
+            duplicate_spike_window_samples,
+        )
+    runtime_legacy = time.time() - time_tmp
+
+    results = {
+        "n_spikes": num_spikes_full,
+        "n_injected_duplicates": extra_spikes.size,
+        "runtime_sweep": runtime_sweep,
+        "runtime_legacy": runtime_legacy,
+        "n_duplicates_sweep": int(np.sum(duplicate_spike_idx)),
+        "n_duplicates_legacy": int(np.sum(legacy_duplicate_spike_idx == 1)),
+    }
+    print(
+        f"Sorted sweep: {runtime_sweep:.3f} s, {results['n_duplicates_sweep']} duplicates\n"
+        f"Batched (previous): {runtime_legacy:.3f} s, {results['n_duplicates_legacy']} duplicates\n"
+        f"Injected duplicates: {results['n_injected_duplicates']} (of {num_spikes_full} spikes)"
+    )
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_remove_duplicates()
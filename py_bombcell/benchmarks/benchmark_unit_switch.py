@@ -0,0 +1,82 @@
+"""
+Benchmarks switching units in the unit quality GUI for each render mode: the time from a unit's
+(cached) data to its rendered figure, to keep track of the GUI latency.
+
+With bombcell installed (e.g. pip install -e .), run on saved bombcell results:
+python benchmarks/benchmark_unit_switch.py <kilosort directory> <bombcell save path>
+"""
+
+import sys
+import time
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from bombcell.loading_utils import load_bc_results
+from bombcell.unit_quality_gui import unit_quality_gui
+
+
+def benchmark_unit_switch(gui, n_switches=10, render_modes=('rebuild', 'persistent')):
+    """
+    Benchmarks switching units in the GUI for each render mode: the time from a unit's (cached) data
+    to its rendered figure, to keep track of the GUI latency
+
+    Parameters
+    ----------
+    gui : InteractiveUnitQualityGUI
+        The GUI to benchmark, its current unit and render mode are restored afterwards
+    n_switches : int, optional
+        The number of unit switches timed per render mode, by default 10
+    render_modes : tuple, optional
+        The render modes to benchmark, by default ('rebuild', 'persistent')
+
+    Returns
+    -------
+    ms_per_switch : dict
+        The mean time of a unit switch in ms, for each render mode
+    """
+    unit_idxs = np.arange(n_switches + 1) % gui.n_units
+    current_unit_idx, render_mode = gui.current_unit_idx, gui.render_mode
+
+    # only time the rendering, the unit data are prepared beforehand
+    for unit_idx in unit_idxs:
+        unit_data = gui.get_unit_data(unit_idx)
+        if gui.param and 'ephys_sample_rate' in gui.param:
+            gui.get_unit_acg(unit_data)
+
+    ms_per_switch = {}
+    for mode in render_modes:
+        gui.render_mode = mode
+        gui._close_persistent_figure()
+        switch_times = []
+        for switch_idx, unit_idx in enumerate(unit_idxs):
+            gui.current_unit_idx = unit_idx
+            unit_data = gui.get_unit_data(unit_idx)
+            time_tmp = time.time()
+            if mode == 'persistent':
+                gui._plot_unit_persistent(unit_data)
+                gui._draw_persistent_figure()
+            else:
+                fig = gui._plot_unit_landscape(unit_data)
+                fig.canvas.draw()
+                plt.close(fig)
+            # the first unit builds the persistent figure
+            if switch_idx > 0:
+                switch_times.append(time.time() - time_tmp)
+        gui._close_persistent_figure()
+        ms_per_switch[mode] = 1000 * np.mean(switch_times)
+        print(f"{mode} render mode: {ms_per_switch[mode]:.0f} ms per unit switch")
+
+    gui.current_unit_idx, gui.render_mode = current_unit_idx, render_mode
+    return ms_per_switch
+
+
+if __name__ == "__main__":
+    ks_dir, save_path = sys.argv[1:3]
+    param, quality_metrics, _ = load_bc_results(save_path)
+    gui = unit_quality_gui(ks_dir, quality_metrics=quality_metrics, param=param, save_path=save_path)
+    benchmark_unit_switch(gui)
@@ -3,6 +3,7 @@ Fast cross-correlogram functions.
 """
 
 import numpy as np
+from numba import njit, prange
 from bombcell.save_utils import global_bc_cacher
 
 
@@ -325,11 +326,141 @@ def crosscorrelate(spike_times,
     return correlograms
 
 
-def ccg_bz(times, groups=None, bin_size=0.001, duration=2.0, fs=1/20000, norm='counts'):
+def compute_acg_store(spike_times, unit_starts, unit_stops, bin_configs, fs=30000):
+    """
+    Compute the auto-correlograms of all units for several (bin, window) configurations, in one
+    compiled pass over each unit's spike train, with units processed in parallel.
+    Same binning as acg() (crosscorrelate), for each configuration.
+
+    Parameters:
+    -----------
+    spike_times : (n_spikes,) array of non-negative integers
+        Spike times of all units, in SAMPLES, grouped by unit (e.g. ordered as in
+        loading_utils.get_spike_index). Spikes are sorted by time within each unit if needed.
+    unit_starts, unit_stops : (n_units,) arrays of integers
+        The slice of spike_times holding each unit's spikes.
+    bin_configs : list of (float, float) tuples
+        The (bin size, window size) configurations to compute, in milliseconds.
+    fs : int, optional
+        Sampling frequency in Hz. Default is 30000 Hz.
+
+    Returns:
+    --------
+    acg_store : dict
+        'acgs': {(cbin, cwin): (n_units, n_bins) int32 array} of auto-correlogram counts, one row per unit
+        'n_spikes': (n_units,) array of the number of spikes of each unit, used for normalization
+        'fs': the sampling frequency
+        Units with less than two spikes have empty (all zero) auto-correlograms.
+    """
+    assert fs > 0, "Sampling frequency must be positive."
+    spike_times = np.asarray(spike_times, dtype=np.int64)
+    unit_starts = np.asarray(unit_starts, dtype=np.int64)
+    unit_stops = np.asarray(unit_stops, dtype=np.int64)
+    bin_configs = [(float(cbin), float(cwin)) for cbin, cwin in bin_configs]
+
+    # same conversion of bin and window sizes to samples as crosscorrelate
+    samples_per_bin = np.zeros(len(bin_configs), dtype=np.int64)
+    half_bins = np.zeros(len(bin_configs), dtype=np.int64)
+    for c, (cbin, cwin) in enumerate(bin_configs):
+        assert cbin > 0 and cwin > 0, "Bin and window sizes must be positive."
+        bin_size = np.clip(cbin, 1000 * 1. / fs, 1e8)
+        win_size = np.clip(cwin, 1e-2, 1e8)
+        half_bins[c] = int(.5 * win_size * 1. / bin_size)
+        samples_per_bin[c] = int(np.ceil(fs * bin_size * 1. / 1000))
+    # each configuration's half auto-correlogram, side by side in one row per unit
+    config_offsets = np.concatenate([[0], np.cumsum(half_bins + 1)]).astype(np.int64)
+
+    half_counts = _acg_store_numba(spike_times, unit_starts, unit_stops,
+                                   samples_per_bin, half_bins, config_offsets)
+
+    acgs = {}
+    for c, config in enumerate(bin_configs):
+        counts = half_counts[:, config_offsets[c]:config_offsets[c + 1]]
+        # remove ACG values at 0 and symmetrize, as in crosscorrelate
+        counts[:, 0] = 0
+        acgs[config] = np.hstack((counts[:, 1:][:, ::-1], counts))
+
+    return {
+        'acgs': acgs,
+        'n_spikes': unit_stops - unit_starts,
+        'fs': fs,
+    }
+
+
+@njit(parallel=True, cache=True)
+def _acg_store_numba(spike_times, unit_starts, unit_stops, samples_per_bin, half_bins, config_offsets):
+    """
+    Compiled half auto-correlogram counts of all units and configurations, spike pairs
+    of each unit are visited once for all configurations
+    """
+    n_units = len(unit_starts)
+    n_configs = len(samples_per_bin)
+    counts = np.zeros((n_units, config_offsets[-1]), dtype=np.int32)
+
+    # largest delay (in samples) counted by any configuration
+    max_delay = 0
+    for c in range(n_configs):
+        max_delay = max(max_delay, (half_bins[c] + 1) * samples_per_bin[c] - 1)
+
+    for u in prange(n_units):
+        times = spike_times[unit_starts[u]:unit_stops[u]]
+        if len(times) > 1 and np.any(times[1:] < times[:-1]):
+            times = np.sort(times)
+        for i in range(len(times)):
+            for j in range(i + 1, len(times)):
+                delay = times[j] - times[i]
+                if delay > max_delay:
+                    break
+                for c in range(n_configs):
+                    delay_bins = delay // samples_per_bin[c]
+                    if delay_bins <= half_bins[c]:
+                        counts[u, config_offsets[c] + delay_bins] += 1
+
+    return counts
+
+
+def get_store_acg(acg_store, unit_row, cbin, cwin, normalize="hertz"):
+    """
+    Get one unit's auto-correlogram from a store computed by compute_acg_store, normalized as by acg()
+
+    Parameters:
+    -----------
+    acg_store : dict
+        The output of compute_acg_store.
+    unit_row : int
+        The unit's row, i.e. its position in the unit_starts passed to compute_acg_store.
+    cbin, cwin : float
+        Bin and window sizes in milliseconds, one of the store's configurations.
+    normalize : str, optional
+        Normalization method, 'counts', 'hertz' (default), 'pearson' or 'zscore', see ccg().
+
+    Returns:
+    --------
+    autocorrelogram : ndarray
+        A 1D array of shape (n_bins, ) holding the autocorrelation histogram.
+    """
+    assert normalize in ['counts', 'hertz', 'pearson', 'zscore'], \
+        "WARNING get_store_acg() 'normalize' argument should be either 'counts', 'hertz', 'pearson', or 'zscore'."
+    counts = acg_store['acgs'][(float(cbin), float(cwin))][unit_row]
+    n_spikes = acg_store['n_spikes'][unit_row]
+
+    if normalize == 'counts':
+        return counts.copy()
+    counts = counts.astype(np.float64)
+    if n_spikes == 0:
+        return counts
+    if normalize == 'hertz':
+        return counts * 1. / (n_spikes * cbin * 1. / 1000)
+    elif normalize == 'pearson':
+        return counts * 1. / np.sqrt(n_spikes * n_spikes)
+    return zscore(counts, 4. / 5)
+
+
+def ccg_bz(times, groups=None, bin_size=0.001, duration=2.0, fs=1/20000, norm='counts', python_reference=False):
     """
     Compute multiple cross- and auto-correlograms
     
-    Python version of MATLAB CCGBz function with C backend for speed
+    Python version of MATLAB CCGBz function with a compiled (numba) backend for speed
     
     Parameters:
     -----------
@@ -350,6 +481,8 @@ def ccg_bz(times, groups=None, bin_size=0.001, duration=2.0, fs=1/20000, norm='c
         Normalization: 'counts' or 'rate'
         'counts': raw spike counts
         'rate': spikes per second
+    python_reference : bool, default=False
+        If True, use the (much slower) pure Python implementation, kept as a reference
         
     Returns:
     --------
@@ -362,7 +495,6 @@ def ccg_bz(times, groups=None, bin_size=0.001, duration=2.0, fs=1/20000, norm='c
         
     Notes:
     ------
-    - Pure Python implementation 
     - Groups must be positive integers (no zeros allowed)
     - Spikes will be automatically sorted by time
     """
@@ -412,13 +544,16 @@ def ccg_bz(times, groups=None, bin_size=0.001, duration=2.0, fs=1/20000, norm='c
     times_int = np.round(times / fs).astype(np.float64)
     bin_size_int = round(bin_size / fs)
     
-    # Use Python implementation
-    counts = _ccg_python(times_int, groups, bin_size_int, half_bins, n_groups, n_bins)
+    if python_reference:
+        counts = _ccg_python(times_int, groups, bin_size_int, half_bins, n_groups, n_bins)
+    else:
+        counts = _ccg_numba(times_int, groups.astype(np.int64), bin_size_int, half_bins, n_groups, n_bins)
     
     # Handle normalization
     if norm == 'rate':
+        group_spike_counts = np.bincount(groups, minlength=n_groups + 1)
         for g in range(1, n_groups + 1):
-            num_ref_spikes = np.sum(groups == g)
+            num_ref_spikes = group_spike_counts[g]
             if num_ref_spikes > 0:
                 counts[:, g-1, :] = counts[:, g-1, :] / num_ref_spikes / bin_size
     
@@ -429,8 +564,8 @@ def ccg_bz(times, groups=None, bin_size=0.001, duration=2.0, fs=1/20000, norm='c
 
 def _ccg_python(times, groups, bin_size, half_bins, n_groups, n_bins):
     """
-    Python fallback implementation of cross-correlogram computation
-    Much slower than C version but provides same results
+    Pure Python reference implementation of cross-correlogram computation
+    Much slower than _ccg_numba but provides same results
     """
     n_spikes = len(times)
     furthest_edge = bin_size * (half_bins + 0.5)
@@ -468,6 +603,46 @@ def _ccg_python(times, groups, bin_size, half_bins, n_groups, n_bins):
     
     return counts
 
+@njit(cache=True)
+def _ccg_numba(times, groups, bin_size, half_bins, n_groups, n_bins):
+    """
+    Compiled implementation of cross-correlogram computation, same binning as _ccg_python:
+    spikes up to furthest_edge before the center spike (inclusive) and after it (exclusive)
+    """
+    n_spikes = len(times)
+    furthest_edge = bin_size * (half_bins + 0.5)
+    
+    # Initialize count array
+    counts = np.zeros((n_bins, n_groups, n_groups), dtype=np.double)
+    
+    for center_spike in range(n_spikes):
+        mark1 = groups[center_spike]
+        time1 = times[center_spike]
+        
+        # Go backward
+        for second_spike in range(center_spike - 1, -1, -1):
+            time2 = times[second_spike]
+            
+            if abs(time1 - time2) > furthest_edge:
+                break
+                
+            bin_idx = half_bins + int(np.floor(0.5 + (time2 - time1) / bin_size))
+            if 0 <= bin_idx < n_bins:
+                counts[bin_idx, mark1 - 1, groups[second_spike] - 1] += 1
+        
+        # Go forward
+        for second_spike in range(center_spike + 1, n_spikes):
+            time2 = times[second_spike]
+            
+            if abs(time1 - time2) >= furthest_edge:
+                break
+                
+            bin_idx = half_bins + int(np.floor(0.5 + (time2 - time1) / bin_size))
+            if 0 <= bin_idx < n_bins:
+                counts[bin_idx, mark1 - 1, groups[second_spike] - 1] += 1
+    
+    return counts
+
 #%% utilities
 
 _ACCEPTED_ARRAY_DTYPES = (np.float32, np.float64,
@@ -573,4 +748,4 @@ def test_ccg():
 
 if __name__ == "__main__":
     # Test the implementation
-    test_ccg()
\ No newline at end of file
+    test_ccg()
@@ -43,17 +43,22 @@ def get_default_parameters(
         "saveAsTSV": True,  # save outputs as a .tsv file, useful for using phy after bombcell
         "unit_type_for_phy": True,  # save a unit_type .tsv file for phy
         "ephysKilosortPath": str(kilosort_path),  # path to the KiloSort directory
+        "nJobs": 1,  # number of parallel workers for the per-unit quality metrics (-1 uses all cores)
+        "cacheQualityMetrics": True,  # cache each quality metric stage in save_path/_bc_cache, only stages whose inputs or parameters changed are recomputed
+        "mmapEphysData": False,  # If True, open the Kilosort arrays memory-mapped in their on-disk dtype instead of loading them into RAM
 
         ## Duplicate spike parameters
         "removeDuplicateSpikes": False,
         "duplicateSpikeWindow_s": 0.000034,  # in seconds
         "saveSpikes_withoutDuplicates": True,
-        "recomputeDuplicateSpikes": False,
+        "recomputeDuplicateSpikes": False,  # unused, duplicate spikes are always recomputed
 
         ## Amplitude / raw waveform parameters
         "detrendWaveform": True,  # If True will linearly de-trend the average waveforms for BombCell
         "detrendForUnitMatch": False,  # If True will linearly de-trend raw waveforms saved for UnitMatch
         "nRawSpikesToExtract": 100,  # Number of raw spikes per unit
+        "rawWaveformBlockSize": 300000,  # Number of samples read from the raw data at once when extracting raw spikes
+        "streamingRawWaveforms": False,  # If True accumulate raw waveforms as float32 running means/approximate medians instead of keeping all raw spikes in memory
         "decompress_data": False,  # whether to decompress .cbin data
         "extractRaw": True,
         "probeType": 1,  # If you are using spikeGLX and your meta files does not
@@ -80,6 +85,8 @@ def get_default_parameters(
         ## Drift estimate
         "driftBinSize": 60,  # in seconds
         "computeDrift": False,  # If True computes drift per unit
+        "driftSpikePositions": True,  # If True and Kilosort 4's spike_positions.npy exists, use its spike
+        # depths for drift instead of pc_features (pc_features are then only loaded for distance metrics)
 
         ## Waveform parameters
         "minThreshDetectPeaksTroughs": 0.2,  # this is multiples by the max value in a units
@@ -7,7 +7,7 @@ import psutil
 import gc
 from pathlib import Path
 from tqdm.auto import tqdm
-from .ccg_fast import acg as compute_acg_fast
+from .ccg_fast import acg as compute_acg_fast, compute_acg_store, get_store_acg
 
 __all__ = [
     'run_all_ephys_properties',
@@ -99,6 +99,7 @@ def get_ephys_parameters(ephys_path, raw_file=None, meta_file=None):
     # Basic settings
     ephys_param['plotDetails'] = False
     ephys_param['verbose'] = True
+    ephys_param['mmapEphysData'] = False  # If True, open the Kilosort arrays memory-mapped instead of loading them
     
     # Recording parameters
     ephys_param['ephys_sample_rate'] = 30000
@@ -209,7 +210,8 @@ def compute_all_ephys_properties(ephys_path, param, save_path):
         List of dictionaries containing all computed properties
     """
     import gc
-    from bombcell.loading_utils import load_ephys_data
+    from bombcell.loading_utils import load_ephys_data, get_spike_index, get_cluster_rows
+    from bombcell.quality_metrics import get_spike_count_matrix
     
     # Load spike data
     (
@@ -220,14 +222,23 @@ def compute_all_ephys_properties(ephys_path, param, save_path):
         pc_features,
         pc_features_idx,
         channel_positions,
-    ) = load_ephys_data(ephys_path)
+        template_ids,
+    ) = load_ephys_data(
+        ephys_path,
+        load_pc_features=False,  # not used for ephys properties
+        mmap_mode="r" if param.get('mmapEphysData', False) else None,
+        cache_dir=save_path,
+        compact_templates=True,
+    )
     
     # Convert to seconds
     spike_times = spike_times_samples / param.get('ephys_sample_rate', 30000)
     
-    # Get unique units
-    unique_units = np.unique(spike_clusters)
+    # Get unique units, and index each unit's spikes once
+    spike_index = get_spike_index(spike_clusters)
+    unique_units = spike_index['unit_ids']
     n_units = len(unique_units)
+    template_rows = get_cluster_rows(template_ids, unique_units)
     
     # Initialize properties dictionary
     ephys_properties = []
@@ -273,15 +284,38 @@ def compute_all_ephys_properties(ephys_path, param, save_path):
         spike_times_sec = spike_times / sampling_rate
     else:
         spike_times_sec = spike_times
+    spike_times_by_unit = spike_times_sec[spike_index['spike_order']]
+
+    # spike counts of all units in fr_bin_size bins over the session in one pass, unless
+    # there are more bins than compute_spike_properties allows per unit
+    fr_bin_size = param.get('fr_bin_size', 1.0)
+    fr_bin_edges = np.arange(np.min(spike_times_sec), np.max(spike_times_sec) + fr_bin_size, fr_bin_size)
+    session_spike_counts = None
+    if len(fr_bin_edges) - 1 <= 10000:
+        session_spike_counts = get_spike_count_matrix(
+            spike_times_sec, spike_clusters, unique_units, fr_bin_edges
+        )
     
     log_memory_usage("After spike time conversion", param.get('verbose', True))
 
+    # ACGs of all units in one compiled pass, same samples and binning as compute_acg
+    acg_bin_size_ms = param.get('ACGbinSize', 0.001) * 1000
+    acg_duration_ms = param.get('ACGduration', 1.0) * 1000
+    acg_fs = param.get('ephys_sampling_rate', 30000)
+    acg_store = compute_acg_store(
+        (spike_times_by_unit * acg_fs).astype(np.uint64),
+        spike_index['unit_starts'],
+        spike_index['unit_stops'],
+        [(acg_bin_size_ms, acg_duration_ms)],
+        fs=acg_fs,
+    )
+
     
     # Unit-by-unit processing with progress tracking
     for i, unit_id in enumerate(tqdm(unique_units, desc="Computing ephys properties")):
         
         # Get spikes for this unit
-        unit_spikes = spike_times_sec[spike_clusters == unit_id]
+        unit_spikes = spike_times_by_unit[spike_index['unit_starts'][i]:spike_index['unit_stops'][i]]
         
         if len(unit_spikes) < param['min_spikes_for_stats']:
             # Clean up and continue to next unit
@@ -290,7 +324,7 @@ def compute_all_ephys_properties(ephys_path, param, save_path):
             continue
             
         # Get template for this unit - avoid loading all at once
-        unit_template = template_waveforms[unit_id].copy()  # Copy to avoid memory issues
+        unit_template = template_waveforms[template_rows[i]].copy()  # Copy to avoid memory issues
 
         
         # Initialize variables for cleanup
@@ -301,7 +335,8 @@ def compute_all_ephys_properties(ephys_path, param, save_path):
         
         try:
             # Compute ACG properties
-            acg_props = compute_acg_properties(unit_spikes, param)
+            unit_acg = get_store_acg(acg_store, i, acg_bin_size_ms, acg_duration_ms, normalize='counts')
+            acg_props = compute_acg_properties(unit_spikes, param, acg=unit_acg)
             ephys_properties[i]['postSpikeSuppression'] = acg_props.get('post_spike_suppression_ratio', np.nan)
             ephys_properties[i]['acg_tau_rise'] = acg_props.get('tau_rise_ms', np.nan)
             ephys_properties[i]['acg_tau_decay'] = acg_props.get('tau_decay_ms', np.nan)
@@ -343,8 +378,13 @@ def compute_all_ephys_properties(ephys_path, param, save_path):
             del wf_props
             gc.collect()
             
-            # Compute spike properties
-            spike_props = compute_spike_properties(unit_spikes, param)
+            # Compute spike properties, from the session spike counts in the bins spanning this unit
+            unit_spike_counts = None
+            if session_spike_counts is not None:
+                first_bin = np.searchsorted(fr_bin_edges, unit_spikes[0], side='right') - 1
+                last_bin = np.searchsorted(fr_bin_edges, unit_spikes[-1], side='right')
+                unit_spike_counts = session_spike_counts[i, first_bin:last_bin]
+            spike_props = compute_spike_properties(unit_spikes, param, spike_counts=unit_spike_counts)
             ephys_properties[i]['firing_rate_mean'] = spike_props.get('mean_firing_rate', np.nan)
             ephys_properties[i]['firing_rate_std'] = spike_props.get('std_firing_rate', np.nan)
             ephys_properties[i]['fano_factor'] = spike_props.get('fano_factor', np.nan)
@@ -393,7 +433,7 @@ def compute_all_ephys_properties(ephys_path, param, save_path):
     return ephys_properties
 
 
-def compute_acg_properties(spike_times, param):
+def compute_acg_properties(spike_times, param, acg=None):
     """
     Compute auto-correlogram based properties
     
@@ -403,6 +443,9 @@ def compute_acg_properties(spike_times, param):
         Spike times in seconds
     param : dict
         Parameters dictionary
+    acg : array, optional
+        The unit's auto-correlogram counts, e.g. from ccg_fast.compute_acg_store, computed
+        with compute_acg if None
         
     Returns
     -------
@@ -412,7 +455,8 @@ def compute_acg_properties(spike_times, param):
     # Compute ACG using MATLAB parameter names
     acg_bin_size = param.get('ACGbinSize', 0.001)
     acg_duration = param.get('ACGduration', 1.0)
-    acg, lags = compute_acg(spike_times, acg_bin_size, acg_duration, param)
+    if acg is None:
+        acg, lags = compute_acg(spike_times, acg_bin_size, acg_duration, param)
     
     # Initialize output
     acg_props = {
@@ -726,7 +770,7 @@ def compute_waveform_properties(template, param, sampling_rate):
     return wf_props
 
 
-def compute_spike_properties(spike_times, param):
+def compute_spike_properties(spike_times, param, spike_counts=None):
     """
     Compute spike timing based properties - memory optimized
     
@@ -736,6 +780,9 @@ def compute_spike_properties(spike_times, param):
         Spike times in seconds
     param : dict
         Parameters dictionary
+    spike_counts : array, optional
+        The unit's spike counts in fr_bin_size bins spanning its spikes, e.g. a slice of
+        quality_metrics.get_spike_count_matrix. By default the spikes are binned here
         
     Returns
     -------
@@ -768,9 +815,14 @@ def compute_spike_properties(spike_times, param):
         bin_size = duration / max_bins
         n_bins = max_bins
     
+    if spike_counts is not None:
+        bin_size = param.get('fr_bin_size', 1.0)
+        n_bins = len(spike_counts)
+
     if n_bins > 1:
-        bins = np.linspace(spike_times[0], spike_times[-1], n_bins + 1)
-        spike_counts, _ = np.histogram(spike_times, bins)
+        if spike_counts is None:
+            bins = np.linspace(spike_times[0], spike_times[-1], n_bins + 1)
+            spike_counts, _ = np.histogram(spike_times, bins)
         firing_rates = spike_counts / bin_size
         
         if len(firing_rates) > 1:
@@ -1,7 +1,6 @@
 import os
 import json
 from pathlib import Path
-from joblib import Parallel, delayed
 
 import numpy as np
 
@@ -318,6 +317,325 @@ def process_a_unit(
     return cluster_raw_waveforms
 
 
+def read_spike_windows(raw_data, window_starts, spike_width, block_size, max_windows=256):
+    """
+    Reads windows of raw data in the order they appear in the file. Windows are grouped into
+    contiguous blocks of at most block_size samples (a block always holds whole windows) and
+    each block is read from the binary file in one sequential read.
+
+    Parameters
+    ----------
+    raw_data : memmap
+        The numpy memmap of the raw data
+    window_starts : ndarray (n_windows)
+        The first sample of each window
+    spike_width : int
+        The number of samples in each window
+    block_size : int
+        The maximum number of samples read at once
+    max_windows : int, optional
+        The maximum number of windows returned at once, by default 256
+
+    Yields
+    ------
+    window_idx : ndarray (n)
+        The indexes of the returned windows in window_starts
+    windows : ndarray (n, spike_width, n_channels_rec)
+        The raw data of the returned windows
+    """
+    window_starts = np.asarray(window_starts, dtype=np.int64)
+    window_order = np.argsort(window_starts, kind="stable")
+    sorted_starts = window_starts[window_order]
+    n_windows = sorted_starts.size
+    window_samples = np.arange(spike_width)
+
+    block_first = 0
+    while block_first < n_windows:
+        # add windows to the block while they fit in block_size samples
+        block_start = sorted_starts[block_first]
+        block_last = np.searchsorted(
+            sorted_starts, block_start + block_size - spike_width, side="right"
+        )
+        block_last = max(block_last, block_first + 1)
+        block_stop = sorted_starts[block_last - 1] + spike_width
+        block = np.asarray(raw_data[block_start:block_stop])
+
+        for batch_first in range(block_first, block_last, max_windows):
+            batch_last = min(batch_first + max_windows, block_last)
+            offsets = sorted_starts[batch_first:batch_last] - block_start
+            yield (
+                window_order[batch_first:batch_last],
+                block[offsets[:, np.newaxis] + window_samples],
+            )
+        block_first = block_last
+
+
+def process_all_units(
+    raw_data,
+    spike_width,
+    half_width,
+    all_spikes_idxs,
+    n_channels_rec,
+    n_sync_channels,
+    unique_clusters,
+    detrendWaveform,
+    detrendForUnitMatch,
+    waveform_baseline_noise,
+    save_directory,
+    save_multiple_raw,
+    template_peak_channels=None,
+    block_size=300000,
+    max_buffer_bytes=2 * 1024**3,
+    streaming=False,
+):
+    """
+    Reads in the sampled spikes of all units with read_spike_windows and processes the data
+    like process_a_unit. Each spike is read once, for both the BombCell average waveforms and
+    the UnitMatch waveforms. When the UnitMatch waveforms are saved, the spikes of units are
+    kept in memory until the unit is processed, so units are processed in groups of at most
+    max_buffer_bytes of raw data. In streaming mode only running statistics are kept, so the
+    memory used is O(n_channels x spike_width) per unit.
+
+    Parameters
+    ----------
+    raw_data : memmap
+        The numpy memmap of the raw data
+    spike_width : int
+        The total number of samples to take per unit
+    half_width : int
+        The number of samples before the spike starts
+    all_spikes_idxs : ndarray (n_clusters, n_spike_to_extract)
+        The spike times of the spikes to extract for each unit, nan if unused
+    n_channels_rec : int
+        The total number of channels in the recording
+    n_sync_channels : int
+        The number of sync channel in the recording
+    unique_clusters : ndarray (n_clusters)
+        The id of each cluster
+    detrendWaveform : bool
+        If True will linearly de-trend the average waveforms for BombCell
+    detrendForUnitMatch : bool
+        If True will linearly de-trend raw waveforms saved for UnitMatch
+    waveform_baseline_noise : int
+        The number of samples before the waveform which are noise
+    save_directory : pathlib.Path
+        The path to the directory to save the UnitMatch data
+    save_multiple_raw : bool
+        If True will save the UnitMatch waveforms
+    template_peak_channels : ndarray (n_clusters), optional
+        The peak channel from the templates of each cluster in unique_clusters. If provided, this will be used
+        instead of calculating from raw waveforms
+    block_size : int, optional
+        The maximum number of samples read from the raw data at once, by default 300000
+    max_buffer_bytes : int, optional
+        The maximum memory used to keep spikes for the UnitMatch waveforms, by default 2GB
+    streaming : bool, optional
+        If True the average waveforms are accumulated as float32 running means and the UnitMatch
+        medians are approximated with running medians, so no spikes are kept in memory, by default False
+
+    Returns
+    -------
+    all_waveforms : list of dict
+        A dictionary of the necessary information extract from the raw data for each unit
+    """
+    n_neural_channels = n_channels_rec - n_sync_channels
+    n_clusters = unique_clusters.shape[0]
+    accumulator_dtype = np.float32 if streaming else np.float64
+
+    # the spikes to read for each unit, and the slot of each spike in its unit
+    spike_idxs = [unit_spikes[~np.isnan(unit_spikes)] for unit_spikes in all_spikes_idxs]
+    n_spikes_sampled = np.array([unit_spikes.size for unit_spikes in spike_idxs])
+    UM_CV_limits = np.floor(n_spikes_sampled / 2).astype(int)
+
+    # group units so the UnitMatch spikes of a group fit in memory
+    if save_multiple_raw and not streaming:
+        unit_bytes = n_spikes_sampled * spike_width * n_neural_channels * 2
+        unit_groups = []
+        group_first = 0
+        for unit_idx in range(1, n_clusters + 1):
+            if unit_idx == n_clusters or np.sum(unit_bytes[group_first : unit_idx + 1]) > max_buffer_bytes:
+                unit_groups.append(np.arange(group_first, unit_idx))
+                group_first = unit_idx
+    else:
+        unit_groups = [np.arange(n_clusters)]
+
+    all_waveforms = [None] * n_clusters
+    progress = tqdm(total=int(n_spikes_sampled.sum()), desc="Extracting raw spikes", unit="spikes")
+    for unit_group in unit_groups:
+        window_unit = np.repeat(unit_group, n_spikes_sampled[unit_group])
+        if window_unit.size > 0:
+            window_slot = np.concatenate([np.arange(n) for n in n_spikes_sampled[unit_group]])
+            window_starts = np.concatenate([spike_idxs[i] for i in unit_group]).astype(np.int64) - half_width - 1
+        else:
+            window_slot = np.zeros(0, dtype=int)
+            window_starts = np.zeros(0, dtype=np.int64)
+
+        # sum (or running mean if streaming) of the BombCell waveforms of each unit
+        spike_map_acc = np.zeros((unit_group.size, spike_width, n_neural_channels), dtype=accumulator_dtype)
+        n_spikes_read = np.zeros(unit_group.size, dtype=int)
+        group_unit_idx = np.searchsorted(unit_group, window_unit)
+        if save_multiple_raw and streaming:
+            # running median of each cross-validation half
+            unitmatch_medians = np.full(
+                (unit_group.size, 2, spike_width, n_neural_channels), np.nan, dtype=np.float32
+            )
+            unitmatch_spreads = np.zeros_like(unitmatch_medians)
+            unitmatch_n_seen = np.zeros((unit_group.size, 2), dtype=int)
+        elif save_multiple_raw:
+            unitmatch_spike_maps = [
+                np.zeros((n_spikes_sampled[i], spike_width, n_neural_channels), dtype=np.int16)
+                for i in unit_group
+            ]
+
+        for window_idx, windows in read_spike_windows(raw_data, window_starts, spike_width, block_size):
+            windows = windows[:, :, :n_neural_channels]
+            these_units = group_unit_idx[window_idx]
+
+            # option to remove a linear in time trends
+            spike_maps = windows.astype(accumulator_dtype)
+            if detrendWaveform:
+                spike_maps = detrend(spike_maps, axis=1)
+            unit_order = np.argsort(these_units, kind="stable")
+            units_in_batch, unit_firsts, units_n_spikes = np.unique(
+                these_units[unit_order], return_index=True, return_counts=True
+            )
+            batch_sums = np.add.reduceat(spike_maps[unit_order], unit_firsts, axis=0)
+            n_spikes_read[units_in_batch] += units_n_spikes
+            if streaming:
+                spike_map_acc[units_in_batch] += (
+                    batch_sums - units_n_spikes[:, np.newaxis, np.newaxis] * spike_map_acc[units_in_batch]
+                ) / n_spikes_read[units_in_batch][:, np.newaxis, np.newaxis]
+            else:
+                spike_map_acc[units_in_batch] += batch_sums
+
+            if save_multiple_raw and streaming:
+                # option to remove a linear in time trends for UnitMatch (separate from BombCell)
+                unitmatch_spikes = windows.astype(np.float32)
+                if detrendForUnitMatch:
+                    unitmatch_spikes = detrend(unitmatch_spikes, axis=1)
+                unitmatch_spikes = smooth_unitmatch_spikes(unitmatch_spikes, waveform_baseline_noise)
+                for unit_idx, slot, spike in zip(these_units, window_slot[window_idx], unitmatch_spikes):
+                    cv = int(slot >= UM_CV_limits[unit_group[unit_idx]])
+                    update_running_median(
+                        unitmatch_medians[unit_idx, cv],
+                        unitmatch_spreads[unit_idx, cv],
+                        unitmatch_n_seen[unit_idx, cv],
+                        spike,
+                    )
+                    unitmatch_n_seen[unit_idx, cv] += 1
+            elif save_multiple_raw:
+                for unit_idx, slot, window in zip(these_units, window_slot[window_idx], windows):
+                    unitmatch_spike_maps[unit_idx][slot] = window
+            progress.update(window_idx.size)
+
+        for group_idx, unit_idx in enumerate(unit_group):
+            cluster_raw_waveforms = {}
+            cid = unique_clusters[unit_idx]
+
+            if save_multiple_raw:
+                if streaming:
+                    avg_waveforms = unitmatch_medians[group_idx].transpose(1, 2, 0)
+                else:
+                    # option to remove a linear in time trends for UnitMatch (separate from BombCell)
+                    if detrendForUnitMatch:
+                        unitmatch_spike_map = detrend(unitmatch_spike_maps[group_idx], axis=1)
+                    else:
+                        unitmatch_spike_map = unitmatch_spike_maps[group_idx].astype(np.float64)
+                    unitmatch_spike_maps[group_idx] = None
+                    unitmatch_spike_map = smooth_unitmatch_spikes(unitmatch_spike_map, waveform_baseline_noise)
+
+                    # split into 2 CV for unitmatch!
+                    UM_CV_limit = UM_CV_limits[unit_idx]
+                    avg_waveforms = np.full((spike_width, n_neural_channels, 2), np.nan)
+                    avg_waveforms[:, :, 0] = np.nanmedian(unitmatch_spike_map[:UM_CV_limit], axis=0)
+                    avg_waveforms[:, :, 1] = np.nanmedian(unitmatch_spike_map[UM_CV_limit:], axis=0)
+                np.save(save_directory / f"Unit{cid}_RawSpikes.npy", avg_waveforms)
+
+            # get average, baseline-subtracted waveforms, Not smoothing as a mandatory processing step!
+            if n_spikes_read[group_idx] == 0:
+                spike_map_mean = np.full((n_neural_channels, spike_width), np.nan)
+            elif streaming:
+                spike_map_mean = spike_map_acc[group_idx].T
+            else:
+                spike_map_mean = (spike_map_acc[group_idx] / n_spikes_read[group_idx]).T
+            raw_waveforms_full = (
+                spike_map_mean
+                - spike_map_mean[:, :waveform_baseline_noise].mean(axis=1)[:, np.newaxis]
+            )
+
+            # use template peak channel if provided, otherwise calculate from raw waveforms
+            if template_peak_channels is not None and unit_idx < len(template_peak_channels):
+                raw_waveforms_peak_channel = template_peak_channels[unit_idx]
+            else:
+                raw_waveforms_peak_channel = np.argmax(
+                    np.max(raw_waveforms_full[:, :], axis=1)
+                    - np.min(raw_waveforms_full[:, :], axis=1)
+                )
+            # the mean over spikes of the baseline is the baseline of the mean
+            average_baseline = spike_map_mean[int(raw_waveforms_peak_channel), :waveform_baseline_noise]
+
+            cluster_raw_waveforms["spike_map_mean"] = spike_map_mean
+            cluster_raw_waveforms["average_baseline"] = average_baseline
+            cluster_raw_waveforms["raw_waveforms_full"] = raw_waveforms_full
+            cluster_raw_waveforms["raw_waveforms_peak_channel"] = raw_waveforms_peak_channel
+            cluster_raw_waveforms["spike_idxs"] = spike_idxs[unit_idx]
+            all_waveforms[unit_idx] = cluster_raw_waveforms
+    progress.close()
+
+    return all_waveforms
+
+
+def smooth_unitmatch_spikes(spike_maps, waveform_baseline_noise):
+    """
+    Smooths and baseline-subtracts the raw spikes used for the UnitMatch waveforms
+
+    Parameters
+    ----------
+    spike_maps : ndarray (n_spikes, spike_width, n_channels)
+        The raw data of each spike
+    waveform_baseline_noise : int
+        The number of samples before the waveform which are noise
+
+    Returns
+    -------
+    spike_maps : ndarray (n_spikes, spike_width, n_channels)
+        The smoothed, baseline-subtracted spikes
+    """
+    # smooth over axis at once
+    spike_maps = gaussian_filter(spike_maps, axes=1, sigma=1, radius=2)
+    # matches matlab smoothdata, EXCEPT at boundaries!
+    spike_maps -= np.mean(spike_maps[:, :waveform_baseline_noise, :], axis=1)[
+        :, np.newaxis, :
+    ]
+    return spike_maps
+
+
+def update_running_median(median, spread, n_seen, sample):
+    """
+    Updates an approximate running median in place with a new sample. This is a stochastic
+    approximation of the median, where the step size is scaled by the running mean absolute
+    deviation, so only the current estimate has to be kept in memory.
+
+    Parameters
+    ----------
+    median : ndarray
+        The current median estimate, updated in place
+    spread : ndarray
+        The running mean absolute deviation from the median estimate, updated in place
+    n_seen : int
+        The number of samples already used in the estimate
+    sample : ndarray
+        The new sample
+    """
+    if n_seen == 0:
+        median[...] = sample
+        spread[...] = 0
+        return
+    deviation = sample - median
+    spread += (np.abs(deviation) - spread) / n_seen
+    median += (np.pi / 2) * spread / (n_seen + 1) * np.sign(deviation)
+
+
 def unpack_dicts(
     all_waveforms,
     spike_width,
@@ -411,8 +729,9 @@ def extract_raw_waveforms(
         If True will re-extract waveforms if there are waveforms saved
     save_path : str
         The path to the directory where results will be saved
-    template_peak_channels : ndarray, optional
-        Array of peak channels from templates. If provided, raw waveforms will use these instead of calculating their own
+    template_peak_channels : ndarray (n_clusters), optional
+        Array of peak channels from templates, one per cluster of np.unique(spike_clusters) (not indexed by
+        cluster id). If provided, raw waveforms will use these instead of calculating their own
 
     Returns
     -------
@@ -422,6 +741,9 @@ def extract_raw_waveforms(
         The peak channel for each cluster
     SNR : ndarray (n_clusters)
         The signal to noise ratio for each unit
+    raw_waveforms_cluster_ids : ndarray (n_clusters)
+        The cluster id of each row of raw_waveforms_full. The padded copy where the row number matches
+        the cluster id is only written to _bc_rawWaveforms_kilosort_format.npy, see save_raw_waveforms_id_match
     """
     # Create save_path if it does not exist
     save_path = path_handler(save_path)
@@ -438,7 +760,6 @@ def extract_raw_waveforms(
     # Cluster ids
     unique_clusters = np.unique(spike_clusters)
     n_clusters = unique_clusters.shape[0]
-    max_cluster_id = unique_clusters[-1]
 
     # Get necessary info from param
     raw_data_file = param["raw_data_file"]
@@ -451,28 +772,32 @@ def extract_raw_waveforms(
     save_multiple_raw = param.get("saveMultipleRaw", False)  # get and save data for UnitMatch
     waveform_baseline_noise = param.get("waveformBaselineNoiseWindow", 20)
     spike_width = param["spike_width"]
-    
+    raw_block_size = param.get("rawWaveformBlockSize", 300000)
+    streaming_raw = param.get("streamingRawWaveforms", False)
 
     # if data exists and re_extract_waveforms is false, load in data
     recompute = re_extract_waveforms
+    updated = False
     if raw_waveforms_file.exists() and not recompute:
         if raw_waveforms_peak_channel_file.exists() and snr_noise_file.exists() and snr_noise_idx_file.exists():
             print(f"Loading file {raw_waveforms_file}...", end='', flush=True)
 
             raw_waveforms_full = np.load(raw_waveforms_file)
             raw_waveforms_peak_channel = np.load(raw_waveforms_peak_channel_file)
-            raw_waveforms_id_match = np.load(raw_waveforms_id_match_file)
             baseline_noise_all = np.load(snr_noise_file)
             baseline_noise_idx = np.load(snr_noise_idx_file)
+            # the rows of raw_waveforms_full are the sorted extracted cluster ids
+            raw_waveforms_cluster_ids = np.unique(baseline_noise_idx).astype(int)
             print(f"\rLoading file {raw_waveforms_file}... Done!") 
 
             check = check_extracted_waveforms(
-                raw_waveforms_id_match, raw_waveforms_peak_channel, spike_clusters, spike_times, baseline_noise_all, param, save_path)
+                raw_waveforms_full, raw_waveforms_peak_channel, raw_waveforms_cluster_ids, spike_clusters, spike_times,
+                baseline_noise_all, param, save_path, template_peak_channels)
 
-            if check != (None, None, None, None, None):
-                raw_waveforms_id_match, raw_waveforms_peak_channel, raw_waveforms_full, baseline_noise_all, baseline_noise_idx = check
-            # Check whether number of clusters changed
-            # assumes that raw_waveforms_full has empty rows for jumps in unit indices
+            if check[0] is not None:
+                raw_waveforms_cluster_ids, raw_waveforms_peak_channel, raw_waveforms_full, baseline_noise_all, baseline_noise_idx = check
+                updated = True
+            # Check whether number of clusters changed, raw_waveforms_full has one row per cluster
             if raw_waveforms_full.shape[0] != n_clusters:
                 print("\rSome units' raw waveforms are not extracted. Extracting now ...") 
                 recompute = True
@@ -571,24 +896,22 @@ def extract_raw_waveforms(
                 all_spikes_idxs[i, : len(clus_spike_times[i])] = clus_spike_times[i]
                 all_spikes_idxs[i, len(clus_spike_times[i]) :] = np.nan
 
-        all_waveforms = Parallel(n_jobs=-1, verbose=10, mmap_mode="r", max_nbytes=None)(
-            delayed(process_a_unit)(
-                raw_data,
-                spike_width,
-                half_width,
-                all_spikes_idxs[i],
-                n_channels_rec,
-                n_channels,
-                n_sync_channels,
-                cid,
-                detrendWaveform,
-                detrendForUnitMatch,
-                waveform_baseline_noise,
-                raw_waveforms_dir,
-                save_multiple_raw,
-                template_peak_channels[i] if template_peak_channels is not None and i < len(template_peak_channels) else None,
-            )
-            for i, cid in tqdm(enumerate(unique_clusters))
+        all_waveforms = process_all_units(
+            raw_data,
+            spike_width,
+            half_width,
+            all_spikes_idxs,
+            n_channels_rec,
+            n_sync_channels,
+            unique_clusters,
+            detrendWaveform,
+            detrendForUnitMatch,
+            waveform_baseline_noise,
+            raw_waveforms_dir,
+            save_multiple_raw,
+            template_peak_channels,
+            block_size=raw_block_size,
+            streaming=streaming_raw,
         )
 
         (raw_waveforms,
@@ -612,39 +935,124 @@ def extract_raw_waveforms(
         np.save(snr_noise_idx_file, baseline_noise_idx)
 
     # Compute SNR
-    SNR = np.zeros(n_clusters)
-    for i, cid in enumerate(unique_clusters):
-        mask = unique_clusters == cid
-        cluster_idx = np.where(mask)[0]
-        peak_channel = raw_waveforms_peak_channel[cluster_idx].astype(int)
+    SNR = get_snr(
+        raw_waveforms_full,
+        raw_waveforms_peak_channel,
+        baseline_noise_all,
+        baseline_noise_idx,
+        unique_clusters,
+    )
+
+    # Save the extracted waveforms if they were recomputed, with a copy were the row number matches the cluster index
+    if recompute or updated:
+        np.save(raw_waveforms_file, raw_waveforms_full)
+        np.save(raw_waveforms_peak_channel_file, raw_waveforms_peak_channel)
+        if updated:
+            np.save(snr_noise_file, baseline_noise_all)
+            np.save(snr_noise_idx_file, baseline_noise_idx)
+        save_raw_waveforms_id_match(raw_waveforms_id_match_file, raw_waveforms_full, unique_clusters)
+
+    return raw_waveforms_full, raw_waveforms_peak_channel, SNR, unique_clusters
+
+
+def save_raw_waveforms_id_match(file_path, raw_waveforms_full, cluster_ids):
+    """
+    Saves the raw waveforms in kilosort format, where the row number matches the cluster id and the rows of
+    clusters which do not exist are NaN. The file is written through a memory-map, so the padded array is
+    never held in memory.
+
+    Parameters
+    ----------
+    file_path : str
+        The .npy file to save to
+    raw_waveforms_full : ndarray (n_clusters, n_channels, spike_width)
+        The extracted average waveforms, one row per cluster
+    cluster_ids : ndarray (n_clusters,)
+        The cluster id of each row of raw_waveforms_full
+    """
+    cluster_ids = np.asarray(cluster_ids).astype(int)
+    n_rows = int(cluster_ids.max()) + 1 if cluster_ids.size > 0 else 0
 
-        # Maximum absolute value of the waveform (signal)
-        peak_waveform = raw_waveforms_full[cluster_idx, peak_channel, :]
-        signal = np.max(np.abs(np.squeeze(peak_waveform)))
+    raw_waveforms_id_match = np.lib.format.open_memmap(
+        file_path, mode="w+", dtype=np.float64, shape=(n_rows,) + raw_waveforms_full.shape[1:]
+    )
+    is_extracted = np.zeros(n_rows, dtype=bool)
+    is_extracted[cluster_ids] = True
+    raw_waveforms_id_match[~is_extracted] = np.nan
+    raw_waveforms_id_match[cluster_ids] = raw_waveforms_full
+    raw_waveforms_id_match.flush()
+    del raw_waveforms_id_match
+
+
+def get_snr(
+    raw_waveforms_full,
+    raw_waveforms_peak_channel,
+    baseline_noise_all,
+    baseline_noise_idx,
+    unique_clusters,
+):
+    """
+    Calculates the signal to noise ratio of all units at once, the signal is the maximum absolute
+    value of the peak channel waveform and the noise is the median absolute deviation (MAD) of
+    the unit's baseline samples
 
-        # Get baseline noise for this cluster
-        baseline_mask = baseline_noise_idx  == cid
-        baseline = baseline_noise_all[baseline_mask]
+    Parameters
+    ----------
+    raw_waveforms_full : ndarray (n_clusters, n_channels, spike_width)
+        All extracted average waveforms
+    raw_waveforms_peak_channel : ndarray (n_clusters)
+        The peak channel for each cluster
+    baseline_noise_all : ndarray
+        The concatenated baseline samples of all units
+    baseline_noise_idx : ndarray
+        The cluster id of each sample in baseline_noise_all
+    unique_clusters : ndarray (n_clusters)
+        The id of each cluster
 
-        # Calculate MAD (noise) - Median Absolute Deviation
-        noise = np.median(np.abs(baseline - np.median(baseline)))
+    Returns
+    -------
+    SNR : ndarray (n_clusters)
+        The signal to noise ratio for each unit
+    """
+    n_clusters = unique_clusters.shape[0]
 
-        # Calculate SNR
-        SNR[i] = signal / noise
+    # Maximum absolute value of the waveform (signal)
+    peak_waveforms = raw_waveforms_full[
+        np.arange(n_clusters), raw_waveforms_peak_channel.astype(int), :
+    ]
+    signal = np.max(np.abs(peak_waveforms), axis=1)
+
+    # group the baseline samples by cluster id
+    baseline_order = np.argsort(baseline_noise_idx, kind="stable")
+    baseline_sorted = baseline_noise_all[baseline_order]
+    baseline_ids, baseline_starts, baseline_counts = np.unique(
+        baseline_noise_idx[baseline_order], return_index=True, return_counts=True
+    )
 
+    # Calculate MAD (noise) - Median Absolute Deviation
+    baseline_mad = np.full(baseline_ids.shape[0], np.nan)
+    if baseline_ids.size > 0 and np.all(baseline_counts == baseline_counts[0]):
+        # all units have the same number of baseline samples, compute at once
+        baselines = baseline_sorted.reshape(baseline_ids.shape[0], baseline_counts[0])
+        baseline_mad = np.median(
+            np.abs(baselines - np.median(baselines, axis=1)[:, np.newaxis]), axis=1
+        )
+    else:
+        for i, (start, count) in enumerate(zip(baseline_starts, baseline_counts)):
+            baseline = baseline_sorted[start : start + count]
+            baseline_mad[i] = np.median(np.abs(baseline - np.median(baseline)))
 
-    #Save a copy of the waveforms were the row number matches the cluster index
-    raw_waveforms_id_match = np.full((max_cluster_id + 1, n_channels - n_sync_channels, spike_width), np.nan)
-    for i, idx in enumerate(unique_clusters):
-        raw_waveforms_id_match[idx] = raw_waveforms_full[i]
+    # units without baseline samples have no noise estimate
+    noise = np.full(n_clusters, np.nan)
+    baseline_pos = np.searchsorted(baseline_ids, unique_clusters)
+    has_baseline = baseline_pos < baseline_ids.shape[0]
+    has_baseline[has_baseline] = baseline_ids[baseline_pos[has_baseline]] == unique_clusters[has_baseline]
+    noise[has_baseline] = baseline_mad[baseline_pos[has_baseline]]
 
-    # Save the extracted waveforms if they were recomputed
-    if recompute:
-        np.save(raw_waveforms_file, raw_waveforms_full)
-        np.save(raw_waveforms_peak_channel_file, raw_waveforms_peak_channel)
-        np.save(raw_waveforms_id_match_file, raw_waveforms_id_match)
+    # Calculate SNR
+    SNR = signal / noise
 
-    return raw_waveforms_full, raw_waveforms_peak_channel, SNR, raw_waveforms_id_match
+    return SNR
 
 
 def decompress_data_if_needed(raw_file_path, decompress_data=True):
@@ -859,46 +1267,70 @@ def _decompress_raw_data(
 
     return decompressed_data_name
 
-def check_extracted_waveforms(raw_waveforms_id_match, raw_waveforms_peak_channel, spike_clusters, spike_times, baseline_noise_all, param, save_path):
+def check_extracted_waveforms(
+    raw_waveforms_full,
+    raw_waveforms_peak_channel,
+    raw_waveforms_cluster_ids,
+    spike_clusters,
+    spike_times,
+    baseline_noise_all,
+    param,
+    save_path,
+    template_peak_channels=None,
+):
+    """
+    Checks whether the clusters changed (e.g. Phy splits/merges) since the raw waveforms were extracted,
+    and if so extracts the waveforms of the new clusters only. All arrays have one row per cluster.
+
+    Parameters
+    ----------
+    raw_waveforms_full : ndarray (n_extracted, n_channels, spike_width)
+        The previously extracted average waveforms
+    raw_waveforms_peak_channel : ndarray (n_extracted,)
+        The previously extracted peak channels
+    raw_waveforms_cluster_ids : ndarray (n_extracted,)
+        The sorted cluster id of each row of raw_waveforms_full
+    spike_clusters, spike_times, param, save_path, template_peak_channels :
+        See extract_raw_waveforms
+    baseline_noise_all : ndarray (n_extracted * waveformBaselineNoiseWindow,)
+        The previously extracted baseline noise
 
+    Returns
+    -------
+    The new cluster ids, peak channels, waveforms, baseline noise and baseline noise index, all None if
+    the clusters did not change
+    """
     # get the current and old cluster indexes
     unique_id_new = np.unique(spike_clusters)
-    unique_id_extracted = np.argwhere(np.isnan(raw_waveforms_id_match[:,0,0]) == False).squeeze()
+    unique_id_extracted = np.asarray(raw_waveforms_cluster_ids)
 
-    if np.all(unique_id_new == unique_id_extracted):
+    if unique_id_new.size == unique_id_extracted.size and np.all(unique_id_new == unique_id_extracted):
         print('No splits/merges detected')
         return None, None, None, None, None
     else:
-        #find the different indexes
-        new_indexes_to_get = unique_id_new[np.argwhere(np.isin(unique_id_new, unique_id_extracted) == False)]
-        old_indexes_to_remove = unique_id_extracted[np.argwhere(np.isin(unique_id_extracted, unique_id_extracted) == False)]
-
-        #create new waveforms array for the new indexes and remove old indexes
-        n_new_clusters = unique_id_new[-1] - unique_id_extracted[-1]
-        new_raw_waveforms_matching_ids = np.pad(raw_waveforms_id_match, ((0,n_new_clusters),(0,0),(0,0)))
-        new_raw_waveforms_matching_ids[old_indexes_to_remove] = np.nan
-
-        #create baseline 
-        baseline_id_match = np.zeros(np.max(unique_id_extracted)+1)
-        for i, idx in enumerate(unique_id_extracted):
-            baseline_id_match[idx] = baseline_noise_all[i*waveform_baseline_noise:(i+1)*waveform_baseline_noise].mean()
-        new_baseline = np.pad(baseline_id_match, (0,n_new_clusters))
-        new_baseline[old_indexes_to_remove] = np.nan
+        waveform_baseline_noise = param.get("waveformBaselineNoiseWindow", 20)
+        n_clusters = unique_id_new.size
 
-        new_baseline_noise_idx = np.hstack([(np.ones(waveform_baseline_noise) * cid) for cid in unique_id_new])
+        #find the different indexes, and the old row of every kept cluster
+        old_rows = np.minimum(np.searchsorted(unique_id_extracted, unique_id_new), unique_id_extracted.size - 1)
+        is_kept = unique_id_extracted[old_rows] == unique_id_new
+        new_indexes_to_get = unique_id_new[~is_kept]
+
+        #create new waveforms, peak channels and baseline arrays, the removed clusters are dropped
+        new_raw_waveform_full = np.full((n_clusters,) + raw_waveforms_full.shape[1:], np.nan)
+        new_raw_waveform_full[is_kept] = raw_waveforms_full[old_rows[is_kept]]
 
-        #create array for peak channels with matching row to id 
-        peak_channels_id_match = np.zeros(np.max(unique_id_extracted)+1)
-        for i, idx in enumerate(unique_id_extracted):
-            peak_channels_id_match[idx] = raw_waveforms_peak_channel[i]
+        new_peak_channels = np.full(n_clusters, np.nan)
+        new_peak_channels[is_kept] = raw_waveforms_peak_channel[old_rows[is_kept]]
 
-        new_peak_channels_matching_ids = np.pad(peak_channels_id_match, (0,n_new_clusters))
-        new_peak_channels_matching_ids[old_indexes_to_remove] = np.nan
+        new_baseline = np.full((n_clusters, waveform_baseline_noise), np.nan)
+        new_baseline[is_kept] = baseline_noise_all.reshape(-1, waveform_baseline_noise)[old_rows[is_kept]]
+
+        new_baseline_noise_idx = np.hstack([(np.ones(waveform_baseline_noise) * cid) for cid in unique_id_new])
 
         print(f'Extracting unit index(s) {new_indexes_to_get}.. from detected splits')
 
         ##NOTE code here is repeated from extracting all units
-        n_clusters = unique_id_new.size
         # Get necessary info from param
         raw_data_file = param["raw_data_file"]
         meta_path = Path(param["ephys_meta_file"]) if param["ephys_meta_file"] is not None else None
@@ -906,7 +1338,7 @@ def check_extracted_waveforms(raw_waveforms_id_match, raw_waveforms_peak_channel
         n_sync_channels = param["nSyncChannels"]
         n_spikes_to_extract = param["nRawSpikesToExtract"]
         detrendWaveform = param["detrendWaveform"]
-        waveform_baseline_noise = param.get("waveformBaselineNoiseWindow", 20)
+        detrendForUnitMatch = param.get("detrendForUnitMatch", False)
         spike_width = param["spike_width"]
         save_multiple_raw = param.get("saveMultipleRaw", False)  # get and save data for UnitMatch
     
@@ -1026,9 +1458,8 @@ def check_extracted_waveforms(raw_waveforms_id_match, raw_waveforms_peak_channel
                 save_multiple_raw,
                 template_peak_ch,
             )
-            new_raw_waveforms_matching_ids[id] = tmp_raw_waveform_info['raw_waveforms_full']
-            new_peak_channels_matching_ids[id] = tmp_raw_waveform_info['raw_waveforms_peak_channel']
+            new_raw_waveform_full[unit_idx] = tmp_raw_waveform_info['raw_waveforms_full']
+            new_peak_channels[unit_idx] = tmp_raw_waveform_info['raw_waveforms_peak_channel']
+            new_baseline[unit_idx] = tmp_raw_waveform_info['average_baseline']
 
-        #remove all empty rows
-        new_raw_waveform_full = new_raw_waveforms_matching_ids[~np.isnan(new_raw_waveforms_matching_ids).all(axis=(1,2)),:,:]
-    return new_raw_waveforms_matching_ids, new_peak_channels_matching_ids, new_raw_waveform_full, new_baseline, new_baseline_noise_idx
\ No newline at end of file
+    return unique_id_new, new_peak_channels, new_raw_waveform_full, new_baseline.reshape(-1), new_baseline_noise_idx
\ No newline at end of file
@@ -5,13 +5,31 @@ import pandas as pd
 from matplotlib.figure import Figure
 
 from tqdm.auto import tqdm
+from joblib import Parallel, delayed, cpu_count
 
 from bombcell.extract_raw_waveforms import manage_data_compression, extract_raw_waveforms
-from bombcell.loading_utils import load_ephys_data
+from bombcell.loading_utils import (
+    load_ephys_data,
+    load_spike_positions,
+    get_spike_index,
+    get_cluster_rows,
+    load_bc_results,
+)
+from bombcell.ccg_fast import compute_acg_store, get_store_acg
 
 # import matplotlib.pyplot as plt
 import bombcell.quality_metrics as qm
-from bombcell.save_utils import get_metric_keys, save_results
+from bombcell.save_utils import (
+    get_metric_keys,
+    save_results,
+    get_stage_cache_key,
+    get_file_cache_key,
+    load_stage_cache,
+    save_stage_cache,
+    save_quality_metric_tsv,
+    save_params_as_parquet,
+    save_gui_data_store,
+)
 from bombcell.plot_functions import *
 
 
@@ -473,12 +491,77 @@ def set_unit_nan(unit_idx, quality_metrics, not_enough_spikes):
 
 
 
+def get_good_time_chunk_spike_times(spike_times, unit_metrics, param):
+    """
+    Gets a unit's spikes in its good time chunks (useTheseTimesStart to useTheseTimesStop),
+    or all its spikes if time chunks are not computed
+
+    Parameters
+    ----------
+    spike_times : ndarray
+        The unit's spike times in seconds
+    unit_metrics : dict
+        The unit's quality metrics
+    param : dict
+        The dictionary of parameters
+
+    Returns
+    -------
+    good_spike_times : ndarray
+        The spike times in good time chunks
+    """
+    if not (param and param.get('computeTimeChunks', False)):
+        return spike_times.copy()
+
+    good_start_times = unit_metrics.get('useTheseTimesStart', None)
+    good_stop_times = unit_metrics.get('useTheseTimesStop', None)
+    if good_start_times is None or good_stop_times is None:
+        return spike_times.copy()
+
+    if np.isscalar(good_start_times):
+        good_start_times = [good_start_times]
+    if np.isscalar(good_stop_times):
+        good_stop_times = [good_stop_times]
+
+    good_spike_mask = np.zeros(len(spike_times), dtype=bool)
+    for g_start, g_stop in zip(good_start_times, good_stop_times):
+        if not (np.isnan(g_start) or np.isnan(g_stop)):
+            good_spike_mask |= (spike_times >= g_start) & (spike_times <= g_stop)
+    return spike_times[good_spike_mask]
+
+
+def compute_gui_acg_store(spike_trains, param, cbin=0.5, cwin=100):
+    """
+    Computes the auto-correlograms shown in the GUI of all units at once, see ccg_fast.compute_acg_store
+
+    Parameters
+    ----------
+    spike_trains : list
+        The spike times in seconds of each unit, e.g. from get_good_time_chunk_spike_times
+    param : dict
+        The dictionary of parameters
+    cbin, cwin : float
+        The bin and window sizes in ms, by default those of the GUI
+
+    Returns
+    -------
+    acg_store : dict
+        The auto-correlogram counts of each unit, in the order of spike_trains
+    """
+    n_spikes = np.array([len(st) for st in spike_trains], dtype=np.int64)
+    unit_stops = np.cumsum(n_spikes)
+    spike_times = np.concatenate([np.zeros(0)] + [np.asarray(st, dtype=np.float64) for st in spike_trains])
+    spike_times_samples = np.round(spike_times * param['ephys_sample_rate']).astype(np.uint64)
+    # binned with acg()'s default sampling rate, as the GUI's auto-correlograms always were
+    return compute_acg_store(spike_times_samples, unit_stops - n_spikes, unit_stops, [(cbin, cwin)])
+
+
 def _precompute_unit_gui_data(unit_idx, unit_id, template_waveforms, quality_metrics, 
-                             spike_clusters, template_amplitudes, channel_positions, 
-                             gui_data, param, per_bin_data=None):
+                             unit_amplitudes, channel_positions, 
+                             gui_data, param, per_bin_data=None, template_row=None):
     """Helper function to precompute GUI data for a single unit during quality metrics computation"""
     try:
-        template = template_waveforms[unit_idx]
+        template = template_waveforms[unit_idx if template_row is None else template_row]
         max_ch = np.argmax(np.ptp(template, axis=0))
         waveform = template[:, max_ch]
         
@@ -657,9 +740,7 @@ def _precompute_unit_gui_data(unit_idx, unit_id, template_waveforms, quality_met
                     pass  # Skip if fitting fails
         
         # Amplitude distribution fit
-        spike_mask = spike_clusters == unit_id
-        if np.sum(spike_mask) > 50:
-            unit_amplitudes = template_amplitudes[spike_mask]
+        if len(unit_amplitudes) > 50:
             try:
                 hist, bin_edges = np.histogram(unit_amplitudes, bins=50, density=True)
                 bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
@@ -694,7 +775,7 @@ def _precompute_unit_gui_data(unit_idx, unit_id, template_waveforms, quality_met
             except:
                 pass  # Skip if fitting fails
         
-        # ACG placeholder (computed lazily in GUI)
+        # ACG placeholder, computed for all units at once in get_all_quality_metrics
         gui_data['acg_data'][unit_id] = None
         
         # Store per-bin data for time bin metrics plotting
@@ -709,17 +790,15 @@ def _precompute_unit_gui_data(unit_idx, unit_id, template_waveforms, quality_met
 
 
 def _save_gui_data(gui_data, save_path, unique_templates, param):
-    """Helper function to save GUI data"""
+    """Helper function to save GUI data, as a per-unit store (see save_utils.save_gui_data_store)"""
     try:
-        import pickle
         import os
         
         gui_folder = os.path.join(save_path, "for_GUI")
         os.makedirs(gui_folder, exist_ok=True)
-        gui_data_path = os.path.join(gui_folder, "gui_data.pkl")
+        gui_data_path = os.path.join(gui_folder, "gui_data")
         
-        with open(gui_data_path, 'wb') as f:
-            pickle.dump(gui_data, f)
+        save_gui_data_store(gui_data, gui_data_path)
             
         if param.get("verbose", False):
             spatial_decay_count = len(gui_data['spatial_decay_fits'])
@@ -733,6 +812,573 @@ def _save_gui_data(gui_data, save_path, unique_templates, param):
             print(f"GUI data saving failed (GUI will still work): {e}")
 
 
+def _get_unit_time_chunk_metrics(
+    unit_idx,
+    spike_index,
+    spike_times_by_unit,
+    amplitudes_by_unit,
+    time_chunks,
+    param,
+    hill_RPVs=None,
+    presence_ratio_counts=None,
+):
+    """
+    Runs the spikes missing, refractory period violations, time chunk and presence ratio
+    calculations for a single unit
+
+    Parameters
+    ----------
+    unit_idx : int
+        The bombcell index of the unit
+    spike_index : dict
+        The spike index from loading_utils.get_spike_index
+    spike_times_by_unit : ndarray
+        The spike times in seconds, ordered as in spike_index
+    amplitudes_by_unit : ndarray
+        The spike amplitudes, ordered as in spike_index
+    time_chunks, param :
+        See get_all_quality_metrics
+    hill_RPVs : tuple, optional
+        The fraction and number of refractory period violations of all units per time chunk, from
+        qm.get_hill_RP_violations, by default computed here with qm.fraction_RP_violations
+    presence_ratio_counts : tuple, optional
+        The session spike count matrix in presenceRatioBinSize bins from qm.get_spike_count_matrix
+        and its bin edges, by default the presence ratio bins are counted here
+
+    Returns
+    -------
+    unit_metrics : dict
+        The quality metric values for this unit
+    fraction_RPVs : ndarray
+        The fraction of refractory period violations for each tauR
+    unit_per_bin_data : dict
+        The per time chunk spikes missing and refractory period violations for the GUI
+    unit_runtimes : dict
+        The runtimes for each section
+    """
+    unit_metrics = {}
+    unit_runtimes = {}
+
+    unit_start = spike_index["unit_starts"][unit_idx]
+    unit_stop = spike_index["unit_stops"][unit_idx]
+    these_spike_idx = spike_index["spike_order"][unit_start:unit_stop]
+    these_spike_times = spike_times_by_unit[unit_start:unit_stop]
+    these_amplitudes = amplitudes_by_unit[unit_start:unit_stop]
+
+    # the unit's spikes in each time chunk, shared by the time-resolved metrics
+    chunk_slices = qm.get_time_bin_slices(these_spike_times, time_chunks[:-1], time_chunks[1:])
+
+    # percentage spikes missing
+    time_tmp = time.time()
+    (
+        percent_missing_gaussian,
+        percent_missing_symmetric,
+        perc_missing_per_bin_data
+    ) = qm.perc_spikes_missing(
+        these_amplitudes, these_spike_times, time_chunks, param, return_per_bin=True,
+        chunk_slices=chunk_slices,
+    )
+    unit_runtimes["spikes_missing_1"] = time.time() - time_tmp
+
+    # fraction contamination
+    time_tmp = time.time()
+    if hill_RPVs is None:
+        fraction_RPVs, num_violations, rpv_per_bin_data = qm.fraction_RP_violations(
+            these_spike_times, these_amplitudes, time_chunks, param, return_per_bin=True,
+            chunk_slices=chunk_slices,
+        )
+    else:
+        fraction_RPVs = hill_RPVs[0][unit_idx]
+        num_violations = hill_RPVs[1][unit_idx]
+        rpv_per_bin_data = {
+            'time_bins': time_chunks,
+            'fraction_RPVs_per_bin': fraction_RPVs.copy()
+        }
+    unit_runtimes["RPV_1"] = time.time() - time_tmp
+
+    # get time chunks to keep
+    time_tmp = time.time()
+    (
+        these_spike_times,
+        these_amplitudes,
+        these_spike_idx,
+        unit_metrics["useTheseTimesStart"],
+        unit_metrics["useTheseTimesStop"],
+        unit_metrics["RPV_window_index"],
+    ) = qm.time_chunks_to_keep(
+        percent_missing_gaussian,
+        fraction_RPVs,
+        time_chunks,
+        these_spike_times,
+        these_amplitudes,
+        these_spike_idx,
+        param,
+    )
+    unit_runtimes["chunks_to_keep"] = time.time() - time_tmp
+
+    use_these_times = np.array(
+        (
+            unit_metrics["useTheseTimesStart"],
+            unit_metrics["useTheseTimesStop"],
+        )
+    )
+    # re-compute percentage spikes missing and RPV on time chunks
+    time_tmp = time.time()
+    (
+        unit_metrics["percentageSpikesMissing_gaussian"],
+        unit_metrics["percentageSpikesMissing_symmetric"],
+    ) = qm.perc_spikes_missing(
+        these_amplitudes, these_spike_times, use_these_times, param, metric = True
+    )
+    unit_runtimes["spikes_missing_2"] = time.time() - time_tmp
+
+    time_tmp = time.time()
+    fraction_RPVs, num_violations = qm.fraction_RP_violations(
+        these_spike_times,
+        these_amplitudes,
+        use_these_times,
+        param)
+    unit_runtimes["RPV_2"] = time.time() - time_tmp
+    fraction_RPVs = fraction_RPVs[0] # only 'use_these_times', so single time chunk
+
+    unit_metrics["fractionRPVs_estimatedTauR"] = fraction_RPVs[
+        int(unit_metrics["RPV_window_index"])
+    ]
+
+    # get presence ratio
+    time_tmp = time.time()
+    spike_counts, bin_edges = None, None
+    if presence_ratio_counts is not None:
+        spike_counts = presence_ratio_counts[0][unit_idx]
+        bin_edges = presence_ratio_counts[1]
+    unit_metrics["presenceRatio"] = qm.presence_ratio(
+        these_spike_times,
+        unit_metrics["useTheseTimesStart"],
+        unit_metrics["useTheseTimesStop"],
+        param,
+        spike_counts=spike_counts,
+        bin_edges=bin_edges,
+    )
+    unit_runtimes["presence_ratio"] = time.time() - time_tmp
+
+    # number of spikes
+    unit_metrics["nSpikes"] = these_spike_times.shape[0]
+
+    unit_per_bin_data = {
+        'perc_missing': perc_missing_per_bin_data,
+        'rpv': rpv_per_bin_data,
+    }
+    if presence_ratio_counts is not None:
+        unit_per_bin_data['spike_counts'] = {
+            'time_bins': bin_edges,
+            'spike_counts_per_bin': spike_counts.copy(),
+        }
+
+    return unit_metrics, fraction_RPVs, unit_per_bin_data, unit_runtimes
+
+
+def _get_all_units_drift_metrics(
+    unit_idxs,
+    unique_templates,
+    spike_index,
+    spike_times_by_unit,
+    use_these_times_start,
+    use_these_times_stop,
+    pc_features,
+    pc_features_idx,
+    channel_positions,
+    param,
+    spike_depths=None,
+):
+    """
+    Runs the drift calculations for all units at once, on the spikes in each unit's kept time chunks.
+    The spike depths are computed in one chunked pass and the per time bin medians with one segmented median.
+
+    Parameters
+    ----------
+    unit_idxs : ndarray
+        The bombcell indexes of the units to run
+    unique_templates, pc_features, pc_features_idx, channel_positions, param :
+        See get_all_quality_metrics
+    spike_index : dict
+        The spike index from loading_utils.get_spike_index
+    spike_times_by_unit : ndarray
+        The spike times in seconds, ordered as in spike_index
+    use_these_times_start, use_these_times_stop : ndarray
+        The start and stop of the kept time chunks of each unit
+    spike_depths : ndarray, optional
+        The depth of every spike, if given pc_features are not used
+
+    Returns
+    -------
+    unit_results : list
+        For each unit, the quality metric values, the per time bin drift for the GUI and the runtimes
+    """
+    time_tmp = time.time()
+
+    # same spikes as kept by time_chunks_to_keep, as a slice of each unit's spikes
+    keep_starts = np.zeros(len(unit_idxs), dtype=int)
+    keep_stops = np.zeros(len(unit_idxs), dtype=int)
+    for i, unit_idx in enumerate(unit_idxs):
+        unit_start = spike_index["unit_starts"][unit_idx]
+        these_spike_times = spike_times_by_unit[unit_start : spike_index["unit_stops"][unit_idx]]
+        keep_starts[i] = unit_start + np.searchsorted(
+            these_spike_times, use_these_times_start[unit_idx], side="left"
+        )
+        keep_stops[i] = unit_start + np.searchsorted(
+            these_spike_times, use_these_times_stop[unit_idx], side="right"
+        )
+
+    # gather the kept spikes of all units and get their depths
+    n_kept = keep_stops - keep_starts
+    kept_spikes = np.arange(n_kept.sum()) + np.repeat(
+        keep_starts - np.concatenate(([0], np.cumsum(n_kept)[:-1])), n_kept
+    )
+    kept_starts = np.concatenate(([0], np.cumsum(n_kept)[:-1]))
+    if spike_depths is not None:
+        kept_spike_depths = np.asarray(spike_depths[spike_index["spike_order"][kept_spikes]], dtype=np.float64)
+    else:
+        kept_spike_depths = qm.get_spike_depths(
+            pc_features,
+            pc_features_idx,
+            spike_index["spike_order"][kept_spikes],
+            np.repeat(unique_templates[unit_idxs], n_kept),
+            channel_positions,
+        )
+
+    max_drift_estimates, cumulative_drift_estimates, drift_per_bin_data = qm.get_drift_estimates(
+        spike_times_by_unit[kept_spikes], kept_spike_depths, kept_starts, kept_starts + n_kept, param
+    )
+
+    unit_runtimes = {"max_drift": (time.time() - time_tmp) / max(len(unit_idxs), 1)}
+    return [
+        (
+            {
+                "maxDriftEstimate": max_drift_estimates[i],
+                "cumDriftEstimate": cumulative_drift_estimates[i],
+            },
+            drift_per_bin_data[i],
+            unit_runtimes,
+        )
+        for i in range(len(unit_idxs))
+    ]
+
+
+def _get_unit_waveform_metrics(
+    unit_idx,
+    unique_templates,
+    template_rows,
+    template_waveforms,
+    max_channels,
+    channel_positions,
+    param,
+):
+    """
+    Runs the template waveform shape calculations for a single unit
+
+    Parameters
+    ----------
+    unit_idx : int
+        The bombcell index of the unit
+    template_rows : ndarray
+        The row of template_waveforms of each unit
+    unique_templates, template_waveforms, channel_positions, param :
+        See get_all_quality_metrics
+    max_channels : ndarray
+        The max channel of each row of template_waveforms
+
+    Returns
+    -------
+    unit_metrics : dict
+        The quality metric values for this unit
+    unit_gui_data : dict
+        The peak and trough locations for the GUI
+    unit_runtimes : dict
+        The runtimes for each section
+    """
+    unit_metrics = {}
+    unit_gui_data = {}
+    unit_runtimes = {}
+    this_unit = unique_templates[unit_idx]
+
+    # waveform
+    time_tmp = time.time()
+    waveform_baseline_window = np.array(
+        (
+            param["waveform_baseline_window_start"],
+            param["waveform_baseline_window_stop"],
+        )
+    )
+
+    (
+        unit_metrics["nPeaks"],
+        unit_metrics["nTroughs"],
+        unit_metrics["waveformDuration_peakTrough"],
+        unit_metrics["spatialDecaySlope"],
+        unit_metrics["waveformBaselineFlatness"],
+        unit_metrics["scndPeakToTroughRatio"],
+        unit_metrics["peak1ToPeak2Ratio"],
+        unit_metrics["mainPeakToTroughRatio"],
+        unit_metrics["troughToPeak2Ratio"],
+        unit_metrics["mainPeak_before_width"],
+        unit_metrics["mainTrough_width"],
+        peak_locs_gui,
+        trough_locs_gui,
+        peak_loc_for_duration_gui,
+        trough_loc_for_duration_gui,
+        param,
+    ) = qm.waveform_shape(
+        template_waveforms,
+        template_rows[unit_idx],
+        max_channels,
+        channel_positions,
+        waveform_baseline_window,
+        param,
+    )
+    unit_runtimes["waveform_shape"] = time.time() - time_tmp
+
+    # Store GUI-specific data, handling numpy arrays and NaN values properly
+    unit_gui_data['peak_locations'] = {}
+    unit_gui_data['trough_locations'] = {}
+    unit_gui_data['peak_loc_for_duration'] = {}
+    unit_gui_data['trough_loc_for_duration'] = {}
+    try:
+        if hasattr(peak_locs_gui, '__len__') and len(peak_locs_gui) > 0:
+            unit_gui_data['peak_locations'][this_unit] = peak_locs_gui.tolist() if hasattr(peak_locs_gui, 'tolist') else peak_locs_gui
+        else:
+            unit_gui_data['peak_locations'][this_unit] = []
+            
+        if hasattr(trough_locs_gui, '__len__') and len(trough_locs_gui) > 0:
+            unit_gui_data['trough_locations'][this_unit] = trough_locs_gui.tolist() if hasattr(trough_locs_gui, 'tolist') else trough_locs_gui
+        else:
+            unit_gui_data['trough_locations'][this_unit] = []
+            
+        unit_gui_data['peak_loc_for_duration'][this_unit] = peak_loc_for_duration_gui if not np.isnan(peak_loc_for_duration_gui) else None
+        unit_gui_data['trough_loc_for_duration'][this_unit] = trough_loc_for_duration_gui if not np.isnan(trough_loc_for_duration_gui) else None
+    except Exception as e:
+        # Fallback to empty if there's any issue
+        unit_gui_data['peak_locations'][this_unit] = []
+        unit_gui_data['trough_locations'][this_unit] = []
+        unit_gui_data['peak_loc_for_duration'][this_unit] = None
+        unit_gui_data['trough_loc_for_duration'][this_unit] = None
+
+    return unit_metrics, unit_gui_data, unit_runtimes
+
+
+def _get_unit_distance_metrics(
+    unit_idx,
+    unique_templates,
+    spike_index,
+    channel_index,
+    spike_clusters,
+    pc_features,
+    pc_features_idx,
+    param,
+):
+    """
+    Runs the isolation distance, L-ratio and silhouette score calculations for a single unit
+
+    Parameters
+    ----------
+    unit_idx : int
+        The bombcell index of the unit
+    unique_templates, spike_clusters, pc_features, pc_features_idx, param :
+        See get_all_quality_metrics
+    spike_index : dict
+        The spike index from loading_utils.get_spike_index
+    channel_index : dict
+        The channel index from quality_metrics.get_channel_unit_index
+
+    Returns
+    -------
+    unit_metrics : dict
+        The quality metric values for this unit
+    unit_runtimes : dict
+        The runtimes for each section
+    """
+    unit_metrics = {}
+    unit_runtimes = {}
+
+    time_tmp = time.time()
+    (
+        unit_metrics["isolationDistance"],
+        unit_metrics["Lratio"],
+        unit_metrics["silhouetteScore"],
+    ) = qm.get_distance_metrics(
+        pc_features, pc_features_idx, unique_templates[unit_idx], spike_clusters, param,
+        spike_index=spike_index, channel_index=channel_index,
+    )
+    unit_runtimes["dist_metrics"] = time.time() - time_tmp
+
+    return unit_metrics, unit_runtimes
+
+
+def _get_unit_gui_data(
+    unit_idx,
+    unique_templates,
+    template_rows,
+    template_waveforms,
+    quality_metrics,
+    spike_index,
+    amplitudes_by_unit,
+    channel_positions,
+    waveform_gui_data_by_unit,
+    per_bin_data_by_unit,
+    param,
+):
+    """
+    Precomputes the GUI data for a single unit, from the results of the quality metric stages
+
+    Parameters
+    ----------
+    unit_idx : int
+        The bombcell index of the unit
+    unique_templates, template_waveforms, quality_metrics, channel_positions, param :
+        See get_all_quality_metrics
+    template_rows : ndarray
+        The row of template_waveforms of each unit
+    spike_index : dict
+        The spike index from loading_utils.get_spike_index
+    amplitudes_by_unit : ndarray
+        The spike amplitudes, ordered as in spike_index
+    waveform_gui_data_by_unit : dict
+        The peak and trough locations from _get_unit_waveform_metrics of each unit
+    per_bin_data_by_unit : dict
+        The per time bin spikes missing, refractory period violations and drift of each unit
+
+    Returns
+    -------
+    unit_gui_data : dict
+        The GUI data for this unit
+    """
+    unit_gui_data = {k: dict(v) for k, v in waveform_gui_data_by_unit[unit_idx].items()}
+
+    # Precompute GUI data during quality metrics computation
+    if 0 <= template_rows[unit_idx] < len(template_waveforms):
+        unit_start = spike_index["unit_starts"][unit_idx]
+        unit_stop = spike_index["unit_stops"][unit_idx]
+        unit_metrics = {k: v[unit_idx] for k, v in quality_metrics.items()}
+        for k in ['spatial_decay_fits', 'amplitude_fits', 'channel_arrangements',
+                  'waveform_scaling', 'acg_data']:
+            unit_gui_data[k] = {}
+        _precompute_unit_gui_data(unit_idx, unique_templates[unit_idx], template_waveforms, unit_metrics, 
+                                amplitudes_by_unit[unit_start:unit_stop], channel_positions, 
+                                unit_gui_data, param, per_bin_data_by_unit[unit_idx],
+                                template_row=template_rows[unit_idx])
+
+    return unit_gui_data
+
+
+def _get_param_subset(param, param_keys):
+    """Returns the values of param_keys in param, None for missing keys"""
+    return {k: param.get(k) for k in param_keys}
+
+
+def _get_unit_batch_results(unit_function, unit_batch, *unit_args):
+    """Runs unit_function on a batch of units, used by the parallel workers"""
+    return [unit_function(unit_idx, *unit_args) for unit_idx in unit_batch]
+
+
+def _run_per_unit(unit_function, unit_idxs, unit_args, param, description):
+    """
+    Runs unit_function on each unit, serially or split into batches for parallel workers
+
+    Parameters
+    ----------
+    unit_function : function
+        The function to run, called as unit_function(unit_idx, *unit_args)
+    unit_idxs : ndarray
+        The bombcell indexes of the units to run
+    unit_args : tuple
+        The other arguments of unit_function
+    param : dict
+        The dictionary of parameters
+    description : str
+        The description shown in the progress bar
+
+    Returns
+    -------
+    unit_results : list
+        The results of unit_function for each unit, in the order of unit_idxs
+    """
+    # run units serially, or split them into batches for parallel workers. Large
+    # arrays are shared with the workers as read-only memmaps rather than pickled
+    n_jobs = param.get("nJobs", 1)
+    bar_description = description + ": {percentage:3.0f}%|{bar:10}| {n}/{total} units"
+    if n_jobs is None or n_jobs == 1 or param.get("plotDetails", False) or len(unit_idxs) == 0:
+        return [
+            unit_function(unit_idx, *unit_args)
+            for unit_idx in tqdm(unit_idxs, bar_format=bar_description)
+        ]
+
+    n_workers = cpu_count() if n_jobs < 0 else n_jobs
+    unit_batches = np.array_split(unit_idxs, min(len(unit_idxs), n_workers * 4))
+    batch_results = Parallel(n_jobs=n_jobs, mmap_mode="r", max_nbytes="1M")(
+        delayed(_get_unit_batch_results)(unit_function, unit_batch, *unit_args)
+        for unit_batch in tqdm(unit_batches, bar_format=bar_description.replace("units", "unit batches"))
+    )
+    return [result for batch in batch_results for result in batch]
+
+
+def _get_input_key(input_file_keys, input_name, *input_arrays):
+    """
+    The cache key of a large input, from the files it was loaded from if known (see
+    save_utils.get_file_cache_key), otherwise from a hash of its arrays
+    """
+    if input_file_keys is not None and input_name in input_file_keys:
+        return input_file_keys[input_name]
+    return get_stage_cache_key(*input_arrays)
+
+
+def _run_cached_stage(
+    stage, key_inputs, unit_function, unit_idxs, unit_args, param, save_path, description, all_units=False
+):
+    """
+    Runs a quality metric stage with _run_per_unit, or loads its results if the stage was already
+    run on the same inputs and parameters
+
+    Parameters
+    ----------
+    stage : str
+        The name of the stage
+    key_inputs : function
+        Returns everything the stage results depend on: input arrays (or keys of the files they were
+        loaded from) and the parameters the stage reads. Only called if the stage is cached
+    unit_function, unit_idxs, unit_args, param, description :
+        See _run_per_unit
+    save_path : str
+        Bombcell results saving path, the cache is saved in save_path/_bc_cache
+    all_units : bool, optional
+        If True unit_function processes all units in one call, as unit_function(unit_idxs, *unit_args),
+        and returns the list of results, by default False
+
+    Returns
+    -------
+    unit_results : list
+        The results of unit_function for each unit, in the order of unit_idxs
+    """
+    # plotDetails makes figures while computing, so always recompute
+    use_cache = param.get("cacheQualityMetrics", True) and not param.get("plotDetails", False)
+    if use_cache:
+        stage_key = get_stage_cache_key(stage, unit_idxs, *key_inputs())
+        unit_results = load_stage_cache(save_path, stage, stage_key)
+        if unit_results is not None:
+            if param.get("verbose", False):
+                print(f"Loaded cached {stage} quality metrics")
+            return unit_results
+
+    if all_units:
+        if param.get("verbose", False):
+            print(description)
+        unit_results = unit_function(unit_idxs, *unit_args)
+    else:
+        unit_results = _run_per_unit(unit_function, unit_idxs, unit_args, param, description)
+
+    if use_cache:
+        save_stage_cache(save_path, stage, stage_key, unit_results)
+    return unit_results
+
+
 def get_all_quality_metrics(
     unique_templates,
     spike_times_seconds,
@@ -748,6 +1394,9 @@ def get_all_quality_metrics(
     param,
     save_path,
     gui_data=None,
+    spike_depths=None,
+    template_ids=None,
+    input_file_keys=None,
 ):
     """
     This function runs all of the quality metric calculations
@@ -780,6 +1429,16 @@ def get_all_quality_metrics(
         The dictionary of parameters
     save_path: str
         Bombcell results saving path
+    spike_depths : ndarray, optional
+        The depth of each spike (e.g. from Kilosort 4's spike_positions.npy), if given drift is
+        computed from these instead of pc_features
+    template_ids : ndarray, optional
+        The cluster id of each row of template_waveforms (see loading_utils.load_ephys_data with
+        compact_templates), by default None (row i of template_waveforms is cluster i)
+    input_file_keys : dict, optional
+        Cache keys of the files 'pc_features', 'spike_depths' and 'template_waveforms' were loaded from
+        (see save_utils.get_file_cache_key), used by the cached stages instead of hashing these arrays,
+        by default None
 
     Returns
     -------
@@ -818,226 +1477,254 @@ def get_all_quality_metrics(
 
     not_enough_spikes = np.zeros(unique_templates.size)
     bad_units = 0
-    bar_description = "Computing bombcell quality metrics: {percentage:3.0f}%|{bar:10}| {n}/{total} units"
-    for unit_idx in tqdm(range(unique_templates.size), bar_format=bar_description):
-        this_unit = unique_templates[unit_idx]
-        quality_metrics["phy_clusterID"][unit_idx] = this_unit
-
-        these_spike_times = spike_times_seconds[spike_clusters == this_unit]
-        these_amplitudes = template_amplitudes[spike_clusters == this_unit]
-
-        # number of spikes
-        quality_metrics["nSpikes"][unit_idx] = these_spike_times.shape[0]
 
+    # index spikes by unit once, so each unit's spikes are a contiguous slice
+    spike_index = get_spike_index(spike_clusters, unique_templates)
+    spike_times_by_unit = spike_times_seconds[spike_index["spike_order"]]
+    amplitudes_by_unit = template_amplitudes[spike_index["spike_order"]]
 
-        if these_spike_times.size < 50:
-            quality_metrics, not_enough_spikes = set_unit_nan(
-                unit_idx, quality_metrics, not_enough_spikes
-            )
-            bad_units += 1
-            continue
-
-        # percentage spikes missing
-        time_tmp = time.time()
-        (
-            percent_missing_gaussian,
-            percent_missing_symmetric,
-            perc_missing_per_bin_data
-        ) = qm.perc_spikes_missing(
-            these_amplitudes, these_spike_times, time_chunks, param, return_per_bin=True
+    # template_waveforms row and peak channel of each unit, quality_metrics["maxChannels"] is indexed by cluster id
+    if template_ids is None:
+        template_rows = unique_templates
+        template_max_channels = quality_metrics["maxChannels"]
+    else:
+        template_rows = get_cluster_rows(template_ids, unique_templates)
+        template_max_channels = quality_metrics["maxChannels"][template_ids]
+
+    # units with too few spikes are not computed
+    n_spikes = spike_index["unit_stops"] - spike_index["unit_starts"]
+    quality_metrics["phy_clusterID"][:] = unique_templates
+    quality_metrics["nSpikes"][:] = n_spikes
+    units_to_compute = np.flatnonzero(n_spikes >= 50)
+    for unit_idx in np.flatnonzero(n_spikes < 50):
+        quality_metrics, not_enough_spikes = set_unit_nan(
+            unit_idx, quality_metrics, not_enough_spikes
         )
-        runtimes_spikes_missing_1[unit_idx] = time.time() - time_tmp
+        bad_units += 1
 
-        # fraction contamination
-        time_tmp = time.time()
-        fraction_RPVs, num_violations, rpv_per_bin_data = qm.fraction_RP_violations(
-            these_spike_times, these_amplitudes, time_chunks, param, return_per_bin=True
+    # waveform_shape switches spatial decay off for sparse channel layouts, decide
+    # this once here so every worker uses the same setting
+    if param["computeSpatialDecay"]:
+        param["computeSpatialDecay"] = bool(
+            np.min(np.diff(np.unique(channel_positions[:, 1]))) < 30
         )
-        runtimes_RPV_1[unit_idx] = time.time() - time_tmp
 
-        # get time chunks to keep
-        time_tmp = time.time()
-        (
-            these_spike_times,
-            these_amplitudes,
-            these_spike_clusters,
-            quality_metrics["useTheseTimesStart"][unit_idx],
-            quality_metrics["useTheseTimesStop"][unit_idx],
-            quality_metrics["RPV_window_index"][unit_idx],
-        ) = qm.time_chunks_to_keep(
-            percent_missing_gaussian,
-            fraction_RPVs,
-            time_chunks,
-            these_spike_times,
-            these_amplitudes,
-            spike_clusters,
-            spike_times_seconds,
-            param,
+    # raw amplitudes of all units at once, using the template's peak channels (raw_waveforms_full
+    # has one row per unit, maxChannels is indexed by cluster id)
+    if raw_waveforms_full is not None and param["extractRaw"] and param["gain_to_uV"] is not None:
+        raw_amplitudes = qm.get_raw_amplitudes(
+            raw_waveforms_full, param["gain_to_uV"], quality_metrics["maxChannels"][unique_templates]
         )
-        runtimes_chunks_to_keep[unit_idx] = time.time() - time_tmp
-
-        use_these_times = np.array(
-            (
-                quality_metrics["useTheseTimesStart"][unit_idx],
-                quality_metrics["useTheseTimesStop"][unit_idx],
-            )
+        quality_metrics["rawAmplitude"][units_to_compute] = raw_amplitudes[units_to_compute]
+
+    # each stage is cached on the arrays and parameters it reads, so changing a parameter only
+    # recomputes the stages that depend on it. The keys are only built if stages are cached
+    time_chunk_param_keys = [
+        "tauR_valuesMin", "tauR_valuesMax", "tauR_valuesStep", "tauC", "hillOrLlobetMethod",
+        "RPV_tauR_estimate", "presenceRatioBinSize", "computeTimeChunks",
+    ]
+    if param["computeTimeChunks"]:
+        # only used to select time chunks
+        time_chunk_param_keys += ["maxRPVviolations", "maxPercSpikesMissing"]
+    # the Hill et al. estimator is solved for every unit, time chunk and tauR value at once
+    hill_RPVs = None
+    if param["hillOrLlobetMethod"] and not param.get("plotDetails", False):
+        hill_RPVs = qm.get_hill_RP_violations(
+            spike_times_by_unit, spike_index["unit_starts"], spike_index["unit_stops"], time_chunks, param
         )
-        # re-compute percentage spikes missing and RPV on time chunks
-        time_tmp = time.time()
+    # spike counts of every unit in presence ratio bins over the whole session, each unit's
+    # presence ratio and the GUI's firing rate are slices of this
+    presence_ratio_edges = np.arange(
+        time_chunks[0], time_chunks[-1] + param["presenceRatioBinSize"], param["presenceRatioBinSize"]
+    )
+    presence_ratio_counts = (
+        qm.get_spike_count_matrix(spike_times_seconds, spike_clusters, unique_templates, presence_ratio_edges),
+        presence_ratio_edges,
+    )
+    time_chunk_results = _run_cached_stage(
+        "time_chunks",
+        lambda: (
+            spike_times_by_unit,
+            amplitudes_by_unit,
+            unique_templates,
+            spike_index["unit_starts"],
+            spike_index["unit_stops"],
+            time_chunks,
+            _get_param_subset(param, time_chunk_param_keys),
+        ),
+        _get_unit_time_chunk_metrics,
+        units_to_compute,
         (
-            quality_metrics["percentageSpikesMissing_gaussian"][unit_idx],
-            quality_metrics["percentageSpikesMissing_symmetric"][unit_idx],
-        ) = qm.perc_spikes_missing(
-            these_amplitudes, these_spike_times, use_these_times, param, metric = True
-        )
-        runtimes_spikes_missing_2[unit_idx] = time.time() - time_tmp
-
-        time_tmp = time.time()
-        fraction_RPVs, num_violations = qm.fraction_RP_violations(
-            these_spike_times,
-            these_amplitudes,
-            use_these_times,
-            param)
-        runtimes_RPV_2[unit_idx] = time.time() - time_tmp
-        fraction_RPVs = fraction_RPVs[0] # only 'use_these_times', so single time chunk
-
-        quality_metrics["fractionRPVs_estimatedTauR"][unit_idx] = fraction_RPVs[
-            int(quality_metrics["RPV_window_index"][unit_idx])
-        ]
-        RPV_tauR_estimate_units_NtauR.append([unit_idx, fraction_RPVs])
-
-        # get presence ratio
-        time_tmp = time.time()
-        quality_metrics["presenceRatio"][unit_idx] = qm.presence_ratio(
-            these_spike_times,
-            quality_metrics["useTheseTimesStart"][unit_idx],
-            quality_metrics["useTheseTimesStop"][unit_idx],
+            spike_index,
+            spike_times_by_unit,
+            amplitudes_by_unit,
+            time_chunks,
             param,
-        )
-        runtimes_presence_ratio[unit_idx] = time.time() - time_tmp
-
-        # maximum cumulative drift estimate
-        time_tmp = time.time()
+            hill_RPVs,
+            presence_ratio_counts,
+        ),
+        param,
+        save_path,
+        "Computing time chunk metrics",
+    )
+    for unit_idx, (unit_metrics, fraction_RPVs, unit_per_bin_data, unit_runtimes) in zip(
+        units_to_compute, time_chunk_results
+    ):
+        for k, v in unit_metrics.items():
+            quality_metrics[k][unit_idx] = v
+        RPV_tauR_estimate_units_NtauR.append([unit_idx, fraction_RPVs])
+        runtimes_spikes_missing_1[unit_idx] = unit_runtimes["spikes_missing_1"]
+        runtimes_RPV_1[unit_idx] = unit_runtimes["RPV_1"]
+        runtimes_chunks_to_keep[unit_idx] = unit_runtimes["chunks_to_keep"]
+        runtimes_spikes_missing_2[unit_idx] = unit_runtimes["spikes_missing_2"]
+        runtimes_RPV_2[unit_idx] = unit_runtimes["RPV_2"]
+        runtimes_presence_ratio[unit_idx] = unit_runtimes["presence_ratio"]
+
+    drift_results = _run_cached_stage(
+        "drift",
+        lambda: (
+            _get_input_key(input_file_keys, "pc_features", pc_features, pc_features_idx)
+            if spike_depths is None else _get_input_key(input_file_keys, "spike_depths", spike_depths),
+            spike_times_by_unit,
+            unique_templates,
+            quality_metrics["useTheseTimesStart"],
+            quality_metrics["useTheseTimesStop"],
+            channel_positions,
+            _get_param_subset(param, ["driftBinSize"]),
+        ),
+        _get_all_units_drift_metrics,
+        units_to_compute,
         (
-            quality_metrics["maxDriftEstimate"][unit_idx],
-            quality_metrics["cumDriftEstimate"][unit_idx],
-            drift_per_bin_data
-        ) = qm.max_drift_estimate(
+            unique_templates,
+            spike_index,
+            spike_times_by_unit,
+            quality_metrics["useTheseTimesStart"],
+            quality_metrics["useTheseTimesStop"],
             pc_features,
             pc_features_idx,
-            these_spike_clusters,
-            these_spike_times,
-            this_unit,
             channel_positions,
             param,
-            return_per_bin=True
-        )
-        runtimes_max_drift[unit_idx] = time.time() - time_tmp
-
-        # number of spikes
-        quality_metrics["nSpikes"][unit_idx] = these_spike_times.shape[0]
+            spike_depths,
+        ),
+        param,
+        save_path,
+        "Computing drift metrics",
+        all_units=True,
+    )
+    for unit_idx, (unit_metrics, drift_per_bin_data, unit_runtimes) in zip(units_to_compute, drift_results):
+        for k, v in unit_metrics.items():
+            quality_metrics[k][unit_idx] = v
+        runtimes_max_drift[unit_idx] = unit_runtimes["max_drift"]
+
+    waveform_results = _run_cached_stage(
+        "waveform",
+        lambda: (
+            _get_input_key(input_file_keys, "template_waveforms", template_waveforms),
+            unique_templates,
+            template_rows,
+            template_max_channels,
+            channel_positions,
+            _get_param_subset(param, [
+                "waveform_baseline_window_start", "waveform_baseline_window_stop", "computeSpatialDecay",
+                "ephys_sample_rate", "minThreshDetectPeaksTroughs", "normalizeSpDecay", "spDecayLinFit",
+            ]),
+        ),
+        _get_unit_waveform_metrics,
+        units_to_compute,
+        (unique_templates, template_rows, template_waveforms, template_max_channels, channel_positions, param),
+        param,
+        save_path,
+        "Computing waveform metrics",
+    )
+    for unit_idx, (unit_metrics, unit_gui_data, unit_runtimes) in zip(units_to_compute, waveform_results):
+        for k, v in unit_metrics.items():
+            quality_metrics[k][unit_idx] = v
+        runtimes_waveform_shape[unit_idx] = unit_runtimes["waveform_shape"]
 
-        # waveform
-        time_tmp = time.time()
-        waveform_baseline_window = np.array(
+    if param["computeDistanceMetrics"]:
+        distance_results = _run_cached_stage(
+            "distance",
+            lambda: (
+                _get_input_key(input_file_keys, "pc_features", pc_features, pc_features_idx),
+                spike_clusters,
+                unique_templates,
+                _get_param_subset(param, ["nChannelsIsoDist"]),
+            ),
+            _get_unit_distance_metrics,
+            units_to_compute,
             (
-                param["waveform_baseline_window_start"],
-                param["waveform_baseline_window_stop"],
-            )
+                unique_templates,
+                spike_index,
+                qm.get_channel_unit_index(pc_features_idx, unique_templates),
+                spike_clusters,
+                pc_features,
+                pc_features_idx,
+                param,
+            ),
+            param,
+            save_path,
+            "Computing distance metrics",
         )
-
+        for unit_idx, (unit_metrics, unit_runtimes) in zip(units_to_compute, distance_results):
+            for k, v in unit_metrics.items():
+                quality_metrics[k][unit_idx] = v
+            runtime_dist_metrics[unit_idx] = unit_runtimes["dist_metrics"]
+
+    # GUI data depends on several stages, always recompute it
+    waveform_gui_data_by_unit = {
+        unit_idx: waveform_result[1] for unit_idx, waveform_result in zip(units_to_compute, waveform_results)
+    }
+    per_bin_data_by_unit = {
+        unit_idx: {**time_chunk_result[2], "drift": drift_result[1]}
+        for unit_idx, time_chunk_result, drift_result in zip(units_to_compute, time_chunk_results, drift_results)
+    }
+    unit_gui_results = _run_per_unit(
+        _get_unit_gui_data,
+        units_to_compute,
         (
-            quality_metrics["nPeaks"][unit_idx],
-            quality_metrics["nTroughs"][unit_idx],
-            quality_metrics["waveformDuration_peakTrough"][unit_idx],
-            quality_metrics["spatialDecaySlope"][unit_idx],
-            quality_metrics["waveformBaselineFlatness"][unit_idx],
-            quality_metrics["scndPeakToTroughRatio"][unit_idx],
-            quality_metrics["peak1ToPeak2Ratio"][unit_idx],
-            quality_metrics["mainPeakToTroughRatio"][unit_idx],
-            quality_metrics["troughToPeak2Ratio"][unit_idx],
-            quality_metrics["mainPeak_before_width"][unit_idx],
-            quality_metrics["mainTrough_width"][unit_idx],
-            peak_locs_gui,
-            trough_locs_gui,
-            peak_loc_for_duration_gui,
-            trough_loc_for_duration_gui,
-            param,
-        ) = qm.waveform_shape(
+            unique_templates,
+            template_rows,
             template_waveforms,
-            this_unit,
-            quality_metrics["maxChannels"],
+            quality_metrics,
+            spike_index,
+            amplitudes_by_unit,
             channel_positions,
-            waveform_baseline_window,
+            waveform_gui_data_by_unit,
+            per_bin_data_by_unit,
             param,
+        ),
+        param,
+        "Precomputing GUI data",
+    )
+    for unit_gui_data in unit_gui_results:
+        for k, unit_values in unit_gui_data.items():
+            if k not in gui_data:
+                gui_data[k] = {}
+            gui_data[k].update(unit_values)
+
+    # GUI auto-correlograms of the spikes in good time chunks, in one pass over all units
+    acg_units = [unit_idx for unit_idx in units_to_compute if unique_templates[unit_idx] in gui_data['acg_data']]
+    if len(acg_units) > 0:
+        acg_cbin, acg_cwin = 0.5, 100
+        acg_store = compute_gui_acg_store(
+            [
+                get_good_time_chunk_spike_times(
+                    spike_times_by_unit[spike_index["unit_starts"][unit_idx]:spike_index["unit_stops"][unit_idx]],
+                    {k: quality_metrics[k][unit_idx] for k in ["useTheseTimesStart", "useTheseTimesStop"]},
+                    param,
+                )
+                for unit_idx in acg_units
+            ],
+            param,
+            acg_cbin,
+            acg_cwin,
         )
-        runtimes_waveform_shape[unit_idx] = time.time() - time_tmp
-
-        # Store GUI-specific data if it's being precomputed
-        if gui_data is not None:
-            # Initialize GUI data keys if they don't exist
-            if 'peak_locations' not in gui_data:
-                gui_data['peak_locations'] = {}
-            if 'trough_locations' not in gui_data:
-                gui_data['trough_locations'] = {}
-            if 'peak_loc_for_duration' not in gui_data:
-                gui_data['peak_loc_for_duration'] = {}
-            if 'trough_loc_for_duration' not in gui_data:
-                gui_data['trough_loc_for_duration'] = {}
-            
-            # Store the data, handling numpy arrays and NaN values properly
-            try:
-                if hasattr(peak_locs_gui, '__len__') and len(peak_locs_gui) > 0:
-                    gui_data['peak_locations'][this_unit] = peak_locs_gui.tolist() if hasattr(peak_locs_gui, 'tolist') else peak_locs_gui
-                else:
-                    gui_data['peak_locations'][this_unit] = []
-                    
-                if hasattr(trough_locs_gui, '__len__') and len(trough_locs_gui) > 0:
-                    gui_data['trough_locations'][this_unit] = trough_locs_gui.tolist() if hasattr(trough_locs_gui, 'tolist') else trough_locs_gui
-                else:
-                    gui_data['trough_locations'][this_unit] = []
-                    
-                gui_data['peak_loc_for_duration'][this_unit] = peak_loc_for_duration_gui if not np.isnan(peak_loc_for_duration_gui) else None
-                gui_data['trough_loc_for_duration'][this_unit] = trough_loc_for_duration_gui if not np.isnan(trough_loc_for_duration_gui) else None
-            except Exception as e:
-                # Fallback to empty if there's any issue
-                gui_data['peak_locations'][this_unit] = []
-                gui_data['trough_locations'][this_unit] = []
-                gui_data['peak_loc_for_duration'][this_unit] = None
-                gui_data['trough_loc_for_duration'][this_unit] = None
-
-        # amplitude
-        if raw_waveforms_full is not None and param["extractRaw"] and param['gain_to_uV'] is not None:
-            # Use the template's peak channel for raw amplitude calculation
-            template_peak_channel = quality_metrics["maxChannels"][unit_idx]
-            quality_metrics["rawAmplitude"][unit_idx] = qm.get_raw_amplitude(
-                raw_waveforms_full[unit_idx], param["gain_to_uV"], peak_channel=template_peak_channel
-            )
-        else:
-            quality_metrics["rawAmplitude"][unit_idx] = np.nan
-
-        time_tmp = time.time()
-        if param["computeDistanceMetrics"]:
-            (
-                quality_metrics["isolationDistance"][unit_idx],
-                quality_metrics["Lratio"][unit_idx],
-                quality_metrics["silhouetteScore"][unit_idx],
-            ) = qm.get_distance_metrics(
-                pc_features, pc_features_idx, this_unit, spike_clusters, param
-            )
-        runtime_dist_metrics = time.time() - time_tmp
-
-        # Precompute GUI data during quality metrics computation
-        if unit_idx < len(template_waveforms):
-            # Collect per-bin data for this unit
-            unit_per_bin_data = {
-                'perc_missing': perc_missing_per_bin_data,
-                'rpv': rpv_per_bin_data,
-                'drift': drift_per_bin_data
+        for unit_row, unit_idx in enumerate(acg_units):
+            gui_data['acg_data'][unique_templates[unit_idx]] = {
+                'acg': get_store_acg(acg_store, unit_row, acg_cbin, acg_cwin, normalize='hertz'),
+                'cbin': acg_cbin,
+                'cwin': acg_cwin,
             }
-            _precompute_unit_gui_data(unit_idx, this_unit, template_waveforms, quality_metrics, 
-                                    spike_clusters, template_amplitudes, channel_positions, 
-                                    gui_data, param, unit_per_bin_data)
 
     # Save GUI data after processing all units
     if param.get("verbose", False):
@@ -1111,7 +1798,14 @@ def run_bombcell(ks_dir, save_path, param, save_figures=False, return_figures=Fa
         print(f"📁 Processing data from: {ks_dir}")
         print(f"Results will be saved to: {save_path}")
         print("\nLoading ephys data...")
-    
+
+    # Kilosort 4 spike positions give the spike depths for drift, then pc_features are only
+    # needed for the distance metrics
+    spike_positions = None
+    if param.get("driftSpikePositions", False):
+        spike_positions = load_spike_positions(ks_dir)
+    load_pc_features = param["computeDistanceMetrics"] or spike_positions is None
+
     (
         spike_times_samples,
         spike_clusters, # actually spike_templates, but they're the same in bombcell
@@ -1120,13 +1814,23 @@ def run_bombcell(ks_dir, save_path, param, save_figures=False, return_figures=Fa
         pc_features,
         pc_features_idx,
         channel_positions,
-    ) = load_ephys_data(ks_dir)
+        template_ids,
+    ) = load_ephys_data(
+        ks_dir,
+        load_pc_features=load_pc_features,
+        mmap_mode="r" if param.get("mmapEphysData", False) else None,
+        cache_dir=save_path if param.get("cacheQualityMetrics", True) else None,
+        compact_templates=True,
+    )
+    spike_depths = None if spike_positions is None else spike_positions[:, 1]
     
     if param.get("verbose", False):
         print(f"Loaded ephys data: {len(np.unique(spike_clusters))} units, {len(spike_times_samples):,} spikes")
 
-    # pre-load peak channels from templates before extracting raw waveforms
-    maxChannels = qm.get_waveform_peak_channel(template_waveforms)
+    # pre-load peak channels from templates before extracting raw waveforms,
+    # indexed by cluster id (template_waveforms only has rows for template_ids)
+    maxChannels = np.zeros(np.max(template_ids) + 1, dtype=int)
+    maxChannels[template_ids] = qm.get_waveform_peak_channel(template_waveforms)
 
     # Extract or load in raw waveforms
     if param["raw_data_file"] is not None:
@@ -1146,20 +1850,20 @@ def run_bombcell(ks_dir, save_path, param, save_figures=False, return_figures=Fa
         raw_waveforms_full,
         raw_waveforms_peak_channel,
         signal_to_noise_ratio,
-        raw_waveforms_id_match,
+        raw_waveforms_cluster_ids,
         ) = extract_raw_waveforms(
             param,
             spike_clusters,
             spike_times_samples,
             param["reextractRaw"],
             save_path,
-            maxChannels,  # Pass template peak channels
+            maxChannels[np.unique(spike_clusters)],  # template peak channel of each extracted cluster
         )
     else:
         raw_waveforms_full = None
         raw_waveforms_peak_channel = None
         signal_to_noise_ratio = None
-        raw_waveforms_id_match = None
+        raw_waveforms_cluster_ids = None
         param["extractRaw"] = False  # No waveforms to extract!
 
     # Remove duplicate spikes
@@ -1187,6 +1891,8 @@ def run_bombcell(ks_dir, save_path, param, save_figures=False, return_figures=Fa
             raw_waveforms_peak_channel=raw_waveforms_peak_channel,
             signal_to_noise_ratio=signal_to_noise_ratio,
         )
+        if spike_depths is not None:
+            spike_depths = spike_depths[duplicate_spike_idx == 0]
     else:
         non_empty_units = np.unique(spike_clusters)
 
@@ -1206,6 +1912,27 @@ def run_bombcell(ks_dir, save_path, param, save_figures=False, return_figures=Fa
     unique_templates = non_empty_units # template ids are cluster ids, in bombcell
     param['unique_templates'] = unique_templates
 
+    # cache keys of the large inputs, from their files so they are not read in full to be hashed.
+    # Their rows also depend on the spikes kept by the duplicate spike removal
+    ks_path = Path(ks_dir)
+    spike_files = [
+        ks_path / file_name for file_name in [
+            "spike_times.npy", "spike_times_corrected.npy", "amplitudes.npy", "spike_templates.npy",
+            "spike_clusters.npy", "templates.npy", "whitening_mat_inv.npy",
+        ]
+    ]
+    duplicate_param = _get_param_subset(param, ["removeDuplicateSpikes", "duplicateSpikeWindow_s"])
+    input_file_keys = {
+        "pc_features": get_stage_cache_key(
+            get_file_cache_key(ks_path / "pc_features.npy", ks_path / "pc_feature_ind.npy", *spike_files),
+            duplicate_param,
+        ),
+        "spike_depths": get_stage_cache_key(
+            get_file_cache_key(ks_path / "spike_positions.npy", *spike_files), duplicate_param
+        ),
+        "template_waveforms": get_file_cache_key(*spike_files),
+    }
+
     # Initialize quality metrics dictionary
     n_units = unique_templates.size
     quality_metrics = create_quality_metrics_dict(n_units, snr=signal_to_noise_ratio)
@@ -1230,6 +1957,9 @@ def run_bombcell(ks_dir, save_path, param, save_figures=False, return_figures=Fa
         template_waveforms,
         param,
         save_path,
+        spike_depths=spike_depths,
+        template_ids=template_ids,
+        input_file_keys=input_file_keys,
     )
 
     if param.get("verbose", False):
@@ -1251,9 +1981,12 @@ def run_bombcell(ks_dir, save_path, param, save_figures=False, return_figures=Fa
     
     # Call plot_summary_data with return_figures parameter if needed
     if return_figures:
-        figures = plot_summary_data(quality_metrics, template_waveforms, unit_type, unit_type_string, param, return_figures=True)
+        figures = plot_summary_data(
+            quality_metrics, template_waveforms, unit_type, unit_type_string, param,
+            return_figures=True, template_ids=template_ids,
+        )
     else:
-        plot_summary_data(quality_metrics, template_waveforms, unit_type, unit_type_string, param)
+        plot_summary_data(quality_metrics, template_waveforms, unit_type, unit_type_string, param, template_ids=template_ids)
 
     if param.get("verbose", False):
         print("\nSaving results...")
@@ -1265,7 +1998,7 @@ def run_bombcell(ks_dir, save_path, param, save_figures=False, return_figures=Fa
         param,
         raw_waveforms_full,
         raw_waveforms_peak_channel,
-        raw_waveforms_id_match,
+        raw_waveforms_cluster_ids,
         save_path,
         ks_dir,
     )  
@@ -1287,6 +2020,61 @@ def run_bombcell(ks_dir, save_path, param, save_figures=False, return_figures=Fa
         )
 
 
+def reclassify(save_path, ks_dir=None, **threshold_overrides):
+    """
+    Re-classifies units from saved BombCell results with new thresholds, without re-computing
+    any quality metric. Each threshold can also be a list of values, to classify the units with
+    every set of thresholds at once (all lists must have the same length); results are then
+    returned but not saved.
+
+    Parameters
+    ----------
+    save_path : str
+        The path to the directory which has the saved BombCell results
+    ks_dir : str, optional
+        The KiloSort directory to save cluster_bc_unitType.tsv to, by default param["ephysKilosortPath"]
+    **threshold_overrides :
+        The classification thresholds to change, e.g. maxRPVviolations=0.05
+
+    Returns
+    -------
+    param : dict
+        The parameters with the new thresholds
+    unit_type : ndarray (n_units) or (n_threshold_sets, n_units)
+        The unit classifications as numbers
+    unit_type_string : ndarray (n_units) or (n_threshold_sets, n_units)
+        The unit classifications as names
+    """
+    param, quality_metrics, _ = load_bc_results(save_path)
+    if param is None:
+        raise FileNotFoundError(f"No saved BombCell parameters found in {save_path}")
+
+    unknown_keys = [k for k in threshold_overrides if k not in param]
+    if len(unknown_keys) > 0:
+        print(f"Warning: {unknown_keys} are not BombCell parameters")
+    param.update(threshold_overrides)
+
+    unit_type, unit_type_string = qm.get_quality_unit_type(param, quality_metrics)
+
+    # a grid of thresholds is only returned
+    if unit_type.ndim > 1:
+        return param, unit_type, unit_type_string
+
+    if ks_dir is None:
+        ks_dir = param["ephysKilosortPath"]
+    if param["saveAsTSV"] and param["unit_type_for_phy"]:
+        save_quality_metric_tsv(
+            unit_type_string,
+            quality_metrics["phy_clusterID"].values,
+            ks_dir,
+            "cluster_bc_unitType.tsv",
+            ("cluster_id", "bc_unitType"),
+        )
+    save_params_as_parquet(param, save_path, file_name="_bc_parameters._bc_qMetrics")
+
+    return param, unit_type, unit_type_string
+
+
 def run_bombcell_unit_match(ks_dir, save_path, raw_file=None, meta_file=None, kilosort_version=4, gain_to_uV=None, save_figures=False, return_figures=False):
     """
     This function runs bombcell pipeline with parameters optimized for UnitMatch
@@ -1,4 +1,9 @@
 import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
 from pathlib import Path
 
 import numpy as np
@@ -7,7 +12,7 @@ import pandas as pd
 import bombcell.extract_raw_waveforms as erw
 
 
-def load_ephys_data(ephys_path):
+def load_ephys_data(ephys_path, load_pc_features=True, mmap_mode=None, cache_dir=None, compact_templates=False):
     """
     This function loads the necessary data from the spike sorting to run BombCell
 
@@ -15,6 +20,18 @@ def load_ephys_data(ephys_path):
     ----------
     ephys_path : str
         The path to the KiloSorted output file
+    load_pc_features : bool, optional
+        If False pc_features.npy is not loaded and pc_features is NaN, by default True
+    mmap_mode : str, optional
+        If given (e.g. "r"), the spike times, amplitudes, templates and pc features are opened as
+        memory-mapped arrays in their on-disk dtype and only read from disk when accessed,
+        by default None (loaded into memory, amplitudes as float64)
+    cache_dir : str, optional
+        If given, the unwhitened templates are cached in cache_dir/_bc_cache, see get_unwhitened_templates
+    compact_templates : bool, optional
+        If True, clusters created by manual curation get one template row each and the cluster id of every
+        row is returned as template_ids, see get_cluster_rows. If False template_waveforms is padded so that
+        row i is cluster i, by default False
 
     Returns
     -------
@@ -33,6 +50,8 @@ def load_ephys_data(ephys_path):
     good_channels: ndarray (n_channels,)
         The array defining the channels used by KiloSort, as some in-active channels are dropped during
         spike sorting
+    template_ids : ndarray (m_templates,)
+        The cluster id of each row of template_waveforms, only returned if compact_templates is True
     """
     ephys_path = Path(ephys_path)
 
@@ -41,22 +60,23 @@ def load_ephys_data(ephys_path):
     spike_templates = np.load(ephys_path / "spike_templates.npy").squeeze()
 
     if (ephys_path / "spike_times_corrected.npy").exists():
-        spike_times_samples = np.load(ephys_path / "spike_times_corrected.npy").squeeze()
+        spike_times_samples = np.load(ephys_path / "spike_times_corrected.npy", mmap_mode=mmap_mode).squeeze()
     else:
-        spike_times_samples = np.load(ephys_path / "spike_times.npy").squeeze()
+        spike_times_samples = np.load(ephys_path / "spike_times.npy", mmap_mode=mmap_mode).squeeze()
 
-    template_amplitudes = np.load(ephys_path / "amplitudes.npy").squeeze().astype(np.float64)
+    template_amplitudes = np.load(ephys_path / "amplitudes.npy", mmap_mode=mmap_mode).squeeze()
+    if mmap_mode is None:
+        template_amplitudes = template_amplitudes.astype(np.float64)
 
     # load and unwhiten templates
-    templates_waveforms_whitened = np.load(ephys_path / "templates.npy")
-    winv = np.load(ephys_path / "whitening_mat_inv.npy")
-    templates_waveforms = np.zeros_like(templates_waveforms_whitened)
-    for t in range(templates_waveforms.shape[0]):
-        templates_waveforms[t, :, :] = templates_waveforms_whitened[t, :, :].squeeze() @ winv
+    templates_waveforms = get_unwhitened_templates(ephys_path, cache_dir=cache_dir, mmap_mode=mmap_mode)
 
     # Load pc features
     if (ephys_path / "pc_features.npy").exists():
-        pc_features = np.load(ephys_path / "pc_features.npy").squeeze()
+        if load_pc_features:
+            pc_features = np.load(ephys_path / "pc_features.npy", mmap_mode=mmap_mode).squeeze()
+        else:
+            pc_features = np.nan
         pc_features_idx = np.load(ephys_path / "pc_feature_ind.npy").squeeze()
     else:
         pc_features = np.nan
@@ -65,11 +85,12 @@ def load_ephys_data(ephys_path):
     channel_positions = np.load(ephys_path / "channel_positions.npy").squeeze()
 
     # Handle Phy manual curation
-    spike_templates, templates_waveforms, pc_features_idx = handle_manual_curation(
-        ephys_path, spike_templates, templates_waveforms, pc_features_idx,
+    curated = handle_manual_curation(
+        ephys_path, spike_templates, templates_waveforms, pc_features_idx, compact_templates=compact_templates,
     )
+    spike_templates, templates_waveforms, pc_features_idx = curated[:3]
 
-    return (
+    ephys_data = (
         spike_times_samples,
         spike_templates,
         templates_waveforms,
@@ -78,13 +99,223 @@ def load_ephys_data(ephys_path):
         pc_features_idx,
         channel_positions,
     )
+    if compact_templates:
+        return ephys_data + (curated[3],)
+    return ephys_data
+
+
+def get_file_hash(file_path, block_size=2**24):
+    """
+    Hashes the content of a file, reading it in blocks
+
+    Parameters
+    ----------
+    file_path : str
+        The file to hash
+    block_size : int, optional
+        The number of bytes read at once, by default 2**24
+
+    Returns
+    -------
+    file_hash : str
+        The sha1 hash of the file content
+    """
+    file_hash = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def get_unwhitened_templates(ephys_path, cache_dir=None, mmap_mode=None):
+    """
+    Unwhitens the Kilosort templates with the inverse whitening matrix, in a single batched float32 matmul.
+    If cache_dir is given the result is saved in cache_dir/_bc_cache, keyed on the hashes of
+    templates.npy and whitening_mat_inv.npy, and later calls only read that file.
+
+    Parameters
+    ----------
+    ephys_path : str
+        The path to the KiloSorted output file
+    cache_dir : str, optional
+        Where to cache the unwhitened templates (e.g. the bombcell save path), by default None (no cache)
+    mmap_mode : str, optional
+        The mmap_mode used to read the whitened or cached templates, by default None
+
+    Returns
+    -------
+    templates_waveforms : ndarray (n_templates, n_time_points, n_channels)
+        The unwhitened template waveforms
+    """
+    ephys_path = Path(ephys_path)
+
+    if cache_dir is not None:
+        templates_key = (
+            get_file_hash(ephys_path / "templates.npy")[:16]
+            + get_file_hash(ephys_path / "whitening_mat_inv.npy")[:16]
+        )
+        cache_path = Path(cache_dir).expanduser() / "_bc_cache"
+        cache_file = cache_path / f"templates_unwhitened_{templates_key}.npy"
+        if cache_file.exists():
+            try:
+                return np.load(cache_file, mmap_mode=mmap_mode)
+            except Exception as e:
+                print(f"Warning: could not load cached unwhitened templates: {e}")
+
+    templates_waveforms_whitened = np.load(ephys_path / "templates.npy", mmap_mode=mmap_mode)
+    winv = np.load(ephys_path / "whitening_mat_inv.npy")
+    templates_waveforms = np.matmul(
+        np.asarray(templates_waveforms_whitened, dtype=np.float32), winv.astype(np.float32)
+    ).astype(templates_waveforms_whitened.dtype, copy=False)
+
+    if cache_dir is not None:
+        try:
+            cache_path.mkdir(parents=True, exist_ok=True)
+            # only keep the templates of the current Kilosort output
+            for old_cache_file in cache_path.glob("templates_unwhitened_*.npy"):
+                old_cache_file.unlink()
+            np.save(cache_file, templates_waveforms)
+            if mmap_mode is not None:
+                templates_waveforms = np.load(cache_file, mmap_mode=mmap_mode)
+        except OSError as e:
+            print(f"Warning: could not cache unwhitened templates: {e}")
+
+    return templates_waveforms
+
+
+def load_spike_positions(ephys_path):
+    """
+    Loads the spike position estimates written by Kilosort 4, memory-mapped
+
+    Parameters
+    ----------
+    ephys_path : str
+        The path to the KiloSorted output file
+
+    Returns
+    -------
+    spike_positions : ndarray (n_spikes, 2) or None
+        The x and y (depth) position of each spike, None if spike_positions.npy does not exist
+        or does not match the spike times
+    """
+    ephys_path = Path(ephys_path)
+    if not (ephys_path / "spike_positions.npy").exists():
+        return None
+
+    spike_positions = np.load(ephys_path / "spike_positions.npy", mmap_mode="r")
+    n_spikes = np.load(ephys_path / "spike_times.npy", mmap_mode="r").shape[0]
+    if spike_positions.ndim != 2 or spike_positions.shape[1] < 2 or spike_positions.shape[0] != n_spikes:
+        print(
+            f"Warning: spike_positions.npy has shape {spike_positions.shape}, expected ({n_spikes}, 2). "
+            "Using pc_features for drift instead."
+        )
+        return None
+
+    return spike_positions
+
+
+def get_spike_index(spike_clusters, unit_ids=None):
+    """
+    Builds a compressed-sparse-row style index of which spikes belong to which unit.
+    Spikes are sorted once by unit (a stable sort, so spikes keep their time order
+    within each unit) and every unit is then a contiguous slice of that ordering,
+    instead of a boolean mask over all spikes per unit.
+
+    Parameters
+    ----------
+    spike_clusters : ndarray (n_spikes,)
+        The array which assigns each spike to a unit
+    unit_ids : ndarray, optional
+        The (sorted) unit ids to index, by default all unique ids in spike_clusters
+
+    Returns
+    -------
+    spike_index : dict
+        'unit_ids' : ndarray (n_units,)
+            The unit ids in the index
+        'spike_order' : ndarray (n_spikes,)
+            The spike indices sorted by unit, then by original spike order
+        'unit_starts', 'unit_stops' : ndarray (n_units,)
+            Unit i's spikes are spike_order[unit_starts[i]:unit_stops[i]]
+    """
+    spike_clusters = np.asarray(spike_clusters)
+    spike_order = np.argsort(spike_clusters, kind="stable")
+    sorted_clusters = spike_clusters[spike_order]
+    if unit_ids is None:
+        unit_ids = np.unique(sorted_clusters)
+    unit_ids = np.asarray(unit_ids)
+
+    spike_index = {
+        "unit_ids": unit_ids,
+        "spike_order": spike_order,
+        "unit_starts": np.searchsorted(sorted_clusters, unit_ids, side="left"),
+        "unit_stops": np.searchsorted(sorted_clusters, unit_ids, side="right"),
+    }
+    return spike_index
+
+
+def get_unit_spike_idx(spike_index, unit_id):
+    """
+    Gets the indices of a unit's spikes from a spike index made by get_spike_index
+
+    Parameters
+    ----------
+    spike_index : dict
+        The spike index
+    unit_id : int
+        The id of the unit
+
+    Returns
+    -------
+    unit_spike_idx : ndarray
+        The indices of this unit's spikes, in their original order
+    """
+    unit_ids = spike_index["unit_ids"]
+    unit_idx = np.searchsorted(unit_ids, unit_id)
+    if unit_idx >= unit_ids.size or unit_ids[unit_idx] != unit_id:
+        return spike_index["spike_order"][:0]
+    return spike_index["spike_order"][
+        spike_index["unit_starts"][unit_idx] : spike_index["unit_stops"][unit_idx]
+    ]
+
+
+def get_cluster_rows(cluster_ids, ids):
+    """
+    Finds the rows of a compact array, which has one row per cluster in cluster_ids, holding the given
+    cluster ids. This replaces padding arrays up to the largest cluster id so that rows can be indexed by id.
+
+    Parameters
+    ----------
+    cluster_ids : ndarray (n_rows,)
+        The cluster id of each row, e.g. the template_ids from load_ephys_data
+    ids : ndarray
+        The cluster ids to look up
+
+    Returns
+    -------
+    rows : ndarray
+        The row of each id, -1 for ids which have no row
+    """
+    cluster_ids = np.asarray(cluster_ids)
+    ids = np.asarray(ids)
+    if cluster_ids.size == 0:
+        return np.full(ids.shape, -1)
+
+    row_order = np.argsort(cluster_ids, kind="stable")
+    sorted_ids = cluster_ids[row_order]
+    pos = np.minimum(np.searchsorted(sorted_ids, ids), sorted_ids.size - 1)
+    rows = np.where(sorted_ids[pos] == ids, row_order[pos], -1)
+    return rows
 
 
-def handle_manual_curation(ephys_path, spike_templates, templates_waveforms, pc_features_idx):
+def handle_manual_curation(ephys_path, spike_templates, templates_waveforms, pc_features_idx, compact_templates=False):
     # if manually curated data, template ids and cluster ids have diverged.
     # this function appends additional template waveforms to templates_waveforms,
-    # and the units that do not exist anymore because they were merged remain as dead rows
+    # and the units that do not exist anymore because they were merged remain as dead rows.
+    # With compact_templates, only one row per new cluster is appended and the cluster id of every
+    # row is returned as template_ids, instead of padding templates_waveforms up to the largest cluster id
     found_pc_features = not np.all(np.isnan(pc_features_idx))
+    template_ids = np.arange(templates_waveforms.shape[0])
 
     if (ephys_path / 'spike_clusters.npy').exists():
         spike_clusters = np.load(ephys_path / 'spike_clusters.npy').squeeze().astype(int)
@@ -93,19 +324,22 @@ def handle_manual_curation(ephys_path, spike_templates, templates_waveforms, pc_
         
         if n_new_units > 0:
             # initialize templates and pc features
-            # TODO currently, if unit id jumps from 300 to 600,
-            # there will be 300 empty rows in padded templates_waveforms.
-            # this is inefficient and should be changed in the future.
+            # the pc feature channels are small, they are still padded so they can be indexed by cluster id
             assert templates_waveforms.shape[0] == pc_features_idx.shape[0]
 
             new_units_max_index = max(new_templates)
             n_old_units = templates_waveforms.shape[0]
             n_new_rows = int(new_units_max_index - n_old_units + 1)
 
-            padding = np.zeros((n_new_rows, 
-                            templates_waveforms.shape[1], 
-                            templates_waveforms.shape[2]))
-            templates_waveforms = np.vstack([templates_waveforms, padding])
+            if compact_templates:
+                new_waveforms = np.zeros((n_new_units,
+                                templates_waveforms.shape[1],
+                                templates_waveforms.shape[2]), dtype=templates_waveforms.dtype)
+            else:
+                padding = np.zeros((n_new_rows, 
+                                templates_waveforms.shape[1], 
+                                templates_waveforms.shape[2]))
+                templates_waveforms = np.vstack([templates_waveforms, padding])
             
             if found_pc_features:
                 pc_features_idx = np.vstack([
@@ -114,7 +348,7 @@ def handle_manual_curation(ephys_path, spike_templates, templates_waveforms, pc_
                                               pc_features_idx.shape[1]))
                                         ])
             
-            for u in new_templates:
+            for i, u in enumerate(new_templates):
                 # find corresponding pre merge/split templates and PCs
                 oldTemplates = spike_templates[spike_clusters == u]
                 merged_unit = len(np.unique(oldTemplates)) > 1
@@ -123,7 +357,10 @@ def handle_manual_curation(ephys_path, spike_templates, templates_waveforms, pc_
                     newWaveform = np.mean(templates_waveforms[np.unique(oldTemplates), :, :], axis=0)
                 else:  # just take value if split
                     newWaveform = templates_waveforms[np.unique(oldTemplates), :, :]
-                templates_waveforms[u, :, :] = newWaveform
+                if compact_templates:
+                    new_waveforms[i, :, :] = newWaveform
+                else:
+                    templates_waveforms[u, :, :] = newWaveform
                 
                 if found_pc_features:
                     if merged_unit:
@@ -131,11 +368,19 @@ def handle_manual_curation(ephys_path, spike_templates, templates_waveforms, pc_
                     else:
                         newPcFeatureIdx = pc_features_idx[np.unique(oldTemplates), :]
                     pc_features_idx[u, :] = newPcFeatureIdx
+
+            if compact_templates:
+                templates_waveforms = np.concatenate([templates_waveforms, new_waveforms])
+                template_ids = np.concatenate([template_ids, new_templates])
+    else:
+        spike_clusters = spike_templates
     
-    spike_templates = spike_templates.astype(int)
+    spike_clusters = spike_clusters.astype(int)
     if found_pc_features:
         pc_features_idx = pc_features_idx.astype(int)
 
+    if compact_templates:
+        return spike_clusters, templates_waveforms, pc_features_idx, template_ids
     return spike_clusters, templates_waveforms, pc_features_idx
 
 
@@ -310,3 +555,161 @@ def load_bc_results(bc_path):
         fractions_RPVs_all_taur = None
 
     return param, quality_metrics, fractions_RPVs_all_taur
+
+
+def _decode_gui_value(encoded, arrays):
+    """Decodes a value of a GUI data store, reading its arrays from the flat array file"""
+    if isinstance(encoded, dict):
+        if "__array__" in encoded:
+            offset, dtype, shape = encoded["__array__"]
+            dtype = np.dtype(dtype)
+            count = int(np.prod(shape))
+            return np.frombuffer(arrays, dtype=dtype, count=count, offset=offset).reshape(shape).copy()
+        if "__dict__" in encoded:
+            return {k: _decode_gui_value(v, arrays) for k, v in encoded["__dict__"]}
+        return {k: _decode_gui_value(v, arrays) for k, v in encoded.items()}
+    if isinstance(encoded, list):
+        return [_decode_gui_value(v, arrays) for v in encoded]
+    return encoded
+
+
+class GUIDataStore(Mapping):
+    """
+    Read-only view of a GUI data store saved by save_utils.save_gui_data_store, which behaves like the
+    {data type: {unit id: value}} GUI data dictionary. Opening the store only reads the per-unit table
+    of ids and data types, a unit's values are decoded the first time one of them is accessed and its
+    arrays are read from the memory-mapped array file.
+
+    Parameters
+    ----------
+    store_path : str
+        The store directory
+    max_cached_units : int, optional
+        The number of decoded units kept in memory, by default 64
+    """
+
+    def __init__(self, store_path, max_cached_units=64):
+        self.store_path = Path(store_path)
+        self.max_cached_units = max_cached_units
+        # the GUI prefetches units from a background thread
+        self._cache_lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        """Re-reads the unit table, e.g. after units were appended to the store"""
+        with open(self.store_path / "fields.json", "r") as f:
+            self.fields = json.load(f)
+
+        # the table is small, only the JSON of the units which are viewed is decoded
+        with open(self.store_path / "units.tsv", "rb") as f:
+            self._units_table = f.read()
+        self._unit_lines = {}
+        self._unit_fields = {}
+        line_start = 0
+        while line_start < len(self._units_table):
+            line_stop = self._units_table.find(b"\n", line_start)
+            id_stop = self._units_table.find(b"\t", line_start)
+            fields_stop = self._units_table.find(b"\t", id_stop + 1)
+            unit_id = json.loads(self._units_table[line_start:id_stop])
+            # units saved again are appended, their later values replace the earlier ones
+            self._unit_lines.setdefault(unit_id, []).append((fields_stop + 1, line_stop))
+            self._unit_fields.setdefault(unit_id, set()).update(
+                self._units_table[id_stop + 1:fields_stop].decode("utf-8").split(",")
+            )
+            line_start = line_stop + 1
+
+        arrays_file = self.store_path / "arrays.bin"
+        if arrays_file.exists() and arrays_file.stat().st_size > 0:
+            self._arrays = np.memmap(arrays_file, dtype=np.uint8, mode="r")
+        else:
+            self._arrays = np.zeros(0, dtype=np.uint8)
+        self._cache = OrderedDict()
+
+    def get_unit(self, unit_id):
+        """
+        Gets all the GUI data of one unit
+
+        Parameters
+        ----------
+        unit_id : int
+            The unit id
+
+        Returns
+        -------
+        unit_data : dict
+            The unit's value for each of its data types
+        """
+        with self._cache_lock:
+            if unit_id in self._cache:
+                self._cache.move_to_end(unit_id)
+                return self._cache[unit_id]
+
+        unit_data = {}
+        for line_start, line_stop in self._unit_lines[unit_id]:
+            unit_data.update(_decode_gui_value(json.loads(self._units_table[line_start:line_stop]), self._arrays))
+        with self._cache_lock:
+            self._cache[unit_id] = unit_data
+            if len(self._cache) > self.max_cached_units:
+                self._cache.popitem(last=False)
+        return unit_data
+
+    @property
+    def unit_ids(self):
+        """The ids of the units in the store"""
+        return list(self._unit_lines.keys())
+
+    def __getitem__(self, field):
+        if field not in self.fields:
+            raise KeyError(field)
+        return _GUIDataField(self, field)
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __contains__(self, field):
+        return field in self.fields
+
+
+class _GUIDataField(Mapping):
+    """The {unit id: value} view of one data type of a GUIDataStore"""
+
+    def __init__(self, store, field):
+        self.store = store
+        self.field = field
+
+    def __getitem__(self, unit_id):
+        if not self.__contains__(unit_id):
+            raise KeyError(unit_id)
+        return self.store.get_unit(unit_id)[self.field]
+
+    def __contains__(self, unit_id):
+        try:
+            return self.field in self.store._unit_fields.get(unit_id, ())
+        except TypeError:
+            return False
+
+    def __iter__(self):
+        return (unit_id for unit_id, fields in self.store._unit_fields.items() if self.field in fields)
+
+    def __len__(self):
+        return sum(self.field in fields for fields in self.store._unit_fields.values())
+
+
+def load_gui_data_store(store_path):
+    """
+    Opens a GUI data store saved by save_utils.save_gui_data_store
+
+    Parameters
+    ----------
+    store_path : str
+        The store directory, e.g. bombcell/for_GUI/gui_data
+
+    Returns
+    -------
+    gui_data : GUIDataStore
+        The lazily loaded GUI data
+    """
+    return GUIDataStore(store_path)
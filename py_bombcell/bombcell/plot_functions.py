@@ -26,7 +26,8 @@ from collections import namedtuple
 # geared towards generating plots in the notebook
 # environment
 ######################################################
-def plot_summary_data(quality_metrics, template_waveforms, unit_type, unit_type_string, param, return_figures=False):
+def plot_summary_data(quality_metrics, template_waveforms, unit_type, unit_type_string, param, return_figures=False,
+                      template_ids=None):
     """
     This function plots summary figure to visualize bombcell's results
 
@@ -46,6 +47,8 @@ def plot_summary_data(quality_metrics, template_waveforms, unit_type, unit_type_
         The dictionary of all bomcell parameters
     return_figures : bool, optional
         If True, returns a dictionary of figure objects, by default False
+    template_ids : ndarray, optional
+        The cluster id of each row of template_waveforms, by default None (row i is cluster i)
 
     Returns
     -------
@@ -67,7 +70,9 @@ def plot_summary_data(quality_metrics, template_waveforms, unit_type, unit_type_
             save_dir.mkdir(parents=True, exist_ok=True)
         
         # Plot waveforms overlay
-        fig_waveforms = plot_waveforms_overlay(quality_metrics, template_waveforms, unit_type, param, save_dir=save_dir)
+        fig_waveforms = plot_waveforms_overlay(
+            quality_metrics, template_waveforms, unit_type, param, save_dir=save_dir, template_ids=template_ids
+        )
         if return_figures:
             figures['waveforms_overlay'] = fig_waveforms
             
@@ -86,7 +91,7 @@ def plot_summary_data(quality_metrics, template_waveforms, unit_type, unit_type_
     return None
 
 
-def plot_waveforms_overlay(quality_metrics, template_waveforms, unit_type, param, save_dir=None):
+def plot_waveforms_overlay(quality_metrics, template_waveforms, unit_type, param, save_dir=None, template_ids=None):
     """
     This function plots overlaid waveforms for each of bombcell's unit classification types (e.g Noise, MUA..)
 
@@ -104,6 +109,8 @@ def plot_waveforms_overlay(quality_metrics, template_waveforms, unit_type, param
         The dictionary of all bomcell parameters
     save_dir : Path or str, optional
         Directory to save the figure to, by default None
+    template_ids : ndarray, optional
+        The cluster id of each row of template_waveforms, by default None (row i is cluster i)
 
     Returns
     -------
@@ -150,7 +157,7 @@ def plot_waveforms_overlay(quality_metrics, template_waveforms, unit_type, param
             unit_type_ = plot_idx
             unit_type_str = labels[unit_type_]
             ax = axs[img_pos[plot_idx][0]][img_pos[plot_idx][1]]
-            generate_waveform_overlay(param, quality_metrics, unit_type_str, template_waveforms, ax)        
+            generate_waveform_overlay(param, quality_metrics, unit_type_str, template_waveforms, ax, template_ids=template_ids)
         else:
             # Hide the unused subplot (6th subplot when n_plots=5)
             ax = axs[img_pos[plot_idx][0]][img_pos[plot_idx][1]]
@@ -308,11 +315,12 @@ def generate_waveform_overlay(
         unit_type_str: str, 
         template_waveforms: np.ndarray=None,
         ax: matplotlib.axes.Axes = None,
+        template_ids: np.ndarray = None,
     ):
     if template_waveforms is None:
         from .loading_utils import load_ephys_data
         ks_dir = param["ephysKilosortPath"]
-        _, _, template_waveforms, _, _, _, _ = load_ephys_data(ks_dir)
+        _, _, template_waveforms, _, _, _, _, template_ids = load_ephys_data(ks_dir, compact_templates=True)
     
     from .quality_metrics import get_quality_unit_type
     unit_types_all, _ = get_quality_unit_type(param, quality_metrics)
@@ -344,6 +352,11 @@ def generate_waveform_overlay(
     unique_templates = param["unique_templates"]
     unit_type_template_ids = unique_templates[unit_types_all==unit_type]
     n_units_of_type = unit_type_template_ids.size
+    if template_ids is None:
+        unit_type_template_rows = unit_type_template_ids
+    else:
+        from .loading_utils import get_cluster_rows
+        unit_type_template_rows = get_cluster_rows(template_ids, unit_type_template_ids)
 
     # initialize figure, axis handles
 
@@ -354,9 +367,9 @@ def generate_waveform_overlay(
 
     # if the current unit type has more than 0 units, generate a plot
     if n_units_of_type > 0:
-        for template_id in unit_type_template_ids:
+        for template_id, template_row in zip(unit_type_template_ids, unit_type_template_rows):
             max_channel_id = quality_metrics["maxChannels"][template_id]
-            template_max_waveform = template_waveforms[template_id, 0:, max_channel_id] # template waveforms comes from load_ephys_data
+            template_max_waveform = template_waveforms[template_row, 0:, max_channel_id] # template waveforms comes from load_ephys_data
             ax.plot(template_max_waveform, color="black", alpha=0.1)
             ax.spines[["right", "top", "bottom", "left"]].set_visible(False)
             ax.set_xticks([])
@@ -6,6 +6,7 @@ from numba import njit
 from scipy.optimize import curve_fit
 from scipy.signal import medfilt, find_peaks
 from scipy.stats import norm, chi2
+from scipy.linalg import solve_triangular
 
 import matplotlib.pyplot as plt
 
@@ -35,101 +36,135 @@ def get_waveform_peak_channel(template_waveforms):
 
 @njit(cache=True)
 def remove_duplicates(
-    batch_spike_times_samples,
-    batch_spike_clusters,
-    batch_template_amplitudes,
-    batch_spike_clusters_flat,
-    maxChannels,
+    spike_times_samples,
+    spike_clusters,
+    template_amplitudes,
+    spike_max_channels,
+    unit_spike_counts,
     duplicate_spike_window_samples,
 ):
     """
-    This function uses batches of spike times and templates to find when spike overlap on the same channel:
+    This function sweeps through the (time-sorted) spikes to find when spikes overlap on the same channel:
         will remove the lowest amplitude spike for a pair the same unit
-        will remove the most common spike of the batch if a pair of different units
+        will remove the spike of the unit with the least spikes if a pair of different units
+    Every spike is compared to all following spikes within duplicate_spike_window_samples, so
+    bursts of overlapping spikes of any length are handled exactly.
+
     Parameters
     ----------
-    batch_spike_times_samples : ndarray
-        A batch of spike times in samples
-    batch_spike_clusters : ndarray
-        A batch of spike templates
-    batch_template_amplitudes : ndarray
-        A batch of spike template amplitudes
-    batch_spike_clusters_flat : ndarray
-        A batch of the flattened spike templates
-    maxChannels : ndarray
-        The max channel for each unit
-    duplicate_spike_window_samples : int
+    spike_times_samples : ndarray
+        The spike times in samples, sorted
+    spike_clusters : ndarray
+        The spike templates
+    template_amplitudes : ndarray
+        The spike template amplitudes
+    spike_max_channels : ndarray
+        The max channel of each spike's unit
+    unit_spike_counts : ndarray
+        The number of spikes for each unit id
+    duplicate_spike_window_samples : float
         The length of time in samples which marks a pair of overlapping spike
 
     Returns
     -------
     remove_idx : ndarray
-        An array which if 1 states that spike should be removed
+        A boolean array which is True if that spike should be removed
     """
+    num_spikes = spike_times_samples.shape[0]
+    remove_idx = np.zeros(num_spikes, dtype=np.bool_)
 
-    num_spikes = batch_spike_times_samples.shape[0]
-    remove_idx = np.zeros(num_spikes)
-    # spike counts for the batch
-    unit_spike_counts = np.bincount(batch_spike_clusters)
-
-    # go through each spike in the batch
+    # go through each spike
     for spike_idx1 in range(num_spikes):
-        if remove_idx[spike_idx1] == 1:
+        if remove_idx[spike_idx1]:
             continue
 
-        # go through each spike within +/- 25 idx's
-        for spike_idx2 in np.arange(spike_idx1 - 25, min(spike_idx1 + 25, num_spikes)):
-            # ignore self
-            if spike_idx1 == spike_idx2:
-                continue
-            if remove_idx[spike_idx2] == 1:
-                continue
-
+        # go through each following spike inside the duplicate window
+        spike_idx2 = spike_idx1 + 1
+        while (
+            spike_idx2 < num_spikes
+            and spike_times_samples[spike_idx2] - spike_times_samples[spike_idx1]
+            <= duplicate_spike_window_samples
+        ):
             if (
-                maxChannels[batch_spike_clusters_flat[spike_idx1]]
-                != maxChannels[batch_spike_clusters_flat[spike_idx2]]
+                remove_idx[spike_idx2]
+                or spike_max_channels[spike_idx1] != spike_max_channels[spike_idx2]
             ):
+                spike_idx2 += 1
                 continue
-            # intra-unit removal
-            if batch_spike_clusters[spike_idx1] == batch_spike_clusters[spike_idx2]:
-                if (
-                    np.abs(
-                        batch_spike_times_samples[spike_idx1]
-                        - batch_spike_times_samples[spike_idx2]
-                    )
-                    <= duplicate_spike_window_samples
-                ):
-                    # keep higher amplitude spike
-                    if (
-                        batch_template_amplitudes[spike_idx1]
-                        < batch_template_amplitudes[spike_idx2]
-                    ):
-                        batch_spike_times_samples[spike_idx1] = np.nan
-                        remove_idx[spike_idx1] = 1
-                    else:
-                        batch_spike_times_samples[spike_idx2] = np.nan
-                        remove_idx[spike_idx2] = 1
-
-            # inter-unit removal
-            if batch_spike_clusters[spike_idx1] != batch_spike_clusters[spike_idx2]:
-                if (
-                    np.abs(
-                        batch_spike_times_samples[spike_idx1]
-                        - batch_spike_times_samples[spike_idx2]
-                    )
-                    <= duplicate_spike_window_samples
-                ):
-                    # keep spike from unit with less spikes
-                    if (
-                        unit_spike_counts[batch_spike_clusters[spike_idx1]]
-                        < unit_spike_counts[batch_spike_clusters[spike_idx2]]
-                    ):
-                        batch_spike_times_samples[spike_idx1] = np.nan
-                        remove_idx[spike_idx1] = 1
-                    else:
-                        batch_spike_times_samples[spike_idx2] = np.nan
-                        remove_idx[spike_idx2] = 1
 
+            if spike_clusters[spike_idx1] == spike_clusters[spike_idx2]:
+                # intra-unit removal: keep higher amplitude spike
+                remove_first = (
+                    template_amplitudes[spike_idx1] < template_amplitudes[spike_idx2]
+                )
+            else:
+                # inter-unit removal: keep spike from unit with more spikes
+                remove_first = (
+                    unit_spike_counts[spike_clusters[spike_idx1]]
+                    < unit_spike_counts[spike_clusters[spike_idx2]]
+                )
+
+            if remove_first:
+                remove_idx[spike_idx1] = True
+                break
+            remove_idx[spike_idx2] = True
+            spike_idx2 += 1
+
+    return remove_idx
+
+
+def find_duplicate_spikes(
+    spike_times_samples,
+    spike_clusters,
+    template_amplitudes,
+    maxChannels,
+    duplicate_spike_window_samples,
+):
+    """
+    Finds duplicate spikes over a whole recording with remove_duplicates
+
+    Parameters
+    ----------
+    spike_times_samples : ndarray
+        The array of spike times in samples
+    spike_clusters : ndarray
+        The array which assigns each spike a id
+    template_amplitudes : ndarray
+        The array of amplitudes for each spike
+    maxChannels : ndarray
+        The max channel for each unit id
+    duplicate_spike_window_samples : float
+        The length of time in samples which marks a pair of overlapping spike
+
+    Returns
+    -------
+    duplicate_spike_idx : ndarray
+        A boolean array which is True for duplicate spikes
+    """
+    spike_times_samples = np.asarray(spike_times_samples).astype(np.int64)
+    spike_clusters = np.asarray(spike_clusters).astype(np.int64)
+
+    # the sweep needs time-sorted spikes, only sort if they are not already
+    spike_order = None
+    if np.any(np.diff(spike_times_samples) < 0):
+        spike_order = np.argsort(spike_times_samples, kind="stable")
+        spike_times_samples = spike_times_samples[spike_order]
+        spike_clusters = spike_clusters[spike_order]
+        template_amplitudes = template_amplitudes[spike_order]
+
+    remove_idx = remove_duplicates(
+        spike_times_samples,
+        spike_clusters,
+        np.asarray(template_amplitudes, dtype=np.float64),
+        np.asarray(maxChannels)[spike_clusters].astype(np.int64),
+        np.bincount(spike_clusters),
+        float(duplicate_spike_window_samples),
+    )
+
+    if spike_order is not None:
+        duplicate_spike_idx = np.zeros_like(remove_idx)
+        duplicate_spike_idx[spike_order] = remove_idx
+        return duplicate_spike_idx
     return remove_idx
 
 
@@ -197,63 +232,23 @@ def remove_duplicate_spikes(
     save_path = path_handler(save_path)
 
     if param["removeDuplicateSpikes"]:
-        # check if spikes are already extract or need to recompute
-        if param["recomputeDuplicateSpikes"] or ~os.path.isdir(
-            os.path.join(save_path, "spikes._bc_duplicateSpikes.npy")
-        ):
-
-            # parameters
-            duplicate_spike_window_samples = (
-                param["duplicateSpikeWindow_s"] * param["ephys_sample_rate"]
-            )
-            batch_size = 10000
-            overlap_size = 100
-            num_spikes_full = spike_times_samples.shape[0]
-
-            # initialize and re-allocate
-            duplicate_spike_idx = np.zeros(num_spikes_full)
-
-            # rename the spike templates according to the remaining templates
-            good_templates_idx = np.unique(spike_clusters)
-            new_spike_idx = np.full(max(good_templates_idx) + 1, np.nan)
-            new_spike_idx[good_templates_idx] = np.arange(good_templates_idx.shape[0])
-            spike_clusters_flat = (
-                new_spike_idx[spike_clusters].astype(np.int32)
-            )
-
-            # check for duplicate spikes in batches
-            num_batches = (num_spikes_full) / (batch_size - overlap_size)
-            start_idxs = np.arange(num_batches, dtype=np.int32) * (
-                batch_size - overlap_size
-            )
-            for start_idx in start_idxs:
-                end_idx = min(start_idx + batch_size, num_spikes_full)
-                batch_spike_times_samples = spike_times_samples[
-                    start_idx:end_idx
-                ].astype(np.float32)
-                batch_spike_clusters = spike_clusters[start_idx:end_idx]
-                batch_template_amplitudes = template_amplitudes[start_idx:end_idx]
-                batch_spike_clusters_flat = spike_clusters_flat[start_idx:end_idx]
-
-                batch_remove_idx = remove_duplicates(
-                    batch_spike_times_samples,
-                    batch_spike_clusters,
-                    batch_template_amplitudes,
-                    batch_spike_clusters_flat,
-                    maxChannels,
-                    duplicate_spike_window_samples,
-                )
-                duplicate_spike_idx[start_idx:end_idx] = batch_remove_idx
-
-            if param["saveSpikes_withoutDuplicates"]:
-                np.save(
-                    os.path.join(save_path, "spikes._bc_duplicateSpikes.npy"),
-                    duplicate_spike_idx,
-                )
+        # always recomputed: the sorted sweep is cheaper than hashing the spikes to check a saved result,
+        # and the saved file would go stale when duplicateSpikeWindow_s or the clusters change
+        duplicate_spike_window_samples = (
+            param["duplicateSpikeWindow_s"] * param["ephys_sample_rate"]
+        )
+        duplicate_spike_idx = find_duplicate_spikes(
+            spike_times_samples,
+            spike_clusters,
+            template_amplitudes,
+            maxChannels,
+            duplicate_spike_window_samples,
+        )
 
-        else:
-            duplicate_spike_idx = np.load(
-                os.path.join(save_path, "spikes._bc_duplicateSpikes.npy")
+        if param["saveSpikes_withoutDuplicates"]:
+            np.save(
+                os.path.join(save_path, "spikes._bc_duplicateSpikes.npy"),
+                duplicate_spike_idx,
             )
 
         # check if there are any empty units
@@ -267,7 +262,7 @@ def remove_duplicate_spikes(
         spike_clusters = spike_clusters[spike_idx_to_remove]
         template_amplitudes = template_amplitudes[spike_idx_to_remove]
 
-        if pc_features is not None:
+        if isinstance(pc_features, np.ndarray):
             pc_features = pc_features[
                 spike_idx_to_remove, :, :
             ]
@@ -348,7 +343,34 @@ def is_peak_cutoff(spike_counts_per_amp_bin_gaussian):
     return not_cutoff
 
 
-def perc_spikes_missing(these_amplitudes, these_spike_times, time_chunks, param, metric = False, return_per_bin = False):
+def get_time_bin_slices(these_spike_times, bin_starts, bin_stops):
+    """
+    Finds which of a unit's spikes fall in each time bin, as contiguous slices.
+    The unit's spike times are sorted, so bin i holds these_spike_times[slice_starts[i]:slice_stops[i]],
+    the spikes with bin_starts[i] <= t < bin_stops[i], without building a mask over all spikes per bin.
+
+    Parameters
+    ----------
+    these_spike_times : ndarray
+        The sorted spike times of the unit
+    bin_starts : ndarray
+        The start of each time bin (inclusive)
+    bin_stops : ndarray
+        The end of each time bin (exclusive)
+
+    Returns
+    -------
+    slice_starts : ndarray
+        The index of the first spike in each bin
+    slice_stops : ndarray
+        One past the index of the last spike in each bin
+    """
+    slice_starts = np.searchsorted(these_spike_times, bin_starts, side="left")
+    slice_stops = np.maximum(np.searchsorted(these_spike_times, bin_stops, side="left"), slice_starts)
+    return slice_starts, slice_stops
+
+
+def perc_spikes_missing(these_amplitudes, these_spike_times, time_chunks, param, metric = False, return_per_bin = False, chunk_slices = None):
     """
     This function estimates the percentage of spike missing from a unit.
 
@@ -366,6 +388,8 @@ def perc_spikes_missing(these_amplitudes, these_spike_times, time_chunks, param,
         If True will return the average percent spikes missing, by default False
     return_per_bin : bool, optional
         If True will return per-bin data for GUI plotting, by default False
+    chunk_slices : tuple, optional
+        The spikes in each time chunk from get_time_bin_slices, by default computed here
 
     Returns
     -------
@@ -382,15 +406,14 @@ def perc_spikes_missing(these_amplitudes, these_spike_times, time_chunks, param,
     ks_test_p_value = np.zeros(time_chunks.shape[0] - 1)  # NOT DONE CURRENTLY
     test = np.zeros(time_chunks.shape[0] - 1)
     fit_params_save = []
+    if chunk_slices is None:
+        chunk_slices = get_time_bin_slices(these_spike_times, time_chunks[:-1], time_chunks[1:])
     for time_chunk_idx in range(time_chunks.shape[0] - 1):
         # amplitude histogram
         n_bins = 50
-        chunk_idx = np.logical_and(
-            these_spike_times >= time_chunks[time_chunk_idx],
-            these_spike_times < time_chunks[time_chunk_idx + 1],
-        )
-
-        these_amplitudes_here = these_amplitudes[chunk_idx]
+        these_amplitudes_here = these_amplitudes[
+            chunk_slices[0][time_chunk_idx] : chunk_slices[1][time_chunk_idx]
+        ]
         
         if these_amplitudes_here.size == 0:
             percent_missing_gaussian[time_chunk_idx] = np.nan
@@ -568,7 +591,192 @@ def perc_spikes_missing(these_amplitudes, these_spike_times, time_chunks, param,
             percent_missing_symmetric
         )
 
-def fraction_RP_violations(these_spike_times, these_amplitudes, time_chunks, param, return_per_bin = False):
+@njit(cache=True)
+def count_pairwise_violations(spike_times, tauR_window, tauC):
+    """
+    Counts all spike pairs (not only consecutive ones) whose interval lies in [tauC, tauR] for every tauR value,
+    in one sweep over the spikes.
+    For each spike i the first spike j > i with t[j] - t[i] >= tauC and the last spike with t[j] - t[i] <= tauR are
+    found with pointers that only move forward, so the cost is O(n_spikes * n_tauR) instead of O(n_spikes ** 2).
+    The same differences and inequalities as the direct pair-wise loop are used, so the counts are identical.
+
+    Parameters
+    ----------
+    spike_times : ndarray
+        The sorted spike times of a unit (in seconds)
+    tauR_window : ndarray
+        The refractory period values, in ascending order
+    tauC : float
+        The censored period
+
+    Returns
+    -------
+    num_violations : ndarray (n_tauR)
+        The number of spike pairs with tauC <= interval <= tauR for each tauR value
+    """
+    n_spikes = spike_times.shape[0]
+    n_tauR = tauR_window.shape[0]
+    num_violations = np.zeros(n_tauR, dtype=np.int64)
+
+    # lo: first spike at least tauC after spike i, hi[k]: first spike more than tauR_window[k] after spike i
+    lo = 1
+    hi = np.ones(n_tauR, dtype=np.int64)
+    for i in range(n_spikes - 1):
+        if lo <= i:
+            lo = i + 1
+        while lo < n_spikes and spike_times[lo] - spike_times[i] < tauC:
+            lo += 1
+        for k in range(n_tauR):
+            if hi[k] <= i:
+                hi[k] = i + 1
+            while hi[k] < n_spikes and spike_times[hi[k]] - spike_times[i] <= tauR_window[k]:
+                hi[k] += 1
+            if hi[k] > lo:
+                num_violations[k] += hi[k] - lo
+
+    return num_violations
+
+
+def get_hill_fraction_RPVs(num_violations, n_spikes, duration, tauR_window, tauC):
+    """
+    Solves the Hill et al. refractory period violation quadratic in closed form for every cell at once.
+    The smallest root of k * x**2 - k * x + nRPVs * T = 0 (k = 2 * (tauR - tauC) * N**2) is
+    (1 - sqrt(1 - 4 * nRPVs * T / k)) / 2, written as 2q / (1 + sqrt(1 - 4q)) with q = nRPVs * T / k to avoid
+    cancellation. Cells with complex roots or a fraction above 1 get the same fallbacks as the per-cell solve.
+
+    Parameters
+    ----------
+    num_violations : ndarray (..., n_tauR)
+        The number of ISI violations for each cell and tauR value
+    n_spikes : ndarray or int
+        The number of spikes in each cell, broadcastable against num_violations
+    duration : ndarray or float
+        The duration of each cell in seconds, broadcastable against num_violations
+    tauR_window : ndarray (n_tauR)
+        The refractory period values
+    tauC : float
+        The censored period
+
+    Returns
+    -------
+    fraction_RPVs : ndarray (..., n_tauR)
+        The estimated fraction of refractory period violations
+    overestimate_bool : ndarray (..., n_tauR)
+        1 where the estimate was capped at 1 because the assumptions fail
+    """
+    num_violations = np.asarray(num_violations, dtype=np.float64)
+    n_spikes = np.asarray(n_spikes, dtype=np.float64)
+    k = 2 * (tauR_window - tauC) * n_spikes**2
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        q = num_violations * duration / k
+        discriminant = 1 - 4 * q
+        real_root = 2 * q / (1 + np.sqrt(np.maximum(discriminant, 0)))
+        # complex roots, use the approximation formula when possible
+        approximation = num_violations / (2 * (tauR_window - tauC) * (n_spikes - num_violations))
+
+    has_real_root = discriminant >= 0
+    fraction_RPVs = np.where(has_real_root, real_root, approximation)
+    overestimate_bool = np.zeros(fraction_RPVs.shape)
+    saturated = ~has_real_root & (num_violations >= n_spikes)
+    fraction_RPVs[saturated] = 1
+    overestimate_bool[saturated] = 1
+
+    # Cap fraction at 1 (assumptions failing if > 1)
+    too_high = fraction_RPVs > 1
+    fraction_RPVs[too_high] = 1
+    overestimate_bool[too_high] = 1
+
+    # No observed refractory period violations
+    no_violations = num_violations == 0
+    fraction_RPVs[no_violations] = 0
+    overestimate_bool[no_violations] = 0
+
+    return fraction_RPVs, overestimate_bool
+
+
+def get_hill_RP_violations(spike_times_by_unit, unit_starts, unit_stops, time_chunks, param):
+    """
+    Batched version of fraction_RP_violations with the Hill et al. method, for many units in one call.
+    The ISIs of every unit and time chunk are binned against the tauR values and accumulated, which gives the
+    violation counts for all tauR values at once, then the estimator is solved for the whole
+    (unit, time chunk, tauR) grid with get_hill_fraction_RPVs.
+
+    Parameters
+    ----------
+    spike_times_by_unit : ndarray
+        The spike times in seconds, ordered by unit (see loading_utils.get_spike_index)
+    unit_starts : ndarray (n_units)
+        The start of each unit's spikes in spike_times_by_unit
+    unit_stops : ndarray (n_units)
+        The end of each unit's spikes in spike_times_by_unit
+    time_chunks : ndarray
+        The time chunks to consider
+    param : dict
+        The param dictionary, uses tauR_valuesMin, tauR_valuesMax, tauR_valuesStep and tauC
+
+    Returns
+    -------
+    fraction_RPVs : ndarray (n_units, n_time_chunks, n_tauR)
+        The fraction of refractory period violations for each unit, time chunk and tauR value
+    num_violations : ndarray (n_units, n_time_chunks, n_tauR)
+        The number of refractory period violations for each unit, time chunk and tauR value
+    """
+    tauR_min = param["tauR_valuesMin"]
+    tauR_max = param["tauR_valuesMax"]
+    tauR_step = param["tauR_valuesStep"]
+    assert tauR_min <= tauR_max, "tauR_max is smaller than tauR_min! Check parameters!"
+    tauR_window = np.arange(tauR_min, tauR_max + tauR_step, tauR_step)
+    tauC = param["tauC"]
+
+    unit_starts = np.asarray(unit_starts)
+    unit_stops = np.asarray(unit_stops)
+    n_units = unit_starts.shape[0]
+    n_chunks = time_chunks.shape[0] - 1
+    n_tauR = tauR_window.shape[0]
+    n_cells = n_units * n_chunks
+
+    # gather the units' spikes and find the unit and time chunk of every spike
+    unit_n_spikes = unit_stops - unit_starts
+    spike_unit = np.repeat(np.arange(n_units), unit_n_spikes)
+    gather_idx = np.arange(spike_unit.shape[0]) + np.repeat(
+        unit_starts - np.concatenate(([0], np.cumsum(unit_n_spikes)[:-1])), unit_n_spikes
+    )
+    spike_times = spike_times_by_unit[gather_idx]
+    spike_chunk = np.searchsorted(time_chunks, spike_times, side="right") - 1
+    in_chunk = (spike_chunk >= 0) & (spike_chunk < n_chunks)
+    spike_cell = spike_unit[in_chunk] * n_chunks + spike_chunk[in_chunk]
+    spike_times = spike_times[in_chunk]
+    n_chunk_spikes = np.bincount(spike_cell, minlength=n_cells)
+
+    # ISIs between consecutive spikes of the same unit and time chunk
+    cell_order = np.argsort(spike_cell, kind="stable")
+    spike_cell = spike_cell[cell_order]
+    spike_times = spike_times[cell_order]
+    same_cell = spike_cell[1:] == spike_cell[:-1]
+    isis = np.diff(spike_times)[same_cell]
+    isi_cell = spike_cell[1:][same_cell]
+
+    # an ISI violates every tauR from the first one with isi <= tauR onwards
+    isi_tauR_idx = np.searchsorted(tauR_window, isis, side="left")
+    violating = isi_tauR_idx < n_tauR
+    violations_hist = np.bincount(
+        isi_cell[violating] * n_tauR + isi_tauR_idx[violating], minlength=n_cells * n_tauR
+    ).reshape(n_cells, n_tauR)
+    num_violations = np.cumsum(violations_hist, axis=1).reshape(n_units, n_chunks, n_tauR).astype(np.float64)
+
+    fraction_RPVs, _ = get_hill_fraction_RPVs(
+        num_violations,
+        n_chunk_spikes.reshape(n_units, n_chunks, 1),
+        np.diff(time_chunks)[None, :, None],
+        tauR_window,
+        tauC,
+    )
+
+    return fraction_RPVs, num_violations
+
+
+def fraction_RP_violations(these_spike_times, these_amplitudes, time_chunks, param, return_per_bin = False, chunk_slices = None):
     """
     This function estimates the fraction of refractory period violations for a given unit.
 
@@ -591,6 +799,8 @@ def fraction_RP_violations(these_spike_times, these_amplitudes, time_chunks, par
         - RPV_tauR_estimate: index of tauR to use for plotting (optional)
     return_per_bin : bool, optional
         If True will return per-bin data for GUI plotting, by default False
+    chunk_slices : tuple, optional
+        The spikes in each time chunk from get_time_bin_slices, by default computed here
 
     Returns
     -------
@@ -638,14 +848,14 @@ def fraction_RP_violations(these_spike_times, these_amplitudes, time_chunks, par
         # Create the top panel that spans all columns
         ax_top = fig.add_subplot(gs[0, :])
 
+    if chunk_slices is None:
+        chunk_slices = get_time_bin_slices(these_spike_times, time_chunks[:-1], time_chunks[1:])
+
     # Loop through each time chunk
     for time_chunk_idx in range(time_chunks.shape[0] - 1):
         # Get spikes in this chunk
         chunk_spike_times = these_spike_times[
-            np.logical_and(
-                these_spike_times >= time_chunks[time_chunk_idx],
-                these_spike_times < time_chunks[time_chunk_idx + 1],
-            )
+            chunk_slices[0][time_chunk_idx] : chunk_slices[1][time_chunk_idx]
         ]
         
         # Number of spikes in chunk
@@ -660,63 +870,32 @@ def fraction_RP_violations(these_spike_times, these_amplitudes, time_chunks, par
         else:
             chunk_ISIs = np.array([])
         
-        # Loop through each tauR value
-        for i_tau_r, tauR in enumerate(tauR_window):
-            # Calculate number of refractory period violations
-            if n_chunk > 1:
-                num_violations[time_chunk_idx, i_tau_r] = np.sum(chunk_ISIs <= tauR)
-                # Calculate raw fraction for plotting
-                RPV_fraction[time_chunk_idx, i_tau_r] = num_violations[time_chunk_idx, i_tau_r] / n_chunk
-            else:
-                num_violations[time_chunk_idx, i_tau_r] = 0
-                RPV_fraction[time_chunk_idx, i_tau_r] = 0
-                
-            # Apply either Hill or Llobet method
-            if param["hillOrLlobetMethod"]:
-                # Hill et al. method
-                k = 2 * (tauR - tauC) * n_chunk**2
-                T = duration_chunk
-                
-                if num_violations[time_chunk_idx, i_tau_r] == 0:
-                    # No observed refractory period violations
-                    fraction_RPVs[time_chunk_idx, i_tau_r] = 0
-                    overestimate_bool[time_chunk_idx, i_tau_r] = 0
-                else:
-                    # Solve the quadratic equation
-                    # Using coefficients [k, -k, nRPVs * T] to match MATLAB
-                    rts = np.roots([k, -k, num_violations[time_chunk_idx, i_tau_r] * T])
-                    
-                    # Get minimum root and check if it's real
-                    min_root = np.min(rts)
-                    if np.isreal(min_root):
-                        fraction_RPVs[time_chunk_idx, i_tau_r] = np.real(min_root)
-                        overestimate_bool[time_chunk_idx, i_tau_r] = 0
-                    else:
-                        # If roots are complex, use approximation formula
-                        if num_violations[time_chunk_idx, i_tau_r] < n_chunk:
-                            fraction_RPVs[time_chunk_idx, i_tau_r] = num_violations[time_chunk_idx, i_tau_r] / (
-                                2 * (tauR - tauC) * (n_chunk - num_violations[time_chunk_idx, i_tau_r])
-                            )
-                        else:
-                            fraction_RPVs[time_chunk_idx, i_tau_r] = 1
-                            overestimate_bool[time_chunk_idx, i_tau_r] = 1
-                            
-                    # Cap fraction at 1 (assumptions failing if > 1)
-                    if fraction_RPVs[time_chunk_idx, i_tau_r] > 1:
-                        fraction_RPVs[time_chunk_idx, i_tau_r] = 1
-                        overestimate_bool[time_chunk_idx, i_tau_r] = 1
+        # Calculate number of refractory period violations for every tauR value
+        if n_chunk > 1:
+            num_violations[time_chunk_idx] = np.searchsorted(np.sort(chunk_ISIs), tauR_window, side="right")
+            # Calculate raw fraction for plotting
+            RPV_fraction[time_chunk_idx] = num_violations[time_chunk_idx] / n_chunk
+
+        # Apply either Hill or Llobet method
+        if param["hillOrLlobetMethod"]:
+            # Hill et al. method, solved for all tauR values at once
+            fraction_RPVs[time_chunk_idx], overestimate_bool[time_chunk_idx] = get_hill_fraction_RPVs(
+                num_violations[time_chunk_idx], n_chunk, duration_chunk, tauR_window, tauC
+            )
+        else:
+            # Llobet et al. method, counts all pair-wise violations for every tauR value at once
+            N = len(chunk_spike_times)
+            if N > 1:
+                if np.any(chunk_ISIs < 0):
+                    chunk_spike_times = np.sort(chunk_spike_times)
+                pair_violations = count_pairwise_violations(
+                    chunk_spike_times.astype(np.float64), tauR_window.astype(np.float64), float(tauC)
+                )
             else:
-                # Llobet et al. method
-                N = len(chunk_spike_times)
-                isi_violations_sum = 0
-
-                # Count all pair-wise violations
-                if N > 1:
-                    for i in range(N - 1):
-                        isi_vec = chunk_spike_times[i+1:] - chunk_spike_times[i]
-                        isi_violations_sum += np.sum((isi_vec <= tauR) & (isi_vec >= tauC))
-                else:
-                    isi_violations_sum = 0
+                pair_violations = np.zeros(tauR_window.shape[0], dtype=np.int64)
+
+            for i_tau_r, tauR in enumerate(tauR_window):
+                isi_violations_sum = pair_violations[i_tau_r]
 
                 # Calculate fraction using Llobet equation
                 if N > 0:  # Avoid division by zero
@@ -825,8 +1004,7 @@ def time_chunks_to_keep(
     time_chunks,
     these_spike_times,
     these_amplitudes,
-    spike_clusters,
-    spike_times_seconds,
+    these_spike_idx,
     param,
 ):
     """
@@ -844,10 +1022,8 @@ def time_chunks_to_keep(
         The spike times of this unit
     these_amplitudes : ndarray
         The spike amplitudes of this unit
-    spike_clusters : ndarray
-        The template waveforms of this unit
-    spike_times_seconds : ndarray
-        The spike times in seconds
+    these_spike_idx : ndarray
+        The indices of this unit's spikes in the full spike arrays
     param : dict
         The param dictionary
 
@@ -857,8 +1033,8 @@ def time_chunks_to_keep(
         Good time chunks to use
     these_amplitudes : ndarray
         The amplitudes for the good time chunks
-    these_spike_clusters : ndarray
-        The spike times for these good time chunks
+    these_spike_idx : ndarray
+        The indices of this unit's spikes in the good time chunks
     use_this_time_start : float
         The start of the good time chunk
     use_this_time_end : float
@@ -924,27 +1100,14 @@ def time_chunks_to_keep(
         # if there are no good time chunks use all time chunks for subsequent computations
         use_these_times = time_chunks
 
-    # select which ones to keep
-    these_amplitudes = these_amplitudes[
-        np.logical_and(
-            these_spike_times >= use_these_times[0],
-            these_spike_times <= use_these_times[-1],
-        )
-    ]
-    these_spike_clusters = spike_clusters.copy().astype(np.int32)
-    these_spike_clusters[
-        np.logical_or(
-            spike_times_seconds < use_these_times[0], 
-            spike_times_seconds > use_these_times[-1],
-        )
-    ] = -1  # set to -1 for bad times
-
-    these_spike_times = these_spike_times[
-        np.logical_and(
-            these_spike_times >= use_these_times[0],
-            these_spike_times <= use_these_times[-1],
-        )
-    ]
+    # select which ones to keep, the unit's spike times are sorted so they are a contiguous slice
+    keep_spikes = slice(
+        np.searchsorted(these_spike_times, use_these_times[0], side="left"),
+        np.searchsorted(these_spike_times, use_these_times[-1], side="right"),
+    )
+    these_amplitudes = these_amplitudes[keep_spikes]
+    these_spike_idx = these_spike_idx[keep_spikes]
+    these_spike_times = these_spike_times[keep_spikes]
 
     use_this_time_start = use_these_times[0]
     use_this_time_end = use_these_times[-1]
@@ -952,14 +1115,57 @@ def time_chunks_to_keep(
     return (
         these_spike_times,
         these_amplitudes,
-        these_spike_clusters,
+        these_spike_idx,
         use_this_time_start,
         use_this_time_end,
         use_tauR,
     )
 
 
-def presence_ratio(these_spike_times, use_this_time_start, use_this_time_end, param):
+def get_spike_count_matrix(spike_times, spike_clusters, unit_ids, bin_edges):
+    """
+    Counts the spikes of every unit in every time bin of the session with a single bincount
+
+    Parameters
+    ----------
+    spike_times : ndarray
+        The spike times in seconds
+    spike_clusters : ndarray
+        The unit id of each spike
+    unit_ids : ndarray
+        The sorted unit ids, one row of the matrix per unit
+    bin_edges : ndarray
+        The edges of the time bins, bin i holds bin_edges[i] <= t < bin_edges[i + 1]
+
+    Returns
+    -------
+    spike_counts : ndarray (n_units, n_bins)
+        The number of spikes of each unit in each time bin
+    """
+    n_units = unit_ids.shape[0]
+    n_bins = bin_edges.shape[0] - 1
+
+    spike_rows = np.minimum(np.searchsorted(unit_ids, spike_clusters), max(n_units - 1, 0))
+    spike_bins = np.searchsorted(bin_edges, spike_times, side="right") - 1
+    counted = (spike_bins >= 0) & (spike_bins < n_bins)
+    if n_units > 0:
+        counted &= unit_ids[spike_rows] == spike_clusters
+
+    spike_counts = np.bincount(
+        spike_rows[counted] * n_bins + spike_bins[counted], minlength=n_units * n_bins
+    ).reshape(n_units, n_bins)
+
+    return spike_counts
+
+
+def presence_ratio(
+    these_spike_times,
+    use_this_time_start,
+    use_this_time_end,
+    param,
+    spike_counts=None,
+    bin_edges=None,
+):
     """
     Calculates the presence ratio of the unit in the good time range
 
@@ -973,6 +1179,10 @@ def presence_ratio(these_spike_times, use_this_time_start, use_this_time_end, pa
         The end of the good times
     param : dict
         The param dictionary
+    spike_counts : ndarray, optional
+        This unit's row of get_spike_count_matrix, with bins of presenceRatioBinSize
+    bin_edges : ndarray, optional
+        The bin edges used for spike_counts, needed if spike_counts is given
 
     Returns
     -------
@@ -986,18 +1196,28 @@ def presence_ratio(these_spike_times, use_this_time_start, use_this_time_end, pa
     presence_ratio_bins = np.arange(
         use_this_time_start, use_this_time_end, presenceRatioBinSize
     )
-
-    spikes_per_bin = np.array(
-        [
-            np.sum(
-                np.logical_and(
-                    these_spike_times >= presence_ratio_bins[x],
-                    these_spike_times < presence_ratio_bins[x + 1],
-                )
+    n_bins = presence_ratio_bins.shape[0] - 1
+
+    # use the session spike count matrix when the unit's bins lie on its bin edges
+    first_bin = -1
+    if spike_counts is not None and n_bins > 0:
+        first_bin = int(np.round((presence_ratio_bins[0] - bin_edges[0]) / presenceRatioBinSize))
+        if (
+            first_bin < 0
+            or first_bin + n_bins > spike_counts.shape[0]
+            or not np.allclose(
+                bin_edges[first_bin : first_bin + n_bins + 1], presence_ratio_bins, rtol=0, atol=1e-9
             )
-            for x in range(presence_ratio_bins.shape[0] - 1)
-        ]
-    )
+        ):
+            first_bin = -1
+
+    if first_bin >= 0:
+        spikes_per_bin = spike_counts[first_bin : first_bin + n_bins]
+    else:
+        bin_slices = get_time_bin_slices(
+            these_spike_times, presence_ratio_bins[:-1], presence_ratio_bins[1:]
+        )
+        spikes_per_bin = bin_slices[1] - bin_slices[0]
     
     full_bins = np.zeros_like(spikes_per_bin)
     threshold = 0.05 * np.percentile(spikes_per_bin, 90)
@@ -1010,15 +1230,174 @@ def presence_ratio(these_spike_times, use_this_time_start, use_this_time_end, pa
     return presence_ratio
 
 
+def get_spike_depths(
+    pc_features, pc_features_idx, spike_idx, spike_clusters, channel_positions, chunk_size=1000000
+):
+    """
+    Calculates the depth of spikes as the average of their PC feature channels' depths, weighted by the
+    squared (positive) first PC. Spikes are processed in chunks to limit the memory used.
+
+    Parameters
+    ----------
+    pc_features : ndarray
+        The top 3 PC features for the 32 most active channels for each spike
+    pc_features_idx : ndarray
+        Which channels are used for each unit
+    spike_idx : ndarray
+        The indices of the spikes to compute
+    spike_clusters : ndarray
+        The unit id of each of these spikes
+    channel_positions : ndarray
+        The (x,y) positions of each channel
+    chunk_size : int, optional
+        The number of spikes processed at once, by default 1000000
+
+    Returns
+    -------
+    spike_depths : ndarray
+        The depth of each spike
+    """
+    channel_positions_z = channel_positions[:, 1]
+    spike_depths = np.empty(spike_idx.shape[0])
+
+    for chunk_start in range(0, spike_idx.shape[0], chunk_size):
+        chunk = slice(chunk_start, chunk_start + chunk_size)
+        pc_features_pc1 = pc_features[spike_idx[chunk], 0, :]
+        pc_features_pc1[pc_features_pc1 < 0] = 0  # remove negative entries
+
+        pc_channel_pos_weights = channel_positions_z[pc_features_idx[spike_clusters[chunk], :]]
+
+        spike_depths[chunk] = np.sum(
+            pc_channel_pos_weights * pc_features_pc1**2, axis=1
+        ) / (np.nansum(pc_features_pc1**2, axis=1) + 1e-3) #adding small value to stop dividing by zero
+
+    return spike_depths
+
+
+def get_segment_medians(values, segment_ids, n_segments):
+    """
+    Calculates the median of values in each segment, ignoring NaNs, with one lexsort over all segments
+
+    Parameters
+    ----------
+    values : ndarray
+        The values
+    segment_ids : ndarray
+        The segment of each value, from 0 to n_segments - 1
+    n_segments : int
+        The number of segments
+
+    Returns
+    -------
+    segment_medians : ndarray (n_segments)
+        The median of each segment, NaN for segments without (non-NaN) values
+    """
+    # sort by segment then value, NaNs go to the end of each segment
+    sort_idx = np.lexsort((values, segment_ids))
+    sorted_values = values[sort_idx]
+    segment_starts = np.searchsorted(segment_ids[sort_idx], np.arange(n_segments), side="left")
+    n_valid = np.bincount(segment_ids[~np.isnan(values)], minlength=n_segments)
+
+    segment_medians = np.full(n_segments, np.nan)
+    has_values = n_valid > 0
+    lower_mid = (segment_starts + (n_valid - 1) // 2)[has_values]
+    upper_mid = (segment_starts + n_valid // 2)[has_values]
+    segment_medians[has_values] = (sorted_values[lower_mid] + sorted_values[upper_mid]) / 2
+
+    return segment_medians
+
+
+def get_drift_estimates(spike_times_by_unit, spike_depths_by_unit, unit_starts, unit_stops, param):
+    """
+    Calculates the drift of many units at once, the batched version of max_drift_estimate.
+    The median spike depth of every (unit, time bin) is found with a single get_segment_medians call.
+
+    Parameters
+    ----------
+    spike_times_by_unit : ndarray
+        The sorted spike times of the units, each unit a contiguous slice
+    spike_depths_by_unit : ndarray
+        The spike depths from get_spike_depths, in the same order
+    unit_starts : ndarray (n_units)
+        The start of each unit's spikes
+    unit_stops : ndarray (n_units)
+        The end of each unit's spikes
+    param : dict
+        The param dictionary
+
+    Returns
+    -------
+    max_drift_estimates : ndarray (n_units)
+        The maximum drift estimated for each unit
+    cumulative_drift_estimates : ndarray (n_units)
+        The cumulative drift estimated over the recording session for each unit
+    per_bin_data : list
+        For each unit a dict with 'time_bins', 'median_spike_depth_per_bin'
+    """
+    n_units = unit_starts.shape[0]
+    unit_time_bins = []
+    bin_starts = [np.zeros(0, dtype=int)]
+    bin_stops = [np.zeros(0, dtype=int)]
+    for unit_idx in range(n_units):
+        these_spike_times = spike_times_by_unit[unit_starts[unit_idx] : unit_stops[unit_idx]]
+        driftBinSize = param["driftBinSize"]
+        time_bins = np.zeros(0)
+        if these_spike_times.size > 0:
+            # NOTE this allow units which are only active briefly to still have two bins
+            if these_spike_times[-1] - these_spike_times[0] < 2 * driftBinSize:
+                driftBinSize = (these_spike_times[-1] - these_spike_times[0]) / 2
+            if driftBinSize > 0:
+                time_bins = np.arange(these_spike_times[0], these_spike_times[-1], driftBinSize)
+
+        slice_starts, slice_stops = get_time_bin_slices(
+            these_spike_times, time_bins[:-1], time_bins[:-1] + driftBinSize
+        )
+        unit_time_bins.append(time_bins)
+        bin_starts.append(slice_starts + unit_starts[unit_idx])
+        bin_stops.append(slice_stops + unit_starts[unit_idx])
+
+    # gather the spikes of every (unit, time bin) segment
+    n_bins = np.array([max(time_bins.shape[0] - 1, 0) for time_bins in unit_time_bins], dtype=int)
+    bin_starts = np.concatenate(bin_starts).astype(int)
+    bin_lengths = np.concatenate(bin_stops).astype(int) - bin_starts
+    segment_ids = np.repeat(np.arange(bin_starts.shape[0]), bin_lengths)
+    gather_idx = np.arange(segment_ids.shape[0]) + np.repeat(
+        bin_starts - np.concatenate(([0], np.cumsum(bin_lengths)[:-1])), bin_lengths
+    )
+    median_spike_depths = get_segment_medians(
+        spike_depths_by_unit[gather_idx], segment_ids, bin_starts.shape[0]
+    )
+
+    max_drift_estimates = np.full(n_units, np.nan)
+    cumulative_drift_estimates = np.full(n_units, np.nan)
+    per_bin_data = []
+    bin_offsets = np.concatenate(([0], np.cumsum(n_bins)))
+    for unit_idx in range(n_units):
+        median_spike_depth = median_spike_depths[bin_offsets[unit_idx] : bin_offsets[unit_idx + 1]]
+        if np.any(~np.isnan(median_spike_depth)):
+            max_drift_estimates[unit_idx] = np.nanmax(median_spike_depth) - np.nanmin(median_spike_depth)
+            cumulative_drift_estimates[unit_idx] = np.sum(
+                np.abs(np.diff(median_spike_depth[~np.isnan(median_spike_depth)]))
+            )
+        per_bin_data.append(
+            {
+                'time_bins': unit_time_bins[unit_idx],
+                'median_spike_depth_per_bin': median_spike_depth.copy()
+            }
+        )
+
+    return max_drift_estimates, cumulative_drift_estimates, per_bin_data
+
+
 def max_drift_estimate(
     pc_features,
     pc_features_idx,
-    spike_clusters,
+    these_spike_idx,
     these_spike_times,
     this_unit,
     channel_positions,
     param,
-    return_per_bin = False
+    return_per_bin = False,
 ):
     """
     Calculates the drift of the unit using the PC components for each channels
@@ -1029,8 +1408,8 @@ def max_drift_estimate(
         The top 3 PC features for the 32 most active channels for each unit
     pc_features_idx : ndarray
         Which channels are used for each unit
-    spike_clusters : ndarray
-        The array which assigns each spike to a unit
+    these_spike_idx : ndarray
+        The indices of the current unit's spikes (in the good time chunks)
     these_spike_times : ndarray
         The spike times for the current unit
     this_unit : ndarray
@@ -1051,30 +1430,15 @@ def max_drift_estimate(
     per_bin_data : dict, optional
         If return_per_bin=True, returns dict with 'time_bins', 'median_spike_depth_per_bin'
     """
-    channel_positions_z = channel_positions[:, 1]
     driftBinSize = param["driftBinSize"]
 
-    # good_times_spikes = np.ones_like(spike_clusters)
-    # good_times_spikes[spike_clusters == -1] = 0
-    # pc_features_drift = pc_features[good_times_spikes == 1, :, :]
-    # spike_clusters_current = spike_clusters[good_times_spikes == 1].astype(np.int32)
-
-    # pc_features_pc1 = pc_features_drift[spike_clusters_current == this_unit, 0, :]
-    # pc_features_pc1[pc_features_pc1 < 0] = 0 # remove negative entries
-
-    pc_features_pc1 = pc_features[spike_clusters == this_unit, 0, :]
-    pc_features_pc1[pc_features_pc1 < 0] = 0  # remove negative entries
-
-    # NOTE test with and without only getting this units pc feature idx here
-    # this is just several thousand copies of the same 32/ n_pce_feature array
-    # spike_pc_feature = pc_features_idx[spike_clusters[spike_clusters == this_unit], :] # get channel for each spike
-    spike_pc_feature = pc_features_idx[this_unit, :]
-
-    pc_channel_pos_weights = channel_positions_z[spike_pc_feature]
-
-    spike_depth_in_channels = np.sum(
-        pc_channel_pos_weights[np.newaxis, :] * pc_features_pc1**2, axis=1
-    ) / (np.nansum(pc_features_pc1**2, axis=1) + 1e-3) #adding small value to stop dividing by zero
+    spike_depth_in_channels = get_spike_depths(
+        pc_features,
+        pc_features_idx,
+        these_spike_idx,
+        np.full(these_spike_idx.shape[0], this_unit),
+        channel_positions,
+    )
 
     # estimate cumulative drift
 
@@ -1087,13 +1451,11 @@ def max_drift_estimate(
     )
 
     median_spike_depth = np.zeros(time_bins.shape[0] - 1)
-    for i, time_bin_start in enumerate(time_bins[:-1]):
-        all_spike_depths = spike_depth_in_channels[
-                np.logical_and(
-                    these_spike_times >= time_bin_start,
-                    these_spike_times < (time_bin_start + driftBinSize),
-                )
-            ]
+    bin_slices = get_time_bin_slices(
+        these_spike_times, time_bins[:-1], time_bins[:-1] + driftBinSize
+    )
+    for i in range(time_bins.shape[0] - 1):
+        all_spike_depths = spike_depth_in_channels[bin_slices[0][i] : bin_slices[1][i]]
         if all_spike_depths.size > 0:
             median_spike_depth[i] = np.nanmedian(all_spike_depths)
         else:
@@ -1683,8 +2045,117 @@ def custom_mahal_loop(test_spike_features, current_spike_features):
     return mahal
 
 
+def get_channel_unit_index(pc_features_idx, unit_ids):
+    """
+    Indexes which units have PC features on each channel, so the units sharing channels with
+    a unit can be found without looping over all units
+
+    Parameters
+    ----------
+    pc_features_idx : ndarray (n_templates, n_pc_channels)
+        Which channels are used for each unit
+    unit_ids : ndarray
+        The ids of the units to index
+
+    Returns
+    -------
+    channel_index : dict
+        channels : the sorted channel of every (unit, channel slot) pair
+        unit_ids : the unit of every pair
+        slots : the position of the channel in the unit's pc_features channels
+    """
+    unit_ids = np.asarray(unit_ids)
+    unit_channels = pc_features_idx[unit_ids]
+    n_slots = unit_channels.shape[1]
+
+    flat_channels = unit_channels.ravel()
+    channel_order = np.argsort(flat_channels, kind="stable")
+    channel_index = {
+        "channels": flat_channels[channel_order],
+        "unit_ids": np.repeat(unit_ids, n_slots)[channel_order],
+        "slots": np.tile(np.arange(n_slots), unit_ids.size)[channel_order],
+    }
+    return channel_index
+
+
+def get_channel_units(channel_index, channel):
+    """
+    Gets the units which have PC features on a channel
+
+    Parameters
+    ----------
+    channel_index : dict
+        The channel index from get_channel_unit_index
+    channel : int
+        The channel
+
+    Returns
+    -------
+    unit_ids : ndarray
+        The sorted ids of the units with the channel
+    slots : ndarray
+        The position of the channel in each unit's pc_features channels
+    """
+    start, stop = np.searchsorted(channel_index["channels"], [channel, channel + 1])
+    # the first slot of each unit, if a channel is repeated
+    unit_ids, first_idx = np.unique(channel_index["unit_ids"][start:stop], return_index=True)
+    return unit_ids, channel_index["slots"][start:stop][first_idx]
+
+
+def get_mahalanobis_distances(test_spike_features, current_spike_features, batch_size=262144):
+    """
+    Calculates the squared mahalanobis distance of test spikes to the distribution of the current
+    spikes. The covariance is factorised once and all test spikes are solved in batches, instead
+    of one product per spike like custom_mahal_loop
+
+    Parameters
+    ----------
+    test_spike_features : ndarray (n_spikes_other, pc_size * n_channels)
+        The features of the spikes to test
+    current_spike_features : ndarray (n_spikes, pc_size * n_channels)
+        The features of the spikes of the current unit
+    batch_size : int, optional
+        The number of test spikes solved at once, by default 262144
+
+    Returns
+    -------
+    mahal : ndarray (n_spikes_other)
+        The mahal score for the test units against the current unit distribution
+    """
+    current_spike_features = np.asarray(current_spike_features, dtype=np.float64)
+    mean_data = current_spike_features.mean(axis=0)
+
+    # Add regularization to handle singular matrices
+    cov = np.atleast_2d(np.cov(current_spike_features.T))
+    cov_reg = cov + 1e-10 * np.eye(cov.shape[0])
+    try:
+        cholesky = np.linalg.cholesky(cov_reg)
+        inv_covmat = None
+    except np.linalg.LinAlgError:
+        # not positive definite, fall back to the inverse
+        cholesky = None
+        inv_covmat = np.linalg.inv(cov_reg)
+
+    mahal = np.zeros(test_spike_features.shape[0])
+    for start in range(0, test_spike_features.shape[0], batch_size):
+        test_features_mu = (
+            np.asarray(test_spike_features[start : start + batch_size], dtype=np.float64)
+            - mean_data[np.newaxis, :]
+        )
+        if cholesky is not None:
+            z = solve_triangular(cholesky, test_features_mu.T, lower=True, check_finite=False)
+            mahal[start : start + batch_size] = np.sum(z**2, axis=0)
+        else:
+            mahal[start : start + batch_size] = np.sum(
+                (test_features_mu @ inv_covmat) * test_features_mu, axis=1
+            )
+
+    return mahal
+
+
 def get_distance_metrics(
-    pc_features, pc_features_idx, this_unit, spike_clusters, param
+    pc_features, pc_features_idx, this_unit, spike_clusters, param, spike_index=None,
+    channel_index=None,
 ):
     """
     Generates functional distance based metrics, such as L-ratio mahalanobis distance
@@ -1701,6 +2172,12 @@ def get_distance_metrics(
         The array which assigns each spike to a unit
     param : dict
         The param dictionary
+    spike_index : dict, optional
+        The spike index from loading_utils.get_spike_index, if given each unit's spikes
+        are taken from it instead of masking all spikes for every unit
+    channel_index : dict, optional
+        The channel index from get_channel_unit_index, computed if not given; pass it
+        when computing many units
 
     Returns
     -------
@@ -1714,108 +2191,88 @@ def get_distance_metrics(
     # get distance metrics
 
     n_pcs = pc_features.shape[1]  # should be 3
+    n_channels_iso_dist = param["nChannelsIsoDist"]
 
     # get current unit max 'n_chans_to_use' chanels
-    these_channels = pc_features_idx[this_unit, 0 : param["nChannelsIsoDist"]]
+    these_channels = pc_features_idx[this_unit, 0 : n_channels_iso_dist]
+
+    if spike_index is None:
+        unique_ids = np.unique(spike_clusters) # np.unique(spike_clusters[spike_clusters > 0])
+    else:
+        unique_ids = spike_index["unit_ids"]
+    if channel_index is None:
+        channel_index = get_channel_unit_index(pc_features_idx, unique_ids)
+
+    def unit_spikes(unit_id):
+        if spike_index is None:
+            return np.flatnonzero(spike_clusters == unit_id)
+        unit_idx = np.searchsorted(unique_ids, unit_id)
+        return spike_index["spike_order"][
+            spike_index["unit_starts"][unit_idx] : spike_index["unit_stops"][unit_idx]
+        ]
 
     # current units features
-    this_unit_idx = spike_clusters == this_unit
-    n_spikes = this_unit_idx.sum()
+    this_unit_idx = unit_spikes(this_unit)
+    n_spikes = this_unit_idx.size
     these_features = np.reshape(
-        pc_features[this_unit_idx, :, : param["nChannelsIsoDist"]],
+        pc_features[this_unit_idx, :, : n_channels_iso_dist],
         (n_spikes, -1),
     )
 
-    # precompute unique identifiers and allocate space for outputs
-    unique_ids = np.unique(spike_clusters) # np.unique(spike_clusters[spike_clusters > 0])
-    mahalanobis_distance = np.zeros(unique_ids.size)  # JF: i don't think is used
-    other_units_double = np.zeros(unique_ids.size)  # JF: i don't think is used
-    # NOTE the first dimension here maybe the prbolem?
-    other_features = np.zeros(
-        (pc_features.shape[0], pc_features.shape[1], param["nChannelsIsoDist"])
-    )
-    other_features_ind = np.full(
-        (pc_features.shape[0], param["nChannelsIsoDist"]), np.nan
-    )
-    n_count = 0  # ML/python difference
-
-    for i, id in enumerate(unique_ids):
-        if id == this_unit:
-            continue
-
-        # identify channels associated with the current ID
-        current_channels = pc_features_idx[id, :]
-        other_spikes = np.squeeze(spike_clusters == id)
-
-        # process channels that are common between current channels and the unit of interest
-        # NOTE This bit could likely be faster.
-        for channel_idx in range(param["nChannelsIsoDist"]):
-            if np.isin(these_channels[channel_idx], current_channels):
-                common_channel_idx = np.squeeze(np.argwhere(current_channels == these_channels[channel_idx]))
-                channel_spikes = pc_features[other_spikes, :, common_channel_idx]
-                other_features[
-                    n_count : n_count + channel_spikes.shape[0], :, channel_idx
-                ] = channel_spikes
-                other_features_ind[
-                    n_count : n_count + channel_spikes.shape[0], channel_idx
-                ] = id
-                # n_count += channel_spikes.shape[0]
-
-        # NOTE i think n_count shouldnt be in the each channel loop?
-        if np.any(np.isin(these_channels, current_channels)):
-            n_count = n_count + channel_spikes.shape[0]
-
-        # #calculate mahalanobis distance if applicable
-        # if np.any(np.isin(these_channels, current_channels)):
-        #     row_indicies = np.argwhere(other_features_ind == id)[:,0]
-        #     if np.logical_and(these_features.shape[0] > these_features.shape[1], row_indicies.size > these_features.shape[1]):
-        #         other_features_reshaped = np.reshape(other_features[row_indicies], (row_indicies.size, n_pcs * param['nChannelsIsoDist']))
-        #         #NOTE try using different functions
-        #         mahalanobis_distance[i] = np.nanmean(custom_mahal_loop(other_features_reshaped, these_features))
+    # where each of this unit's channels is in the other units' channels, -1 if not shared.
+    # Only spikes of units sharing this unit's main channel are compared, but all units
+    # sharing any channel count towards the number of other spikes
+    main_channel_units, _ = get_channel_units(channel_index, these_channels[0])
+    other_units = main_channel_units[main_channel_units != this_unit]
+    other_slots = np.full((other_units.size, n_channels_iso_dist), -1)
+    sharing_units = []
+    for channel_idx in range(n_channels_iso_dist):
+        channel_units, channel_slots = get_channel_units(channel_index, these_channels[channel_idx])
+        sharing_units.append(channel_units)
+        unit_pos = np.searchsorted(other_units, channel_units)
+        in_other_units = unit_pos < other_units.size
+        in_other_units[in_other_units] = other_units[unit_pos[in_other_units]] == channel_units[in_other_units]
+        other_slots[unit_pos[in_other_units], channel_idx] = channel_slots[in_other_units]
+    sharing_units = np.unique(np.concatenate(sharing_units))
+    sharing_units = sharing_units[sharing_units != this_unit]
+    n_count = int(sum(unit_spikes(unit_id).size for unit_id in sharing_units))
+
+    # gather the other units' features on the shared channels, zero on the others
+    other_features = []
+    for unit_id, slots in zip(other_units, other_slots):
+        other_spikes = unit_spikes(unit_id)
+        unit_features = np.zeros((other_spikes.size, n_pcs, n_channels_iso_dist), dtype=pc_features.dtype)
+        shared = slots >= 0
+        unit_features[:, :, shared] = pc_features[np.ix_(other_spikes, np.arange(n_pcs), slots[shared])]
+        other_features.append(unit_features)
 
     # predefine outputs
     isolation_dist = np.nan
     L_ratio = np.nan
     silhouette_score = np.nan
-    mahal_D = np.nan  # JF: I don't think this is used
-    histogram_mahal_units_counts = np.nan
-    histogram_mahal_units_edges = np.nan
-    histogram_mahal_noise_counts = np.nan
-    histogram_mahal_noise_edges = np.nan
 
-    # reshape features for the mahalanobis distance calc if there are other features
     # any other units have spikes at active channels and enough spikes to test
-    other_features = other_features[~np.isnan(other_features_ind[:, 0]), :, :]
-    other_features_ind = other_features_ind[~np.isnan(other_features_ind)]
-    #####FROM HERE !!!!
     if np.logical_and(
-        np.any(~np.isnan(other_features_ind)),
-        n_spikes > param["nChannelsIsoDist"] * n_pcs,
+        n_count > 0,
+        n_spikes > n_channels_iso_dist * n_pcs,
     ):
-        other_features = np.reshape(other_features, (other_features.shape[0], -1))
+        if len(other_features) > 0:
+            other_features = np.concatenate(other_features).reshape(-1, n_pcs * n_channels_iso_dist)
+        else:
+            other_features = np.zeros((0, n_pcs * n_channels_iso_dist))
 
-        mahal_sort = np.sort(custom_mahal_loop(other_features, these_features))
-        L = np.sum(1 - chi2.cdf(mahal_sort, n_pcs * param["nChannelsIsoDist"]))
+        mahal_sort = np.sort(get_mahalanobis_distances(other_features, these_features))
+        L = np.sum(1 - chi2.cdf(mahal_sort, n_pcs * n_channels_iso_dist))
         L_ratio = L / n_spikes
 
         if np.logical_and(
-            n_count > n_spikes, n_spikes > n_pcs * param["nChannelsIsoDist"]
+            n_count > n_spikes, n_spikes > n_pcs * n_channels_iso_dist
         ):
             # Only calculate isolation distance if we have enough spikes from other units
             if n_spikes < len(mahal_sort):
                 isolation_dist = mahal_sort[n_spikes]
             # Otherwise isolation_dist remains NaN (undefined)
 
-        mahal_self = custom_mahal_loop(these_features, these_features)
-        mahal_self_sort = np.sort(mahal_self)  # JF: I don't think this is used
-
-    # plt.hist(mahal_self, bins = 50, range = (0, np.quantile(mahal_self, 0.995)), density = True, histtype = 'step', label = 'mahal')
-    # plt.hist(mahal_sort, bins = 50, range = (0, np.quantile(mahal_sort, 0.995)), density = True, histtype = 'step', label = 'inter unit mahal')
-    # plt.title(f' L-ratio = {L_ratio:.4f}')
-    # plt.xlabel('mahalanobis_distance')
-    # plt.ylabel('probability')
-    # plt.legend()
-
     return (
         isolation_dist,
         L_ratio,
@@ -1858,6 +2315,38 @@ def get_raw_amplitude(this_raw_waveform, gain_to_uV, peak_channel=None):
     return raw_amplitude
 
 
+def get_raw_amplitudes(raw_waveforms, gain_to_uV, peak_channels):
+    """
+    The raw amplitude of all units at once, same as get_raw_amplitude on each unit's peak channel
+
+    Parameters
+    ----------
+    raw_waveforms : ndarray (n_units, n_channels, spike_width)
+        The extracted raw average waveforms
+    gain_to_uV : float
+        The waveform gain
+    peak_channels : ndarray (n_units)
+        The peak channel of each unit
+
+    Returns
+    -------
+    raw_amplitudes : ndarray (n_units)
+        The actual raw amplitude of each unit
+    """
+    if np.isnan(gain_to_uV):
+        return np.full(raw_waveforms.shape[0], np.nan)
+
+    peak_waveforms = (
+        raw_waveforms[np.arange(raw_waveforms.shape[0]), np.asarray(peak_channels, dtype=int), :]
+        * gain_to_uV
+    )
+    raw_amplitudes = np.abs(np.nanmax(peak_waveforms, axis=1)) + np.abs(
+        np.nanmin(peak_waveforms, axis=1)
+    )
+
+    return raw_amplitudes
+
+
 def get_quality_unit_type(param, quality_metrics):
     """
     Classifies neural units based on quality metrics.
@@ -1869,6 +2358,9 @@ def get_quality_unit_type(param, quality_metrics):
     3: Non-somatic units (good if split)
     4: Non-somatic MUA (if split)
 
+    Any classification threshold in param can also be a 1-D array of n_threshold_sets values,
+    to classify the units with every set of thresholds at once.
+
     Parameters
     ----------
     param : dict
@@ -1878,66 +2370,89 @@ def get_quality_unit_type(param, quality_metrics):
     
     Returns
     -------
-    unit_type : ndarray
+    unit_type : ndarray (n_units) or (n_threshold_sets, n_units)
         The unit type classifaction as a number
-    unit_type_string : ndarray
+    unit_type_string : ndarray (n_units) or (n_threshold_sets, n_units)
         The unit type classification as a string
     """
     n_units = len(quality_metrics["nPeaks"])
-    unit_type = np.full(n_units, np.nan)
+
+    def metric(name):
+        return np.asarray(quality_metrics[name], dtype=float)
+
+    def threshold(name):
+        # a grid of thresholds is compared to all units along a new first axis
+        value = np.asarray(param[name], dtype=float)
+        return value[:, np.newaxis] if value.ndim == 1 else value
+
+    threshold_names = [
+        "maxNPeaks", "maxNTroughs", "minWvDuration", "maxWvDuration", "maxWvBaselineFraction",
+        "maxScndPeakToTroughRatio_noise", "minSpatialDecaySlope", "minSpatialDecaySlopeExp",
+        "maxSpatialDecaySlopeExp", "minTroughToPeak2Ratio_nonSomatic", "minWidthFirstPeak_nonSomatic",
+        "minWidthMainTrough_nonSomatic", "maxPeak1ToPeak2Ratio_nonSomatic",
+        "maxMainPeakToTroughRatio_nonSomatic", "maxPercSpikesMissing", "minNumSpikes",
+        "maxRPVviolations", "minPresenceRatio", "minAmplitude", "minSNR", "maxDrift", "isoDmin", "lratioMax",
+    ]
+    n_threshold_sets = [np.size(param[k]) for k in threshold_names if np.ndim(param.get(k)) == 1]
+    if len(n_threshold_sets) > 0:
+        unit_type_shape = (n_threshold_sets[0], n_units)
+    else:
+        unit_type_shape = (n_units,)
+    unit_type = np.full(unit_type_shape, np.nan)
     
     # Noise classification
     noise_mask = (
-        np.isnan(quality_metrics["nPeaks"]) |
-        (quality_metrics["nPeaks"] > param["maxNPeaks"]) |
-        (quality_metrics["nTroughs"] > param["maxNTroughs"]) |
-        (quality_metrics["waveformDuration_peakTrough"] < param["minWvDuration"]) |
-        (quality_metrics["waveformDuration_peakTrough"] > param["maxWvDuration"]) |
-        (quality_metrics["waveformBaselineFlatness"] > param["maxWvBaselineFraction"]) |
-        (quality_metrics["scndPeakToTroughRatio"] > param["maxScndPeakToTroughRatio_noise"])
+        np.isnan(metric("nPeaks")) |
+        (metric("nPeaks") > threshold("maxNPeaks")) |
+        (metric("nTroughs") > threshold("maxNTroughs")) |
+        (metric("waveformDuration_peakTrough") < threshold("minWvDuration")) |
+        (metric("waveformDuration_peakTrough") > threshold("maxWvDuration")) |
+        (metric("waveformBaselineFlatness") > threshold("maxWvBaselineFraction")) |
+        (metric("scndPeakToTroughRatio") > threshold("maxScndPeakToTroughRatio_noise"))
     )
 
     if param["computeSpatialDecay"] & param["spDecayLinFit"]:
-        noise_mask |= (quality_metrics["spatialDecaySlope"] < param["minSpatialDecaySlope"])
+        noise_mask = noise_mask | (metric("spatialDecaySlope") < threshold("minSpatialDecaySlope"))
     elif param["computeSpatialDecay"]:
-        noise_mask |= (
-            (quality_metrics["spatialDecaySlope"] < param["minSpatialDecaySlopeExp"]) |
-            (quality_metrics["spatialDecaySlope"] > param["maxSpatialDecaySlopeExp"])
+        noise_mask = noise_mask | (
+            (metric("spatialDecaySlope") < threshold("minSpatialDecaySlopeExp")) |
+            (metric("spatialDecaySlope") > threshold("maxSpatialDecaySlopeExp"))
         )
     
-    unit_type[noise_mask] = 0
+    unit_type[np.broadcast_to(noise_mask, unit_type_shape)] = 0
     
     # Non-somatic classification
-    is_non_somatic = (
-        (quality_metrics["troughToPeak2Ratio"] < param["minTroughToPeak2Ratio_nonSomatic"]) &
-        (quality_metrics["mainPeak_before_width"] < param["minWidthFirstPeak_nonSomatic"]) &
-        (quality_metrics["mainTrough_width"] < param["minWidthMainTrough_nonSomatic"]) &
-        (quality_metrics["peak1ToPeak2Ratio"] > param["maxPeak1ToPeak2Ratio_nonSomatic"]) |
-        (quality_metrics["mainPeakToTroughRatio"] > param["maxMainPeakToTroughRatio_nonSomatic"])
+    is_non_somatic = np.broadcast_to(
+        (metric("troughToPeak2Ratio") < threshold("minTroughToPeak2Ratio_nonSomatic")) &
+        (metric("mainPeak_before_width") < threshold("minWidthFirstPeak_nonSomatic")) &
+        (metric("mainTrough_width") < threshold("minWidthMainTrough_nonSomatic")) &
+        (metric("peak1ToPeak2Ratio") > threshold("maxPeak1ToPeak2Ratio_nonSomatic")) |
+        (metric("mainPeakToTroughRatio") > threshold("maxMainPeakToTroughRatio_nonSomatic")),
+        unit_type_shape,
     )
     
     # MUA classification
     mua_mask = np.isnan(unit_type) & (
-        (quality_metrics["percentageSpikesMissing_gaussian"] > param["maxPercSpikesMissing"]) |
-        (quality_metrics["nSpikes"] < param["minNumSpikes"]) |
-        (quality_metrics["fractionRPVs_estimatedTauR"] > param["maxRPVviolations"]) |
-        (quality_metrics["presenceRatio"] < param["minPresenceRatio"])
+        (metric("percentageSpikesMissing_gaussian") > threshold("maxPercSpikesMissing")) |
+        (metric("nSpikes") < threshold("minNumSpikes")) |
+        (metric("fractionRPVs_estimatedTauR") > threshold("maxRPVviolations")) |
+        (metric("presenceRatio") < threshold("minPresenceRatio"))
     )
     
     if param["extractRaw"]:
         # Apply amplitude/SNR checks only to units with valid rawAmplitude values
-        mua_mask |= np.isnan(unit_type) & ~np.isnan(quality_metrics['rawAmplitude']) & (
-            (quality_metrics["rawAmplitude"] < param["minAmplitude"]) |
-            (quality_metrics["signalToNoiseRatio"] < param["minSNR"])
+        mua_mask |= np.isnan(unit_type) & ~np.isnan(metric("rawAmplitude")) & (
+            (metric("rawAmplitude") < threshold("minAmplitude")) |
+            (metric("signalToNoiseRatio") < threshold("minSNR"))
         )
     
     if param["computeDrift"]:
-        mua_mask |= np.isnan(unit_type) & (quality_metrics["maxDriftEstimate"] > param["maxDrift"])
+        mua_mask |= np.isnan(unit_type) & (metric("maxDriftEstimate") > threshold("maxDrift"))
     
     if param["computeDistanceMetrics"]:
         mua_mask |= np.isnan(unit_type) & (
-            (quality_metrics["isolationDistance"] < param["isoDmin"]) |
-            (quality_metrics["Lratio"] > param["lratioMax"])
+            (metric("isolationDistance") < threshold("isoDmin")) |
+            (metric("Lratio") > threshold("lratioMax"))
         )
     
     unit_type[mua_mask] = 2
@@ -1957,7 +2472,7 @@ def get_quality_unit_type(param, quality_metrics):
              3: "NON-SOMA GOOD" if param["splitGoodAndMua_NonSomatic"] else "NON-SOMA",
              4: "NON-SOMA MUA"}
     
-    unit_type_string = np.full(n_units, "", dtype=object)
+    unit_type_string = np.full(unit_type_shape, "", dtype=object)
     for code, label in labels.items():
         unit_type_string[unit_type == code] = label
     
@@ -1,4 +1,6 @@
 import os
+import json
+import pickle
 from pathlib import Path
 
 import numpy as np
@@ -6,7 +8,9 @@ import pandas as pd
 from typing import Dict, Tuple, List
 from numpy.typing import NDArray
 
+from joblib import hash as joblib_hash
 from cachecache import Cacher, distributed_cacher
+
 __cachedir__ = "~/.bombcell"
 global_bc_cacher = Cacher(__cachedir__)
 
@@ -51,6 +55,104 @@ def get_metric_keys():
             ]
 
 
+def get_stage_cache_key(*inputs):
+    """
+    Hashes the content of everything a quality metric stage depends on
+
+    Parameters
+    ----------
+    *inputs :
+        The arrays, parameter dictionaries and other hashes the stage depends on
+
+    Returns
+    -------
+    stage_key : str
+        The hash of the inputs
+    """
+    from bombcell import __version__
+
+    return joblib_hash((__version__,) + inputs)
+
+
+def get_file_cache_key(*file_paths):
+    """
+    Identifies input files by their path, size and modification time, a cheap cache key for large
+    arrays (e.g. pc_features.npy) which would have to be read in full to hash their content
+
+    Parameters
+    ----------
+    *file_paths :
+        The files, which may not exist
+
+    Returns
+    -------
+    file_key : str
+        The hash of the files' paths, sizes and modification times
+    """
+    file_stats = []
+    for file_path in file_paths:
+        file_path = Path(file_path)
+        if file_path.exists():
+            file_stat = file_path.stat()
+            file_stats.append((str(file_path.resolve()), file_stat.st_size, file_stat.st_mtime_ns))
+        else:
+            file_stats.append((str(file_path), None, None))
+    return get_stage_cache_key(*file_stats)
+
+
+def load_stage_cache(save_path, stage, stage_key):
+    """
+    Loads the cached results of a quality metric stage
+
+    Parameters
+    ----------
+    save_path : str
+        Bombcell results saving path
+    stage : str
+        The name of the stage
+    stage_key : str
+        The hash of the stage inputs, from get_stage_cache_key
+
+    Returns
+    -------
+    stage_results : list or None
+        The cached results, None if there is no cache for these inputs
+    """
+    cache_file = Path(save_path) / "_bc_cache" / f"{stage}.pkl"
+    if not cache_file.exists():
+        return None
+    try:
+        with open(cache_file, "rb") as f:
+            stage_cache = pickle.load(f)
+    except Exception as e:
+        print(f"Warning: could not load cached {stage} quality metrics: {e}")
+        return None
+    if stage_cache.get("stage_key") != stage_key:
+        return None
+    return stage_cache["stage_results"]
+
+
+def save_stage_cache(save_path, stage, stage_key, stage_results):
+    """
+    Saves the results of a quality metric stage, overwriting the previous cache of the stage
+
+    Parameters
+    ----------
+    save_path : str
+        Bombcell results saving path
+    stage : str
+        The name of the stage
+    stage_key : str
+        The hash of the stage inputs, from get_stage_cache_key
+    stage_results : list
+        The results of the stage
+    """
+    cache_dir = Path(save_path) / "_bc_cache"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    with open(cache_dir / f"{stage}.pkl", "wb") as f:
+        pickle.dump({"stage_key": stage_key, "stage_results": stage_results}, f)
+
+
 def save_quality_metric_tsv(metric_data, template_ids, output_dir, filename, column_names):
     """
     Save a quality metric array as a TSV file.
@@ -234,7 +336,7 @@ def save_params_as_parquet(
     param_df.to_parquet(str(file_path) + ".parquet")
 
 
-def save_waveforms_as_npy(raw_waveforms_full, raw_waveforms_peak_channel, raw_waveforms_id_match, save_path):
+def save_waveforms_as_npy(raw_waveforms_full, raw_waveforms_peak_channel, raw_waveforms_cluster_ids, save_path):
     """
     This function saves the raw waveform information as npy arrays
 
@@ -244,6 +346,9 @@ def save_waveforms_as_npy(raw_waveforms_full, raw_waveforms_peak_channel, raw_wa
         The (n_units, n_channels, time) array of extracted average raw waveforms
     raw_waveforms_peak_channel : ndarray
         The peak channels of the extracted raw waveforms
+    raw_waveforms_cluster_ids : ndarray
+        The cluster id of each row of raw_waveforms_full, the copy where the row number matches the
+        cluster id (_bc_rawWaveforms_kilosort_format.npy) is written by extract_raw_waveforms
     save_path : str
         The path to the save directory
     """
@@ -256,9 +361,6 @@ def save_waveforms_as_npy(raw_waveforms_full, raw_waveforms_peak_channel, raw_wa
     file_path_peak_channels = save_path / "templates._bc_rawWaveformPeakChannels.npy"
     np.save(file_path_peak_channels, raw_waveforms_peak_channel)
 
-    file_path_raw_waveforms_id_match = save_path / "_bc_rawWaveforms_kilosort_format"
-    np.save(file_path_raw_waveforms_id_match, raw_waveforms_id_match)
-
 
 def save_results(
     quality_metrics,
@@ -267,7 +369,7 @@ def save_results(
     param,
     raw_waveforms_full,
     raw_waveforms_peak_channel,
-    raw_waveforms_id_match,
+    raw_waveforms_cluster_ids,
     save_path,
     ks_dir,
 ):
@@ -288,6 +390,8 @@ def save_results(
         The (n_units, n_channels, time) array of extracted average raw waveforms
     raw_waveforms_peak_channel : ndarray
         The peak channels of the extracted raw waveforms
+    raw_waveforms_cluster_ids : ndarray
+        The cluster id of each row of raw_waveforms_full
     save_path : str
         The path to the save directory
     """
@@ -311,4 +415,95 @@ def save_results(
     )
 
     # Save waveforms
-    save_waveforms_as_npy(raw_waveforms_full, raw_waveforms_peak_channel, raw_waveforms_id_match, save_path)
+    save_waveforms_as_npy(raw_waveforms_full, raw_waveforms_peak_channel, raw_waveforms_cluster_ids, save_path)
+
+
+def _encode_gui_value(value, array_chunks, offset):
+    """
+    Encodes a GUI data value as JSON, numpy arrays are appended to array_chunks and replaced by
+    their [offset, dtype, shape] in the flat array file
+
+    Returns
+    -------
+    encoded : JSON serialisable value
+    offset : int
+        The byte offset in the array file after the appended arrays
+    """
+    if isinstance(value, np.ndarray) and value.dtype != object:
+        array_bytes = np.ascontiguousarray(value).tobytes()
+        array_chunks.append(array_bytes)
+        encoded = {"__array__": [offset, value.dtype.str, list(value.shape)]}
+        return encoded, offset + len(array_bytes)
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    if isinstance(value, np.generic):
+        return value.item(), offset
+    if isinstance(value, dict):
+        items = []
+        for k, v in value.items():
+            encoded_value, offset = _encode_gui_value(v, array_chunks, offset)
+            items.append((k.item() if isinstance(k, np.generic) else k, encoded_value))
+        if all(isinstance(k, str) for k, _ in items):
+            return dict(items), offset
+        return {"__dict__": [list(item) for item in items]}, offset
+    if isinstance(value, (list, tuple)):
+        encoded = []
+        for v in value:
+            encoded_value, offset = _encode_gui_value(v, array_chunks, offset)
+            encoded.append(encoded_value)
+        return encoded, offset
+    return value, offset
+
+
+def save_gui_data_store(gui_data, store_path, append=False):
+    """
+    Saves the GUI data, a {data type: {unit id: value}} dictionary, as a per-unit indexed store
+    which the GUI can open without reading every unit, see loading_utils.GUIDataStore.
+    Numpy arrays (amplitudes, fits, per time bin metrics...) are written back to back in arrays.bin,
+    and units.tsv has one line per unit: its id, its data types and its values as JSON, where arrays
+    are replaced by their offset, dtype and shape in arrays.bin. Nothing is pickled.
+
+    Parameters
+    ----------
+    gui_data : dict
+        The GUI data, {data type: {unit id: value}}
+    store_path : str
+        The store directory
+    append : bool, optional
+        If True the units are appended to an existing store without rewriting it, the values of a
+        unit saved again replace its previous values of the same data types, by default False
+    """
+    store_path = Path(store_path)
+    store_path.mkdir(parents=True, exist_ok=True)
+    units_file = store_path / "units.tsv"
+    arrays_file = store_path / "arrays.bin"
+    fields_file = store_path / "fields.json"
+    if not append or not units_file.exists():
+        append = False
+
+    # regroup by unit, so each unit is one line of the table
+    data_by_unit = {}
+    for field, values in gui_data.items():
+        for unit_id, value in values.items():
+            unit_id = unit_id.item() if isinstance(unit_id, np.generic) else unit_id
+            data_by_unit.setdefault(unit_id, {})[field] = value
+
+    fields = list(gui_data.keys())
+    if append and fields_file.exists():
+        with open(fields_file, "r") as f:
+            saved_fields = json.load(f)
+        fields = saved_fields + [k for k in fields if k not in saved_fields]
+
+    offset = arrays_file.stat().st_size if append and arrays_file.exists() else 0
+    mode = "ab" if append else "wb"
+    with open(arrays_file, mode) as arrays_f, open(units_file, mode) as units_f:
+        for unit_id, unit_data in data_by_unit.items():
+            array_chunks = []
+            encoded, offset = _encode_gui_value(unit_data, array_chunks, offset)
+            for array_bytes in array_chunks:
+                arrays_f.write(array_bytes)
+            unit_line = f"{json.dumps(unit_id)}\t{','.join(unit_data.keys())}\t{json.dumps(encoded)}\n"
+            units_f.write(unit_line.encode("utf-8"))
+
+    with open(fields_file, "w") as f:
+        json.dump(fields, f)
@@ -2,12 +2,18 @@ import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Button
 import matplotlib.gridspec as gridspec
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from pathlib import Path
 import pandas as pd
 import pickle
 import os
+import threading
+from collections import OrderedDict
 
-from bombcell.ccg_fast import acg, ccg
+from bombcell.ccg_fast import ccg, get_store_acg
+from bombcell.loading_utils import get_spike_index, get_unit_spike_idx, load_gui_data_store
+from bombcell.save_utils import save_gui_data_store, get_stage_cache_key
 
 try:
     import ipywidgets as widgets
@@ -52,7 +58,8 @@ def precompute_gui_data(ephys_data, quality_metrics, param, save_path=None):
     if param.get("verbose", False):
         print("Pre-computing GUI visualization data...")
     
-    unique_units = np.unique(ephys_data['spike_clusters'])
+    spike_index = get_spike_index(ephys_data['spike_clusters'])
+    unique_units = spike_index['unit_ids']
     n_units = len(unique_units)
     
     gui_data = {
@@ -221,9 +228,9 @@ def precompute_gui_data(ephys_data, quality_metrics, param, save_path=None):
                                 pass
         
         # Pre-compute amplitude fit
-        spike_mask = ephys_data['spike_clusters'] == unit_id
-        if 'template_amplitudes' in ephys_data and np.sum(spike_mask) > 10:
-            amplitudes = ephys_data['template_amplitudes'][spike_mask]
+        spike_idx = get_unit_spike_idx(spike_index, unit_id)
+        if 'template_amplitudes' in ephys_data and len(spike_idx) > 10:
+            amplitudes = ephys_data['template_amplitudes'][spike_idx]
             
             if SCIPY_AVAILABLE and len(amplitudes) > 10:
                 try:
@@ -290,7 +297,30 @@ def precompute_gui_data(ephys_data, quality_metrics, param, save_path=None):
                 'max_channel': max_ch,
                 'scaling_factor': np.ptp(max_ch_waveform) * 2.5 if max_ch_waveform is not None else 1.0
             }
-        
+    
+    # Pre-compute the autocorrelograms of all units at once, from their spikes in good time chunks
+    if 'spike_times' in ephys_data and n_units > 0:
+        from bombcell.helper_functions import get_good_time_chunk_spike_times, compute_gui_acg_store
+
+        acg_cbin, acg_cwin = 0.5, 100
+        spike_trains = []
+        for unit_idx, unit_id in enumerate(unique_units):
+            unit_metrics = {
+                k: quality_metrics[k][unit_idx] for k in ['useTheseTimesStart', 'useTheseTimesStop']
+                if k in quality_metrics and unit_idx < len(quality_metrics[k])
+            }
+            spike_trains.append(get_good_time_chunk_spike_times(
+                ephys_data['spike_times'][get_unit_spike_idx(spike_index, unit_id)], unit_metrics, param
+            ))
+        acg_store = compute_gui_acg_store(spike_trains, param, acg_cbin, acg_cwin)
+        gui_data['acg_data'] = {
+            unit_id: {
+                'acg': get_store_acg(acg_store, unit_idx, acg_cbin, acg_cwin, normalize='hertz'),
+                'cbin': acg_cbin,
+                'cwin': acg_cwin,
+            }
+            for unit_idx, unit_id in enumerate(unique_units)
+        }
     
     # Save pre-computed data in "for_GUI" subfolder
     # Determine save path
@@ -305,18 +335,17 @@ def precompute_gui_data(ephys_data, quality_metrics, param, save_path=None):
             # If save_path is a directory, create for_GUI subfolder
             gui_folder = os.path.join(save_path, "for_GUI")
             os.makedirs(gui_folder, exist_ok=True)
-            final_save_path = os.path.join(gui_folder, "gui_data.pkl")
+            final_save_path = os.path.join(gui_folder, "gui_data")
         else:
-            # If save_path is a file path, put it in for_GUI subfolder
+            # If save_path is a file path, put the store named after it in for_GUI subfolder
             parent_dir = os.path.dirname(save_path)
             gui_folder = os.path.join(parent_dir, "for_GUI")
             os.makedirs(gui_folder, exist_ok=True)
-            filename = os.path.basename(save_path)
+            filename = os.path.splitext(os.path.basename(save_path))[0]
             final_save_path = os.path.join(gui_folder, filename)
         
         try:
-            with open(final_save_path, 'wb') as f:
-                pickle.dump(gui_data, f)
+            save_gui_data_store(gui_data, final_save_path)
             if param.get("verbose", False):
                 print(f"Pre-computed GUI data saved to: {final_save_path}")
         except Exception as e:
@@ -338,15 +367,29 @@ def load_gui_data(load_path):
     -----------
     load_path : str
         Path to load GUI data from. Can be:
-        - Direct path to .pkl file
-        - Directory containing for_GUI/gui_data.pkl
+        - A GUI data store directory (see save_utils.save_gui_data_store)
+        - Direct path to .pkl file, saved by older versions
+        - Directory containing for_GUI/gui_data or for_GUI/gui_data.pkl
         - Directory where for_GUI/ subfolder will be checked
     
     Returns:
     --------
-    gui_data : dict or None
-        Pre-computed GUI data, or None if not found
+    gui_data : GUIDataStore, dict or None
+        Pre-computed GUI data, lazily loaded per unit from a store or a dict from a .pkl file,
+        or None if not found
     """
+    load_path = str(load_path)
+
+    # Per-unit stores open without reading every unit
+    for store_path in [load_path, os.path.join(load_path, "for_GUI", "gui_data"), os.path.join(load_path, "gui_data")]:
+        if os.path.exists(os.path.join(store_path, "units.tsv")):
+            try:
+                gui_data = load_gui_data_store(store_path)
+                print(f"Loaded GUI data from: {store_path}")
+                return gui_data
+            except Exception as e:
+                print(f"Failed to load GUI data from {store_path}: {e}")
+
     # Try different path options
     possible_paths = []
     
@@ -383,7 +426,8 @@ class InteractiveUnitQualityGUI:
     """
     
     def __init__(self, ephys_data, quality_metrics, ephys_properties=None, 
-                 raw_waveforms=None, param=None, unit_types=None, gui_data=None, save_path=None, layout='auto', auto_advance=True):
+                 raw_waveforms=None, param=None, unit_types=None, gui_data=None, save_path=None, layout='auto', auto_advance=True,
+                 n_prefetch_units=5, unit_cache_mb=512, render_mode='persistent', spike_index=None, headless=False):
         """
         Initialize the interactive GUI
         
@@ -398,6 +442,23 @@ class InteractiveUnitQualityGUI:
         auto_advance : bool, optional
             Whether to automatically advance to next unit after manual classification
             Default: True
+        n_prefetch_units : int, optional
+            Number of units prepared by a background thread ahead of the current unit, in the
+            current navigation direction, 0 to disable prefetching
+            Default: 5
+        unit_cache_mb : float, optional
+            Memory bound of the per-unit data cache, least recently viewed units are dropped first
+            Default: 512
+        render_mode : str, optional
+            'persistent' builds the figure and the histograms of all units once and only replaces the
+            unit panels when changing unit (blitting them with the ipympl backend), 'rebuild' creates
+            a new figure for each unit
+            Default: 'persistent'
+        spike_index : dict, optional
+            The per-unit spike index from loading_utils.get_spike_index, computed if not given
+        headless : bool, optional
+            Only prepare the units' data and plots, without widgets (see export_unit_panels)
+            Default: False
         """
         self.ephys_data = ephys_data
         self.quality_metrics = quality_metrics
@@ -407,6 +468,7 @@ class InteractiveUnitQualityGUI:
         self.unit_types = unit_types
         self.save_path = save_path
         self.auto_advance = auto_advance
+        self.headless = headless
         
         # Determine layout mode
         self.layout_mode = self._determine_layout(layout)
@@ -417,10 +479,13 @@ class InteractiveUnitQualityGUI:
             import os
             ks_path = param['ephysKilosortPath']
             possible_paths = [
+                os.path.join(ks_path, 'bombcell', 'for_GUI', 'gui_data'),
+                os.path.join(ks_path, 'for_GUI', 'gui_data'),
+                os.path.join(save_path, 'for_GUI', 'gui_data') if save_path else '',
                 os.path.join(ks_path, 'bombcell', 'for_GUI', 'gui_data.pkl'),
                 os.path.join(ks_path, 'for_GUI', 'gui_data.pkl'),
                 os.path.join(ks_path, 'gui_data.pkl'),
-                os.path.join(save_path, 'for_GUI', 'gui_data.pkl'),
+                os.path.join(save_path, 'for_GUI', 'gui_data.pkl') if save_path else '',
             ]
             for path in possible_paths:
                 if os.path.exists(path):
@@ -465,18 +530,46 @@ class InteractiveUnitQualityGUI:
         else:
             print("No pre-computed GUI data found - will compute everything real-time")
         
-        # Get unique units
-        self.unique_units = np.unique(ephys_data['spike_clusters'])
+        # Get unique units, and index each unit's spikes once
+        self.spike_index = spike_index if spike_index is not None else get_spike_index(ephys_data['spike_clusters'])
+        self.unique_units = self.spike_index['unit_ids']
         self.n_units = len(self.unique_units)
         print(f"Total units: {self.n_units}")
         self.current_unit_idx = 0
+
+        # Per-unit data cache, filled by get_unit_data and by the prefetching thread
+        self.n_prefetch_units = n_prefetch_units
+        self.unit_cache_bytes = unit_cache_mb * 1024**2
+        self._unit_cache = OrderedDict()
+        self._unit_cache_nbytes = {}
+        self._unit_cache_lock = threading.Lock()
+        self._metrics_row_by_unit = None
+        self._acg_stores = {}
+        self._acg_store_lock = threading.Lock()
+        self._nav_category = None
+        self._previous_unit_idx = 0
+        self._prefetch_targets = []
+        self._prefetch_generation = 0
+        self._prefetch_event = threading.Event()
+        self._prefetch_thread = None
+
+        # Figure kept across units in the persistent render mode
+        if render_mode not in ('persistent', 'rebuild'):
+            raise ValueError(f"render_mode must be 'persistent' or 'rebuild', not {render_mode!r}")
+        self.render_mode = render_mode
+        self._persistent_figure = None
+        self._persistent_panel_axes = []
+        self._persistent_unit_axes = []
+        self._histogram_markers = []
+        self._blit_background = None
         
         # Initialize manual classifications (separate from bombcell unit_types)
         self._initialize_manual_classifications()
         
         # Setup widgets and display
-        self.setup_widgets()
-        self.display_gui()
+        if not headless:
+            self.setup_widgets()
+            self.display_gui()
         
     def _initialize_manual_classifications(self):
         """Initialize manual classification system - separate from bombcell classifications"""
@@ -829,18 +922,21 @@ class InteractiveUnitQualityGUI:
         
     def prev_unit(self, b=None):
         """Go to previous unit"""
+        self._nav_category = None
         if self.current_unit_idx > 0:
             self.current_unit_idx -= 1
             self.unit_slider.value = self.current_unit_idx
             
     def next_unit(self, b=None):
         """Go to next unit"""
+        self._nav_category = None
         if self.current_unit_idx < self.n_units - 1:
             self.current_unit_idx += 1
             self.unit_slider.value = self.current_unit_idx
             
     def goto_unit_number(self, b=None):
         """Go to specific unit number"""
+        self._nav_category = None
         unit_num = self.unit_input.value
         if 0 <= unit_num < self.n_units:
             self.current_unit_idx = unit_num
@@ -849,6 +945,7 @@ class InteractiveUnitQualityGUI:
             
     def goto_next_good(self, b=None):
         """Go to next BombCell-classified good unit"""
+        self._nav_category = (1,)
         if self.bombcell_unit_types is not None:
             for i in range(self.current_unit_idx + 1, self.n_units):
                 if self.bombcell_unit_types[i] == 1:  # Good unit
@@ -858,6 +955,7 @@ class InteractiveUnitQualityGUI:
                     
     def goto_prev_good(self, b=None):
         """Go to previous BombCell-classified good unit"""
+        self._nav_category = (1,)
         if self.bombcell_unit_types is not None:
             for i in range(self.current_unit_idx - 1, -1, -1):
                 if self.bombcell_unit_types[i] == 1:  # Good unit
@@ -867,6 +965,7 @@ class InteractiveUnitQualityGUI:
                     
     def goto_next_mua(self, b=None):
         """Go to next BombCell-classified MUA unit"""
+        self._nav_category = (2,)
         if self.bombcell_unit_types is not None:
             for i in range(self.current_unit_idx + 1, self.n_units):
                 if self.bombcell_unit_types[i] == 2:  # MUA unit
@@ -876,6 +975,7 @@ class InteractiveUnitQualityGUI:
                     
     def goto_prev_mua(self, b=None):
         """Go to previous BombCell-classified MUA unit"""
+        self._nav_category = (2,)
         if self.bombcell_unit_types is not None:
             for i in range(self.current_unit_idx - 1, -1, -1):
                 if self.bombcell_unit_types[i] == 2:  # MUA unit
@@ -885,6 +985,7 @@ class InteractiveUnitQualityGUI:
                     
     def goto_next_noise(self, b=None):
         """Go to next BombCell-classified noise unit"""
+        self._nav_category = (0,)
         if self.bombcell_unit_types is not None:
             for i in range(self.current_unit_idx + 1, self.n_units):
                 if self.bombcell_unit_types[i] == 0:  # Noise unit
@@ -894,6 +995,7 @@ class InteractiveUnitQualityGUI:
                     
     def goto_prev_noise(self, b=None):
         """Go to previous BombCell-classified noise unit"""
+        self._nav_category = (0,)
         if self.bombcell_unit_types is not None:
             for i in range(self.current_unit_idx - 1, -1, -1):
                 if self.bombcell_unit_types[i] == 0:  # Noise unit
@@ -903,6 +1005,7 @@ class InteractiveUnitQualityGUI:
                     
     def goto_next_nonsomatic(self, b=None):
         """Go to next BombCell-classified non-somatic unit"""
+        self._nav_category = (3, 4)
         if self.bombcell_unit_types is not None:
             for i in range(self.current_unit_idx + 1, self.n_units):
                 if self.bombcell_unit_types[i] in [3, 4]:  # Non-somatic good or non-somatic MUA
@@ -912,6 +1015,7 @@ class InteractiveUnitQualityGUI:
                     
     def goto_prev_nonsomatic(self, b=None):
         """Go to previous BombCell-classified non-somatic unit"""
+        self._nav_category = (3, 4)
         if self.bombcell_unit_types is not None:
             for i in range(self.current_unit_idx - 1, -1, -1):
                 if self.bombcell_unit_types[i] in [3, 4]:  # Non-somatic good or non-somatic MUA
@@ -1105,15 +1209,38 @@ class InteractiveUnitQualityGUI:
         return None
             
     def get_unit_data(self, unit_idx):
-        """Get data for a specific unit"""
+        """Get data for a specific unit, from the per-unit cache if it was already prepared"""
         if unit_idx >= self.n_units:
             return None
-            
+
+        with self._unit_cache_lock:
+            if unit_idx in self._unit_cache:
+                self._unit_cache.move_to_end(unit_idx)
+                return self._unit_cache[unit_idx]
+
+        unit_data = self._load_unit_data(unit_idx)
+
+        # keep the cache under its memory bound, dropping the least recently viewed units
+        unit_nbytes = sum(v.nbytes for v in unit_data.values() if isinstance(v, np.ndarray))
+        with self._unit_cache_lock:
+            self._unit_cache[unit_idx] = unit_data
+            self._unit_cache_nbytes[unit_idx] = unit_nbytes
+            while len(self._unit_cache) > 1 and sum(self._unit_cache_nbytes.values()) > self.unit_cache_bytes:
+                dropped_idx, _ = self._unit_cache.popitem(last=False)
+                del self._unit_cache_nbytes[dropped_idx]
+        return unit_data
+
+    def _load_unit_data(self, unit_idx):
+        """Gathers the spikes, template and quality metrics of a unit"""
         unit_id = self.unique_units[unit_idx]
         
-        # Get spike times for this unit
-        spike_mask = self.ephys_data['spike_clusters'] == unit_id
-        spike_times = self.ephys_data['spike_times'][spike_mask]
+        # Get spike times and amplitudes for this unit
+        spike_idx = get_unit_spike_idx(self.spike_index, unit_id)
+        spike_times = self.ephys_data['spike_times'][spike_idx]
+        amplitudes = (
+            self.ephys_data['template_amplitudes'][spike_idx]
+            if 'template_amplitudes' in self.ephys_data else None
+        )
         
         # Get template waveform
         if unit_idx < len(self.ephys_data['template_waveforms']):
@@ -1122,18 +1249,32 @@ class InteractiveUnitQualityGUI:
             template = np.zeros((82, 1))
             
         # Get quality metrics for this unit
+        unit_metrics = self._get_unit_metrics(unit_idx)
+
+        return {
+            'unit_id': unit_id,
+            'spike_times': spike_times,
+            'amplitudes': amplitudes,
+            'template': template,
+            'metrics': unit_metrics
+        }
+
+    def _get_unit_metrics(self, unit_idx):
+        """Gets the quality metrics of a unit, whatever the format of quality_metrics"""
+        unit_id = self.unique_units[unit_idx]
         unit_metrics = {}
         
         # Handle different quality_metrics formats
         if isinstance(self.quality_metrics, list):
             # List of dicts format: [{'phy_clusterID': 0, 'metric1': val, ...}, ...]
-            unit_found = False
-            for unit_dict in self.quality_metrics:
-                if unit_dict.get('phy_clusterID') == unit_id:
-                    unit_metrics = unit_dict.copy()
-                    unit_found = True
-                    break
-            if not unit_found:
+            if self._metrics_row_by_unit is None:
+                self._metrics_row_by_unit = {}
+                for row, unit_dict in enumerate(self.quality_metrics):
+                    self._metrics_row_by_unit.setdefault(unit_dict.get('phy_clusterID'), row)
+            row = self._metrics_row_by_unit.get(unit_id)
+            if row is not None:
+                unit_metrics = self.quality_metrics[row].copy()
+            else:
                 unit_metrics = {'phy_clusterID': unit_id}
                 
         elif isinstance(self.quality_metrics, dict):
@@ -1155,13 +1296,68 @@ class InteractiveUnitQualityGUI:
                 unit_metrics = {}
         else:
             unit_metrics = {}
-                
-        return {
-            'unit_id': unit_id,
-            'spike_times': spike_times,
-            'template': template,
-            'metrics': unit_metrics
-        }
+
+        return unit_metrics
+
+    def _get_prefetch_units(self, unit_idx, direction):
+        """
+        The units to prepare after showing unit_idx: the next units in the navigation direction
+        (within the category being stepped through, if any), then the next and previous unit of
+        every category so the category jumps are prepared too
+        """
+        n_prefetch = self.n_prefetch_units
+        if self.bombcell_unit_types is not None and self._nav_category is not None:
+            candidates = np.flatnonzero(np.isin(self.bombcell_unit_types, self._nav_category))
+        else:
+            candidates = np.arange(self.n_units)
+        if direction >= 0:
+            prefetch_units = list(candidates[candidates > unit_idx][:n_prefetch])
+        else:
+            prefetch_units = list(candidates[candidates < unit_idx][::-1][:n_prefetch])
+
+        if self.bombcell_unit_types is not None:
+            for category in [(1,), (2,), (0,), (3, 4)]:
+                category_units = np.flatnonzero(np.isin(self.bombcell_unit_types, category))
+                next_pos = np.searchsorted(category_units, unit_idx, side='right')
+                if next_pos < category_units.size:
+                    prefetch_units.append(category_units[next_pos])
+                prev_pos = np.searchsorted(category_units, unit_idx, side='left') - 1
+                if prev_pos >= 0:
+                    prefetch_units.append(category_units[prev_pos])
+        return [int(i) for i in dict.fromkeys(prefetch_units) if i != unit_idx]
+
+    def _prefetch_units(self, unit_idxs):
+        """Asks the prefetching thread to prepare these units, replacing its previous request"""
+        if self.n_prefetch_units <= 0:
+            return
+        with self._unit_cache_lock:
+            self._prefetch_targets = list(unit_idxs)
+            self._prefetch_generation += 1
+        self._prefetch_event.set()
+        if self._prefetch_thread is None or not self._prefetch_thread.is_alive():
+            self._prefetch_thread = threading.Thread(target=self._prefetch_worker, daemon=True)
+            self._prefetch_thread.start()
+
+    def _prefetch_worker(self):
+        """Background thread preparing the data, GUI data and ACG of the requested units"""
+        while True:
+            self._prefetch_event.wait()
+            self._prefetch_event.clear()
+            with self._unit_cache_lock:
+                unit_idxs = self._prefetch_targets
+                generation = self._prefetch_generation
+            for unit_idx in unit_idxs:
+                # stop as soon as the user moved on, the new request comes first
+                if generation != self._prefetch_generation:
+                    break
+                try:
+                    unit_data = self.get_unit_data(unit_idx)
+                    if self.gui_data is not None and hasattr(self.gui_data, 'get_unit'):
+                        self.gui_data.get_unit(unit_data['unit_id'])
+                    if self.param and 'ephys_sample_rate' in self.param:
+                        self.get_unit_acg(unit_data)
+                except Exception:
+                    continue
         
     def update_unit_info(self):
         """Update unit info display"""
@@ -1207,11 +1403,29 @@ class InteractiveUnitQualityGUI:
         
         self.unit_info.value = info_html
         
+    # Panels of the landscape layout, on a 100 x 30 grid: (plot method, (row, column), rowspan, colspan)
+    LANDSCAPE_PANELS = [
+        ('plot_unit_location', (0, 0), 100, 1),  # 1. Unit location plot (left column)
+        ('plot_template_waveform', (0, 2), 20, 6),  # 2. Template waveforms
+        ('plot_raw_waveforms', (0, 9), 20, 6),  # 3. Raw waveforms
+        ('plot_spatial_decay', (30, 2), 20, 6),  # 4. Spatial decay
+        ('plot_autocorrelogram', (30, 9), 20, 6),  # 5. ACG
+        ('plot_amplitudes_over_time', (60, 2), 20, 10),  # 6. Amplitudes over time
+        ('plot_time_bin_metrics', (85, 2), 10, 10),  # 6b. Time bin metrics, shares x with 6.
+        ('plot_amplitude_fit', (60, 13), 20, 2),  # 7. Amplitude fit
+    ]
+
     def plot_unit(self, unit_idx):
         """Plot data for a specific unit with adaptive layout"""
         unit_data = self.get_unit_data(unit_idx)
         if unit_data is None:
             return
+
+        if self.render_mode == 'persistent':
+            new_figure = self._persistent_figure is None
+            self._plot_unit_persistent(unit_data)
+            self._show_persistent_figure(new_figure)
+            return
             
         with self.plot_output:
             clear_output(wait=True)
@@ -1219,62 +1433,63 @@ class InteractiveUnitQualityGUI:
             
             # Always use landscape layout
             self._plot_unit_landscape(unit_data)
+            plt.show()
     
     def _plot_unit_landscape(self, unit_data):
-        """Plot unit data in landscape mode (side-by-side layout)"""
-        # CENTRALIZED FONT SIZE CONFIGURATION FOR LANDSCAPE MODE
-        AXIS_LABEL_FONTSIZE = 20
-        TICK_LABEL_FONTSIZE = 14
-        LEGEND_FONTSIZE = 16
-        TEXT_FONTSIZE = 16
-        PLOT_TITLE_FONTSIZE = 22
-        QUALITY_METRIC_TEXT_FONTSIZE = 15
-        
+        """Plot unit data in landscape mode (side-by-side layout), in a new figure"""
         # Create figure with extended width and height for histograms
         fig = plt.figure(figsize=(30, 25))  # Taller figure
         fig.patch.set_facecolor('white')
         
         # LEFT HALF - Original GUI (columns 0-14) - MUCH LARGER GRID
-        # 1. Unit location plot (left column)
-        ax_location = plt.subplot2grid((100, 30), (0, 0), rowspan=100, colspan=1)
-        self.plot_unit_location(ax_location, unit_data)
-        
-        # 2. Template waveforms - scale to 100-row grid
-        ax_template = plt.subplot2grid((100, 30), (0, 2), rowspan=20, colspan=6)
-        self.plot_template_waveform(ax_template, unit_data)
-        
-        # 3. Raw waveforms - scale to 100-row grid
-        ax_raw = plt.subplot2grid((100, 30), (0, 9), rowspan=20, colspan=6)
-        self.plot_raw_waveforms(ax_raw, unit_data)
-        
-        # 4. Spatial decay - scale to 100-row grid
-        ax_spatial = plt.subplot2grid((100, 30), (30, 2), rowspan=20, colspan=6)
-        self.plot_spatial_decay(ax_spatial, unit_data)
-        
-        # 5. ACG - scale to 100-row grid
-        ax_acg = plt.subplot2grid((100, 30), (30, 9), rowspan=20, colspan=6)
-        self.plot_autocorrelogram(ax_acg, unit_data)
-        
-        # 6. Amplitudes over time - scale to 100-row grid
-        ax_amplitude = plt.subplot2grid((100, 30), (60, 2), rowspan=20, colspan=10)
-        self.plot_amplitudes_over_time(ax_amplitude, unit_data)
-        
-        # 6b. Time bin metrics - scale to 100-row grid
-        ax_bin_metrics = plt.subplot2grid((100, 30), (85, 2), rowspan=10, colspan=10, sharex=ax_amplitude)
-        self.plot_time_bin_metrics(ax_bin_metrics, unit_data)
-        
-        # 7. Amplitude fit - scale to 100-row grid
-        ax_amp_fit = plt.subplot2grid((100, 30), (60, 13), rowspan=20, colspan=2)
-        self.plot_amplitude_fit(ax_amp_fit, unit_data)
+        unit_axes = self._plot_landscape_panels(self._create_landscape_axes(fig), unit_data)
         
         # RIGHT HALF - Histogram panel (columns 16-29)
+        n_unit_axes = len(fig.axes)
         self.plot_histograms_panel(fig, unit_data)
         
         # Adjust subplot margins to eliminate gap with title/buttons - seamless layout
-        plt.subplots_adjust(left=0.03, right=0.98, top=0.99, bottom=0.08, hspace=0.4, wspace=0.4)
+        fig.subplots_adjust(left=0.03, right=0.98, top=0.99, bottom=0.08, hspace=0.4, wspace=0.4)
         
+        self._format_landscape_axes(unit_axes + fig.axes[n_unit_axes:])
+        return fig
+
+    def _create_landscape_axes(self, fig):
+        """Creates the (empty) axes of the unit panels of the landscape layout"""
+        panel_axes = []
+        for plot_name, loc, rowspan, colspan in self.LANDSCAPE_PANELS:
+            sharex = panel_axes[-1] if plot_name == 'plot_time_bin_metrics' else None
+            panel_axes.append(plt.subplot2grid((100, 30), loc, rowspan=rowspan, colspan=colspan, sharex=sharex, fig=fig))
+        return panel_axes
+
+    def _plot_landscape_panels(self, panel_axes, unit_data):
+        """
+        Plots the unit panels of the landscape layout
+
+        Returns
+        -------
+        unit_axes : list
+            The panel axes, each followed by the (twin) axes its plot added
+        """
+        fig = panel_axes[0].figure
+        unit_axes = []
+        for ax, (plot_name, _, _, _) in zip(panel_axes, self.LANDSCAPE_PANELS):
+            n_axes = len(fig.axes)
+            getattr(self, plot_name)(ax, unit_data)
+            unit_axes.append(ax)
+            unit_axes.extend(fig.axes[n_axes:])
+        return unit_axes
+
+    def _format_landscape_axes(self, axes):
+        """Forces consistent fonts and min/max ticks on the landscape axes, in their creation order"""
+        # CENTRALIZED FONT SIZE CONFIGURATION FOR LANDSCAPE MODE
+        AXIS_LABEL_FONTSIZE = 20
+        TICK_LABEL_FONTSIZE = 14
+        LEGEND_FONTSIZE = 16
+        PLOT_TITLE_FONTSIZE = 22
+
         # FORCE CONSISTENT FONTS ACROSS ALL PLOTS - OVERRIDE EVERYTHING (LANDSCAPE)
-        for i, ax in enumerate(fig.get_axes()):
+        for i, ax in enumerate(axes):
             # Skip axes that might be unit title or toggle buttons
             if hasattr(ax, 'get_position') and ax.get_position().height < 0.05:
                 continue  # Skip very small axes (likely buttons)
@@ -1337,8 +1552,117 @@ class InteractiveUnitQualityGUI:
             if legend:
                 for text in legend.get_texts():
                     text.set_fontsize(LEGEND_FONTSIZE)
-        
-        plt.show()
+
+    def _plot_unit_persistent(self, unit_data):
+        """
+        Plots a unit in the persistent figure: the figure, its axes and the histograms of all units
+        are built for the first unit, later units only replace the unit panels and move the
+        current unit markers on the histograms
+        """
+        if self._persistent_figure is None:
+            if self._use_blitting():
+                # interactive canvas, kept in the output and updated by blitting
+                with plt.ioff():
+                    fig = plt.figure(figsize=(30, 25))
+                fig.canvas.mpl_connect('draw_event', self._on_persistent_draw)
+            else:
+                # not managed by pyplot, so it is not closed or shown when the notebook cell ends
+                fig = Figure(figsize=(30, 25))
+                FigureCanvasAgg(fig)
+            fig.patch.set_facecolor('white')
+            self._persistent_figure = fig
+            self._persistent_panel_axes = self._create_landscape_axes(fig)
+            self._persistent_unit_axes = self._plot_landscape_panels(self._persistent_panel_axes, unit_data)
+            n_unit_axes = len(fig.axes)
+            self.plot_histograms_panel(fig, unit_data)
+            fig.subplots_adjust(left=0.03, right=0.98, top=0.99, bottom=0.08, hspace=0.4, wspace=0.4)
+            self._format_landscape_axes(self._persistent_unit_axes + fig.axes[n_unit_axes:])
+        else:
+            # twin axes added by the previous unit's plots
+            for ax in self._persistent_unit_axes:
+                if ax not in self._persistent_panel_axes:
+                    ax.remove()
+            for ax in self._persistent_panel_axes:
+                ax.cla()
+            self._persistent_unit_axes = self._plot_landscape_panels(self._persistent_panel_axes, unit_data)
+            self._format_landscape_axes(self._persistent_unit_axes)
+            for marker, metric_name, bins_out, bin_heights in self._histogram_markers:
+                marker.set_offsets(self._get_histogram_marker_offsets(metric_name, bins_out, bin_heights))
+
+        if self._use_blitting():
+            # drawn on top of the static background, see _draw_persistent_figure
+            for artist in self._persistent_unit_axes + [marker[0] for marker in self._histogram_markers]:
+                artist.set_animated(True)
+
+    def _use_blitting(self):
+        """Whether the persistent figure is updated by blitting, which needs an interactive (ipympl) canvas"""
+        backend = plt.get_backend().lower()
+        return not self.headless and self.render_mode == 'persistent' and ('ipympl' in backend or backend == 'widget')
+
+    def _on_persistent_draw(self, event):
+        """After a full draw of the persistent figure, keep its static background and draw the unit's artists"""
+        fig = self._persistent_figure
+        if fig is None:
+            return
+        self._blit_background = fig.canvas.copy_from_bbox(fig.bbox)
+        self._draw_unit_artists()
+
+    def _draw_unit_artists(self):
+        """Draws the unit panels and the current unit markers, which are left out of the background"""
+        fig = self._persistent_figure
+        for ax in self._persistent_unit_axes:
+            fig.draw_artist(ax)
+        for marker, _, _, _ in self._histogram_markers:
+            fig.draw_artist(marker)
+
+    def _draw_persistent_figure(self):
+        """Renders the persistent figure, blitting the unit's artists on the static background when possible"""
+        canvas = self._persistent_figure.canvas
+        if self._use_blitting() and self._blit_background is not None:
+            canvas.restore_region(self._blit_background)
+            self._draw_unit_artists()
+            canvas.blit(self._persistent_figure.bbox)
+            canvas.flush_events()
+        else:
+            # the draw_event callback saves the background when blitting
+            canvas.draw()
+
+    def _show_persistent_figure(self, new_figure):
+        """Displays the persistent figure in the plot output"""
+        if self._use_blitting():
+            if new_figure:
+                with self.plot_output:
+                    clear_output(wait=True)
+                    display(self._persistent_figure.canvas)
+            self._draw_persistent_figure()
+        else:
+            # static backends (e.g. inline) render a new image of the figure
+            with self.plot_output:
+                clear_output(wait=True)
+                display(self._persistent_figure)
+
+    def _close_persistent_figure(self):
+        """Closes the persistent figure, the next unit shown builds a new one"""
+        if self._persistent_figure is not None:
+            plt.close(self._persistent_figure)
+        self._persistent_figure = None
+        self._persistent_panel_axes = []
+        self._persistent_unit_axes = []
+        self._histogram_markers = []
+        self._blit_background = None
+
+    def _get_histogram_marker_offsets(self, metric_name, bins_out, bin_heights):
+        """The position of the current unit's marker above a metric's histogram, empty if its value is NaN"""
+        current_unit_idx = self.current_unit_idx
+        if current_unit_idx < len(self.quality_metrics[metric_name]):
+            current_value = self.quality_metrics[metric_name][current_unit_idx]
+            if not np.isnan(current_value):
+                # Add triangle above histogram (revert to original position)
+                bin_idx = np.digitize(current_value, bins_out) - 1
+                bin_height = bin_heights[bin_idx] if 0 <= bin_idx < len(bin_heights) else 0.5
+                triangle_y = bin_height + 0.15  # Above the histogram bars
+                return np.array([[current_value, triangle_y]])
+        return np.empty((0, 2))
     
     def plot_amplitude_histogram(self, ax, unit_data, metric_name):
         """Plot amplitude histogram with current unit highlighted"""
@@ -1611,43 +1935,72 @@ class InteractiveUnitQualityGUI:
         # Add quality metrics text
         self.add_metrics_text(ax, unit_data, 'raw')
         
+    def get_unit_acg(self, unit_data, cbin=0.5, cwin=100):
+        """
+        Autocorrelogram of a unit's spikes in good time chunks, kept in unit_data so it is only
+        looked up once per unit (e.g. by the prefetching thread). It is read from the precomputed
+        GUI data if available, otherwise from the auto-correlograms of all units computed at once
+        the first time one is needed (see _get_acg_store)
+
+        Returns
+        -------
+        bins : ndarray
+            The bin edges in ms
+        autocorr : ndarray
+            The autocorrelogram in Hz
+        filtered_spike_times : ndarray
+            The spike times in good time chunks
+        """
+        from bombcell.helper_functions import get_good_time_chunk_spike_times
+
+        acg_key = ('acg', cbin, cwin)
+        if acg_key in unit_data:
+            return unit_data[acg_key]
+
+        unit_id = unit_data['unit_id']
+        filtered_spike_times = get_good_time_chunk_spike_times(unit_data['spike_times'], unit_data['metrics'], self.param)
+        bins = np.arange(-cwin / 2, cwin / 2 + cbin, cbin)
+
+        acg_data = None
+        if self.gui_data is not None and 'acg_data' in self.gui_data:
+            acg_data = self.gui_data['acg_data'].get(unit_id)
+        if acg_data is not None and acg_data['cbin'] == cbin and acg_data['cwin'] == cwin:
+            autocorr = np.asarray(acg_data['acg'])
+        else:
+            acg_store = self._get_acg_store(cbin, cwin)
+            unit_row = np.searchsorted(self.unique_units, unit_id)
+            autocorr = get_store_acg(acg_store, unit_row, cbin, cwin, normalize='hertz')
+
+        unit_data[acg_key] = (bins, autocorr, filtered_spike_times)
+        return unit_data[acg_key]
+
+    def _get_acg_store(self, cbin, cwin):
+        """
+        Auto-correlograms of the spikes in good time chunks of all units, computed in one
+        compiled pass the first time they are needed (see helper_functions.compute_gui_acg_store)
+        """
+        from bombcell.helper_functions import get_good_time_chunk_spike_times, compute_gui_acg_store
+
+        # the prefetching thread may ask for the same store
+        with self._acg_store_lock:
+            if (cbin, cwin) not in self._acg_stores:
+                spike_trains = [
+                    get_good_time_chunk_spike_times(
+                        self.ephys_data['spike_times'][get_unit_spike_idx(self.spike_index, unit_id)],
+                        self._get_unit_metrics(unit_idx),
+                        self.param,
+                    )
+                    for unit_idx, unit_id in enumerate(self.unique_units)
+                ]
+                self._acg_stores[(cbin, cwin)] = compute_gui_acg_store(spike_trains, self.param, cbin, cwin)
+            return self._acg_stores[(cbin, cwin)]
+
     def plot_autocorrelogram(self, ax, unit_data, cbin=0.5, cwin=100):
         """Plot autocorrelogram with tauR and firing rate lines"""
 
         spike_times = unit_data['spike_times']
         metrics = unit_data['metrics']
-        filtered_spike_times = spike_times.copy()
-        
-        # Filter spike times
-        if self.param and self.param.get('computeTimeChunks', False):
-
-            good_start_times = metrics.get('useTheseTimesStart', None)
-            good_stop_times = metrics.get('useTheseTimesStop', None)
-            
-            if good_start_times is not None and good_stop_times is not None:
-                # Ensure they are arrays
-                if np.isscalar(good_start_times):
-                    good_start_times = [good_start_times]
-                if np.isscalar(good_stop_times):
-                    good_stop_times = [good_stop_times]
-                
-                # Create mask for spikes in good time chunks
-                good_spike_mask = np.zeros(len(spike_times), dtype=bool)
-                for g_start, g_stop in zip(good_start_times, good_stop_times):
-                    if not (np.isnan(g_start) or np.isnan(g_stop)):
-                        good_spike_mask |= (spike_times >= g_start) & (spike_times <= g_stop)
-                
-                # Filter spike times to only good time chunks
-                filtered_spike_times = spike_times[good_spike_mask]
-        
-        # Compute autocorrelogram
-        bins = np.arange(-cwin / 2, cwin / 2 + cbin, cbin)
-        bin_centers = bins[:-1] + cbin/2
-        filtered_spike_times_samples = np.round(filtered_spike_times * self.param['ephys_sample_rate']).astype(np.uint64)
-        autocorr = acg(filtered_spike_times_samples,
-                       cbin,
-                       cwin,
-                       normalize='hertz') # built-in caching
+        bins, autocorr, filtered_spike_times = self.get_unit_acg(unit_data, cbin, cwin)
             
         if len(filtered_spike_times) <= 1:
             return
@@ -1878,7 +2231,6 @@ class InteractiveUnitQualityGUI:
         if len(spike_times) > 0:
             # Get amplitudes if available
             unit_id = unit_data['unit_id']
-            spike_mask = self.ephys_data['spike_clusters'] == unit_id
             
             # Calculate time bins for presence ratio and firing rate
             total_duration = np.max(spike_times) - np.min(spike_times)
@@ -1887,13 +2239,28 @@ class InteractiveUnitQualityGUI:
             bin_centers = (time_bins[:-1] + time_bins[1:]) / 2
             bin_width = time_bins[1] - time_bins[0]
             
-            # Calculate firing rate per bin
-            bin_counts, _ = np.histogram(spike_times, bins=time_bins)
+            # Calculate firing rate per bin, using the precomputed session spike counts if available
+            per_bin_data = None
+            if hasattr(self, 'gui_data') and self.gui_data is not None:
+                per_bin_data = self.gui_data.get('per_bin_metrics', {}).get(unit_id)
+            if per_bin_data and 'spike_counts' in per_bin_data:
+                count_bins = per_bin_data['spike_counts']['time_bins']
+                bin_counts = per_bin_data['spike_counts']['spike_counts_per_bin']
+                # only the bins spanning this unit's spikes
+                first_bin = max(np.searchsorted(count_bins, np.min(spike_times), side='right') - 1, 0)
+                last_bin = np.searchsorted(count_bins, np.max(spike_times), side='right')
+                time_bins = count_bins[first_bin:last_bin + 1]
+                bin_counts = bin_counts[first_bin:last_bin]
+                time_bins = time_bins[:bin_counts.shape[0] + 1]
+                bin_centers = (time_bins[:-1] + time_bins[1:]) / 2
+                bin_width = time_bins[1] - time_bins[0] if len(time_bins) > 1 else 1
+            else:
+                bin_counts, _ = np.histogram(spike_times, bins=time_bins)
             firing_rates = bin_counts / bin_width
-            
-            
-            if 'template_amplitudes' in self.ephys_data:
-                amplitudes = self.ephys_data['template_amplitudes'][spike_mask]
+
+
+            if unit_data.get('amplitudes') is not None:
+                amplitudes = unit_data['amplitudes']
                 
                 # Color spikes based on goodTimeChunks if computeTimeChunks is enabled
                 spike_colors = np.full(len(spike_times), 'darkorange')  # Default: bad chunks (orange)
@@ -2453,8 +2820,8 @@ class InteractiveUnitQualityGUI:
                         depth = positions[max_ch, 1]  # Keep original - deeper = lower y values
                         
                         # Calculate firing rate for this unit
-                        unit_spike_mask = self.ephys_data['spike_clusters'] == unit_id
-                        unit_spike_times = self.ephys_data['spike_times'][unit_spike_mask]
+                        unit_spike_idx = get_unit_spike_idx(self.spike_index, unit_id)
+                        unit_spike_times = self.ephys_data['spike_times'][unit_spike_idx]
                         
                         if len(unit_spike_times) > 0:
                             duration = np.max(unit_spike_times) - np.min(unit_spike_times)
@@ -2591,10 +2958,9 @@ class InteractiveUnitQualityGUI:
         if len(spike_times) > 0:
             # Get amplitudes if available
             unit_id = unit_data['unit_id']
-            spike_mask = self.ephys_data['spike_clusters'] == unit_id
             
-            if 'template_amplitudes' in self.ephys_data:
-                amplitudes = self.ephys_data['template_amplitudes'][spike_mask]
+            if unit_data.get('amplitudes') is not None:
+                amplitudes = unit_data['amplitudes']
                 
                 # Filter to good time chunks if computeTimeChunks is enabled
                 if self.param and self.param.get('computeTimeChunks', False):
@@ -3217,6 +3583,7 @@ class InteractiveUnitQualityGUI:
         # Preprocessing - handle inf values using shared utility
         from bombcell.helper_functions import clean_inf_values
         self.quality_metrics = clean_inf_values(self.quality_metrics)
+        self._histogram_markers = []
 
         # Define MATLAB-style color matrices - exact copy
         red_colors = np.array([
@@ -3381,7 +3748,7 @@ class InteractiveUnitQualityGUI:
                 # ALL plots same height - no extending last row
                 actual_height = plot_height
                 
-                ax = plt.subplot2grid((grid_rows, 30), (start_row, start_col), rowspan=actual_height, colspan=col_width)
+                ax = plt.subplot2grid((grid_rows, 30), (start_row, start_col), rowspan=actual_height, colspan=col_width, fig=fig)
             else:
                 continue
             
@@ -3408,21 +3775,13 @@ class InteractiveUnitQualityGUI:
                     for patch in patches:
                         patch.set_height(patch.get_height() * bin_width)
                 
-                # Add current unit highlighting with ARROW instead of line
-                current_unit_idx = self.current_unit_idx
-                if current_unit_idx < len(self.quality_metrics[metric_name]):
-                    current_value = self.quality_metrics[metric_name][current_unit_idx]
-                    if not np.isnan(current_value):
-                        # NO red bin highlighting - removed for cleaner look
-                        
-                        # Add triangle above histogram (revert to original position)
-                        bin_idx = np.digitize(current_value, bins_out) - 1
-                        bin_height = patches[bin_idx].get_height() if 0 <= bin_idx < len(patches) else 0.5
-                        triangle_y = bin_height + 0.15  # Above the histogram bars
-                        
-                        # Large black triangle pointing down with white contour for visibility
-                        ax.scatter(current_value, triangle_y, marker='v', s=500, color='black', 
-                                  alpha=1.0, zorder=15, edgecolors='white', linewidths=4)
+                # Add current unit highlighting with ARROW instead of line, kept to move it to other units
+                # Large black triangle pointing down with white contour for visibility
+                bin_heights = np.array([patch.get_height() for patch in patches])
+                marker = ax.scatter([], [], marker='v', s=500, color='black', 
+                                    alpha=1.0, zorder=15, edgecolors='white', linewidths=4)
+                marker.set_offsets(self._get_histogram_marker_offsets(metric_name, bins_out, bin_heights))
+                self._histogram_markers.append((marker, metric_name, bins_out, bin_heights))
                 
                 # Add threshold lines above histogram at 0.9 - MUCH MORE EXTENDED x-limits for text
                 x_lim = ax.get_xlim()
@@ -3588,6 +3947,11 @@ class InteractiveUnitQualityGUI:
         self.update_unit_info()
         self.plot_unit(self.current_unit_idx)
 
+        # prepare the next units in the direction the user is moving
+        direction = -1 if self.current_unit_idx < self._previous_unit_idx else 1
+        self._previous_unit_idx = self.current_unit_idx
+        self._prefetch_units(self._get_prefetch_units(self.current_unit_idx, direction))
+
 
 
 
@@ -3615,8 +3979,18 @@ def load_metrics_for_gui(ks_dir, quality_metrics, ephys_properties=None, param=N
     """
     from . import loading_utils as bc_load
     
-    # Load ephys data (returns tuple)
-    ephys_data_tuple = bc_load.load_ephys_data(ks_dir)
+    # Determine the save path for bombcell data
+    if save_path is None:
+        bombcell_path = Path(ks_dir) / "bombcell"
+    else:
+        bombcell_path = Path(save_path)
+
+    # Load ephys data (returns tuple), reusing the unwhitened templates cached next to the bombcell outputs
+    ephys_data_tuple = bc_load.load_ephys_data(
+        ks_dir,
+        mmap_mode="r" if param is not None and param.get('mmapEphysData', False) else None,
+        cache_dir=bombcell_path if bombcell_path.exists() else None,
+    )
     
     # Convert tuple to dictionary
     ephys_data = {
@@ -3629,12 +4003,6 @@ def load_metrics_for_gui(ks_dir, quality_metrics, ephys_properties=None, param=N
         'channel_positions': ephys_data_tuple[6]
     }
     
-    # Determine the save path for bombcell data
-    if save_path is None:
-        bombcell_path = Path(ks_dir) / "bombcell"
-    else:
-        bombcell_path = Path(save_path)
-    
     # Load raw waveforms if available
     raw_waveforms = None
     raw_wf_path = bombcell_path / "templates._bc_rawWaveforms.npy"
@@ -3663,7 +4031,8 @@ def load_metrics_for_gui(ks_dir, quality_metrics, ephys_properties=None, param=N
 
 
 def unit_quality_gui(ephys_data_or_path=None, quality_metrics=None, ephys_properties=None, 
-                     unit_types=None, param=None, ks_dir=None, save_path=None, layout='landscape', auto_advance=True):
+                     unit_types=None, param=None, ks_dir=None, save_path=None, layout='landscape', auto_advance=True,
+                     n_prefetch_units=5, unit_cache_mb=512, render_mode='persistent'):
     """
     Launch the Unit Quality GUI - Python equivalent of unitQualityGUI_synced
     
@@ -3686,6 +4055,16 @@ def unit_quality_gui(ephys_data_or_path=None, quality_metrics=None, ephys_proper
     auto_advance : bool, optional
         Whether to automatically advance to next unit after manual classification
         Default: True
+    n_prefetch_units : int, optional
+        Number of units prepared in the background ahead of the current unit, 0 to disable
+        Default: 5
+    unit_cache_mb : float, optional
+        Memory bound of the per-unit data cache
+        Default: 512
+    render_mode : str, optional
+        'persistent' to build the figure once and only update the unit panels, 'rebuild' for a new
+        figure per unit
+        Default: 'persistent'
         
     Returns
     -------
@@ -3734,5 +4113,205 @@ def unit_quality_gui(ephys_data_or_path=None, quality_metrics=None, ephys_proper
         save_path=save_path,
         layout=layout,
         auto_advance=auto_advance,
+        n_prefetch_units=n_prefetch_units,
+        unit_cache_mb=unit_cache_mb,
+        render_mode=render_mode,
+    )
+    return gui
+
+# names of the bombcell (0-4) and manual (-1: not classified yet) unit types in the export index
+UNIT_TYPE_NAMES = {-1: "Unclassified", 0: "Noise", 1: "Good", 2: "MUA", 3: "Non-somatic", 4: "Non-somatic MUA"}
+
+
+def export_unit_panels(ks_dir, quality_metrics, param, unit_types=None, save_path=None, export_path=None,
+                       image_format='png', dpi=50, n_jobs=None):
+    """
+    Exports the unit quality GUI panels of every unit as images, to review units without a Python kernel.
+    The units are rendered headless (Agg) by a pool of worker processes, units whose inputs did not
+    change since the last export are skipped, and export_path/unit_panels_index.json maps each unit id
+    to its image and classifications
+
+    Parameters
+    ----------
+    ks_dir : str
+        Path to kilosort directory
+    quality_metrics : dict
+        Quality metrics from bombcell
+    param : dict
+        Parameters dictionary
+    unit_types : ndarray, optional
+        BombCell unit types, by default None (classified from quality_metrics with param)
+    save_path : str, optional
+        Path where bombcell data was saved (precomputed GUI data, raw waveforms, manual classifications),
+        by default ks_dir/bombcell
+    export_path : str, optional
+        Where the images and the index are saved, by default save_path/unit_panels
+    image_format : str, optional
+        The image format, e.g. 'png' or 'webp', by default 'png'
+    dpi : int, optional
+        The resolution of the (30 x 25 inch) images, by default 50
+    n_jobs : int, optional
+        The number of worker processes, -1 for all cores, by default param['nJobs']
+
+    Returns
+    -------
+    index : dict
+        The content of the index file
+    """
+    import contextlib
+    import io
+    import json
+    from joblib import Parallel, delayed, cpu_count
+    from tqdm.auto import tqdm
+
+    if save_path is None:
+        save_path = Path(ks_dir) / "bombcell"
+    export_path = Path(save_path) / "unit_panels" if export_path is None else Path(export_path)
+    export_path.mkdir(parents=True, exist_ok=True)
+    if n_jobs is None:
+        n_jobs = param.get("nJobs", 1)
+
+    # the index maps every unit to its classification, so classify the units if no types are given
+    if unit_types is None:
+        from bombcell.quality_metrics import get_quality_unit_type
+        unit_types, _ = get_quality_unit_type(param, quality_metrics)
+
+    # as done by the histograms panel, so every unit is plotted and keyed with the same metrics
+    from bombcell.helper_functions import clean_inf_values
+    quality_metrics = clean_inf_values(quality_metrics)
+
+    # the data of all units are loaded once and shared with the workers, with the precomputed
+    # GUI data store opened again by each worker
+    with contextlib.redirect_stdout(io.StringIO()):
+        gui_inputs = load_metrics_for_gui(ks_dir, quality_metrics, param=param, save_path=save_path)
+        gui = InteractiveUnitQualityGUI(
+            ephys_data=gui_inputs['ephys_data'],
+            quality_metrics=quality_metrics,
+            raw_waveforms=gui_inputs['raw_waveforms'],
+            param=gui_inputs['param'],
+            unit_types=unit_types,
+            save_path=save_path,
+            n_prefetch_units=0,
+            headless=True,
+        )
+    gui_data = gui.gui_data.store_path if hasattr(gui.gui_data, 'store_path') else gui.gui_data
+
+    # the histograms show all units, so everything they depend on is part of each unit's key
+    common_key = get_stage_cache_key(
+        "unit_panels", quality_metrics, gui.param, gui.raw_waveforms, unit_types, image_format, dpi
     )
-    return gui
\ No newline at end of file
+    index_file = export_path / "unit_panels_index.json"
+    previous_keys = {}
+    if index_file.exists():
+        try:
+            with open(index_file, "r") as f:
+                previous_keys = {unit["unit_id"]: unit["key"] for unit in json.load(f)["units"]}
+        except Exception as e:
+            print(f"Warning: could not read the previous export index, exporting all units: {e}")
+
+    unit_idxs = np.arange(gui.n_units)
+    batch_args = (
+        gui.ephys_data, quality_metrics, gui.raw_waveforms, gui.param, unit_types, gui_data,
+        gui.spike_index, export_path, image_format, dpi, common_key, previous_keys,
+    )
+    bar_description = "Exporting unit panels: {percentage:3.0f}%|{bar:10}| {n}/{total} unit batches"
+    if n_jobs is None or n_jobs == 1 or len(unit_idxs) == 0:
+        batch_results = [_export_unit_batch(unit_idxs, *batch_args)]
+    else:
+        # each batch builds its figure once, then only replaces the unit panels
+        n_workers = cpu_count() if n_jobs < 0 else n_jobs
+        unit_batches = np.array_split(unit_idxs, min(len(unit_idxs), n_workers * 2))
+        batch_results = Parallel(n_jobs=n_jobs, mmap_mode="r", max_nbytes="1M")(
+            delayed(_export_unit_batch)(unit_batch, *batch_args)
+            for unit_batch in tqdm(unit_batches, bar_format=bar_description)
+        )
+    unit_results = [result for batch in batch_results for result in batch]
+
+    units = []
+    bombcell_types = gui.bombcell_unit_types
+    for unit_idx, image_name, unit_key, _ in unit_results:
+        bombcell_type = int(bombcell_types[unit_idx]) if bombcell_types is not None else -1
+        manual_type = int(gui.manual_unit_types[unit_idx])
+        units.append({
+            "unit_id": int(gui.unique_units[unit_idx]),
+            "image": image_name,
+            "bombcell_type": bombcell_type,
+            "bombcell_type_name": UNIT_TYPE_NAMES.get(bombcell_type, "Unknown"),
+            "manual_type": manual_type,
+            "manual_type_name": UNIT_TYPE_NAMES.get(manual_type, "Unknown"),
+            "key": unit_key,
+        })
+    index = {"image_format": image_format, "dpi": dpi, "units": units}
+    with open(index_file, "w") as f:
+        json.dump(index, f, indent=1)
+
+    n_rendered = sum(result[3] for result in unit_results)
+    print(f"Exported {n_rendered} unit panels to {export_path}, {len(unit_results) - n_rendered} unchanged units skipped")
+    return index
+
+
+def _export_unit_batch(unit_idxs, ephys_data, quality_metrics, raw_waveforms, param, unit_types, gui_data,
+                       spike_index, export_path, image_format, dpi, common_key, previous_keys):
+    """
+    Renders the panels of a batch of units to images, used by the export_unit_panels workers
+
+    Returns
+    -------
+    unit_results : list
+        (unit index, image name, unit key, whether the image was rendered) for each unit
+    """
+    import contextlib
+    import io
+
+    if isinstance(gui_data, (str, Path)):
+        gui_data = load_gui_data_store(gui_data)
+    with contextlib.redirect_stdout(io.StringIO()):
+        gui = InteractiveUnitQualityGUI(
+            ephys_data=ephys_data,
+            quality_metrics=quality_metrics,
+            raw_waveforms=raw_waveforms,
+            param=param,
+            unit_types=unit_types,
+            gui_data=gui_data,
+            n_prefetch_units=0,
+            spike_index=spike_index,
+            headless=True,
+        )
+
+    unit_results = []
+    for unit_idx in unit_idxs:
+        unit_data = gui.get_unit_data(unit_idx)
+        unit_id = int(unit_data['unit_id'])
+        unit_gui_data = {}
+        if hasattr(gui_data, 'get_unit'):
+            try:
+                unit_gui_data = gui_data.get_unit(unit_id)
+            except KeyError:
+                pass
+        elif gui_data:
+            unit_gui_data = {
+                field: values[unit_id] for field, values in gui_data.items()
+                if isinstance(values, dict) and unit_id in values
+            }
+        # memmapped (parallel workers) and in-memory arrays hash the same
+        unit_key = get_stage_cache_key(
+            common_key,
+            *[None if unit_data[k] is None else np.asarray(unit_data[k]) for k in ('spike_times', 'amplitudes', 'template')],
+            {k: np.asarray(v) if isinstance(v, np.ndarray) else v for k, v in unit_data['metrics'].items()},
+            unit_gui_data,
+        )
+        image_name = f"unit_{unit_id}.{image_format}"
+        if previous_keys.get(unit_id) == unit_key and (Path(export_path) / image_name).exists():
+            unit_results.append((unit_idx, image_name, unit_key, False))
+            continue
+
+        # the histograms mark the current unit
+        gui.current_unit_idx = unit_idx
+        with contextlib.redirect_stdout(io.StringIO()):
+            gui._plot_unit_persistent(unit_data)
+        gui._persistent_figure.savefig(Path(export_path) / image_name, format=image_format, dpi=dpi)
+        unit_results.append((unit_idx, image_name, unit_key, True))
+
+    gui._close_persistent_figure()
+    return unit_results
+
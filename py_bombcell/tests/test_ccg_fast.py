@@ -0,0 +1,60 @@
+import numpy as np
+
+from bombcell.ccg_fast import acg, ccg_bz, compute_acg_store, get_store_acg
+
+
+def test_ccg_bz_parity():
+    """
+    Test that the compiled ccg_bz matches the pure Python reference, on the ccg_fast.test_ccg data
+    and on spikes placed exactly on the bin and window edges
+    """
+    np.random.seed(42)
+    times1 = np.sort(np.random.exponential(0.1, 100))
+    times2 = np.sort(np.random.exponential(0.15, 80)) + 0.002
+    times = np.concatenate([times1, times2])
+    groups = np.concatenate([np.ones(len(times1)), np.full(len(times2), 2)]).astype(np.uint32)
+
+    # delays of whole and half bins (1 ms bins at 20 kHz), up to the furthest edge of a 0.1 s window
+    edge_times = np.concatenate([[0.0], np.arange(1, 102) * 0.0005, [0.0505, 0.0505]])
+    edge_groups = np.resize(np.array([1, 2, 3], dtype=np.uint32), len(edge_times))
+
+    for test_times, test_groups in [(times, groups), (edge_times, edge_groups), ([times1, times2], None)]:
+        for bin_size, duration in [(0.001, 0.1), (0.0005, 0.05), (0.002, 1.0)]:
+            for norm in ['counts', 'rate']:
+                ccg_numba, t_numba = ccg_bz(test_times, test_groups, bin_size=bin_size, duration=duration, norm=norm)
+                ccg_python, t_python = ccg_bz(test_times, test_groups, bin_size=bin_size, duration=duration,
+                                              norm=norm, python_reference=True)
+                assert np.array_equal(t_numba, t_python)
+                assert np.array_equal(ccg_numba, ccg_python), \
+                    f"ccg_bz mismatch with bin_size={bin_size}, duration={duration}, norm={norm}"
+
+
+def test_acg_store_parity():
+    """
+    Test that compute_acg_store matches acg() for each unit and configuration, including units
+    with unsorted spikes, duplicate spike times, spikes exactly on bin edges and too few spikes
+    """
+    np.random.seed(42)
+    fs = 30000
+    spike_trains = [
+        np.sort(np.random.randint(0, 60 * fs, 2000)).astype(np.uint64),
+        np.random.randint(0, 10 * fs, 500).astype(np.uint64),  # unsorted
+        np.array([0, 0, 15, 30, 45, 450, 1500, 1515, 3000, 3015], dtype=np.uint64),  # duplicates and bin edges
+        np.array([100], dtype=np.uint64),
+        np.array([], dtype=np.uint64),
+    ]
+    unit_stops = np.cumsum([len(st) for st in spike_trains])
+    unit_starts = unit_stops - [len(st) for st in spike_trains]
+    bin_configs = [(0.5, 100), (1, 1000), (0.01, 1), (0.7, 33)]
+    acg_store = compute_acg_store(np.concatenate(spike_trains), unit_starts, unit_stops, bin_configs, fs)
+
+    for unit_row, spike_train in enumerate(spike_trains):
+        for cbin, cwin in bin_configs:
+            for normalize in ['counts', 'hertz', 'pearson', 'zscore']:
+                store_acg = get_store_acg(acg_store, unit_row, cbin, cwin, normalize)
+                if len(spike_train) < 2:
+                    assert not np.any(store_acg)
+                    continue
+                reference_acg = acg(spike_train, cbin, cwin, fs, normalize, cache_results=False)
+                assert np.array_equal(store_acg, reference_acg), \
+                    f"compute_acg_store mismatch for unit {unit_row}, cbin={cbin}, cwin={cwin}, normalize={normalize}"
@@ -0,0 +1,123 @@
+"""
+Checks that units keep the same raw amplitude, signal to noise ratio and raw peak channel when their
+cluster ids become sparse after manual curation, as after a split or merge in Phy (so a unit's row no
+longer matches its cluster id)
+"""
+import copy
+import os
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import numpy as np
+import pytest
+
+import bombcell as bc
+
+N_CHANNELS = 32
+N_TEMPLATES = 8
+SPIKE_WIDTH = 82
+SAMPLE_RATE = 30000
+DURATION_S = 20
+
+
+@pytest.fixture(scope="module")
+def ks_dir(tmp_path_factory):
+    """A small Kilosort 2 directory, with its raw data, made of noise and template spikes"""
+    ks_dir = tmp_path_factory.mktemp("kilosort")
+    rng = np.random.default_rng(0)
+
+    # a trough then a peak, largest on a different channel for each template
+    samples = np.arange(SPIKE_WIDTH)
+    waveform = -np.exp(-((samples - 41) ** 2) / 8) + 0.4 * np.exp(-((samples - 50) ** 2) / 20)
+    peak_channels = np.linspace(2, N_CHANNELS - 3, N_TEMPLATES).astype(int)
+    channel_decay = np.exp(-np.abs(np.arange(N_CHANNELS)[None, :] - peak_channels[:, None]) / 2)
+    templates = (waveform[None, :, None] * channel_decay[:, None, :]).astype(np.float32)
+
+    n_samples = DURATION_S * SAMPLE_RATE
+    spike_times, spike_templates = [], []
+    for template_id in range(N_TEMPLATES):
+        n_spikes = rng.integers(300, 900)
+        times = np.sort(rng.choice(np.arange(SPIKE_WIDTH, n_samples - SPIKE_WIDTH, 100), n_spikes, replace=False))
+        spike_times.append(times)
+        spike_templates.append(np.full(n_spikes, template_id))
+    spike_times = np.concatenate(spike_times)
+    spike_templates = np.concatenate(spike_templates)
+    order = np.argsort(spike_times, kind="stable")
+    spike_times = spike_times[order]
+    spike_templates = spike_templates[order]
+    n_spikes = spike_times.size
+
+    np.save(ks_dir / "spike_times.npy", spike_times.astype(np.uint64)[:, None])
+    np.save(ks_dir / "spike_templates.npy", spike_templates.astype(np.uint32))
+    np.save(ks_dir / "spike_clusters.npy", spike_templates.astype(np.int32))
+    np.save(ks_dir / "amplitudes.npy", rng.normal(20, 2, n_spikes).astype(np.float32))
+    np.save(ks_dir / "templates.npy", templates)
+    np.save(ks_dir / "whitening_mat_inv.npy", np.eye(N_CHANNELS))
+    np.save(ks_dir / "channel_map.npy", np.arange(N_CHANNELS, dtype=np.int32))
+    channel_positions = np.stack([np.tile([0, 32], N_CHANNELS // 2), 20 * (np.arange(N_CHANNELS) // 2)], axis=1)
+    np.save(ks_dir / "channel_positions.npy", channel_positions.astype(float))
+    pc_feature_ind = np.clip(peak_channels[:, None] + np.arange(-4, 4)[None, :], 0, N_CHANNELS - 1)
+    np.save(ks_dir / "pc_feature_ind.npy", pc_feature_ind.astype(np.uint32))
+    np.save(ks_dir / "pc_features.npy", rng.normal(0, 1, (n_spikes, 3, 8)).astype(np.float32))
+
+    # raw data with one sync channel
+    raw = rng.normal(0, 10, (n_samples, N_CHANNELS + 1))
+    for spike_time, template_id in zip(spike_times, spike_templates):
+        raw[spike_time - 41 : spike_time + 41, :N_CHANNELS] += 100 * templates[template_id]
+    raw.astype(np.int16).tofile(ks_dir / "raw.ap.bin")
+
+    return ks_dir
+
+
+def _run_bombcell(ks_dir, run_dir, spike_clusters):
+    """Runs bombcell on a copy of ks_dir with the given spike_clusters"""
+    run_ks_dir = run_dir / "kilosort"
+    run_ks_dir.mkdir(parents=True)
+    for file_path in ks_dir.glob("*.npy"):
+        if file_path.name != "spike_clusters.npy":
+            os.symlink(file_path.resolve(), run_ks_dir / file_path.name)
+    np.save(run_ks_dir / "spike_clusters.npy", spike_clusters.astype(np.int32))
+
+    param = bc.get_default_parameters(
+        str(run_ks_dir), raw_file=str(ks_dir / "raw.ap.bin"), kilosort_version=2, gain_to_uV=2.34
+    )
+    param["plotGlobal"] = False
+    param["verbose"] = False
+    param["nChannels"] = N_CHANNELS + 1
+    param["nSyncChannels"] = 1
+    param["presenceRatioBinSize"] = 5
+    param["driftBinSize"] = 5
+    param["reextractRaw"] = True
+
+    save_path = run_dir / "bombcell"
+    quality_metrics, _, _, _ = bc.run_bombcell(str(run_ks_dir), str(save_path), copy.deepcopy(param))
+    return (
+        np.asarray(quality_metrics["phy_clusterID"]).astype(int),
+        {
+            "rawAmplitude": np.asarray(quality_metrics["rawAmplitude"], dtype=float),
+            "signalToNoiseRatio": np.asarray(quality_metrics["signalToNoiseRatio"], dtype=float),
+            "rawWaveformPeakChannel": np.load(save_path / "templates._bc_rawWaveformPeakChannels.npy").astype(float),
+        },
+    )
+
+
+def test_curated_cluster_ids(ks_dir, tmp_path):
+    spike_templates = np.load(ks_dir / "spike_templates.npy").astype(int)
+    template_ids = np.unique(spike_templates)
+
+    # relabel every other template from the fourth one, with ids far above the largest template id
+    relabelled = template_ids[3::2]
+    curated_ids = np.arange(template_ids.max() + 1)
+    curated_ids[relabelled] = template_ids.max() + 100 * np.arange(1, relabelled.size + 1)
+
+    plain_unit_ids, plain_values = _run_bombcell(ks_dir, tmp_path / "plain_ids", spike_templates)
+    curated_unit_ids, curated_values = _run_bombcell(ks_dir, tmp_path / "curated_ids", curated_ids[spike_templates])
+
+    # compare each unit with the same unit of the plain run, where its cluster id is its template id
+    template_of_id = dict(zip(curated_ids, np.arange(curated_ids.size)))
+    plain_rows = np.searchsorted(plain_unit_ids, [template_of_id[cid] for cid in curated_unit_ids])
+    assert np.array_equal(plain_unit_ids[plain_rows], [template_of_id[cid] for cid in curated_unit_ids])
+    for name in plain_values:
+        np.testing.assert_allclose(curated_values[name], plain_values[name][plain_rows], err_msg=name)